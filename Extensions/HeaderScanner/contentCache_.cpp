@@ -2,6 +2,7 @@
 #include "contentCache_.hpp"
 
 #include "headerCache_.hpp"
+#include "profile_.hpp"
 #include "utility_.hpp"
 
 #include <memory>
@@ -23,25 +24,46 @@ llvm::ErrorOr<clang::vfs::Status> ContentCache::status( llvm::Twine const & path
 
 llvm::ErrorOr<ContentEntryPtr> ContentCache::addNewEntry( llvm::Twine const & path )
 {
+    // Remember generation before reading the file, so that a change done
+    // while reading is caught in the next generation.
+    std::size_t const currentGeneration( generation() );
     llvm::ErrorOr<ContentEntryPtr> newPtrE = ContentEntry::create( path );
     if ( std::error_code ec = newPtrE.getError() )
         return ec;
 
     ContentEntryPtr const & newPtr = newPtrE.get();
+    newPtr->generation = currentGeneration;
 
+    ProfileScope lockWait( ProfilePhase::contentLockWait );
     boost::upgrade_lock<boost::shared_mutex> upgradeLock( contentMutex_ );
+    lockWait.stop();
     auto iter = content_.get<ByName>().find( path.str() );
     if ( iter != content_.get<ByName>().end() )
         return *iter;
 
+    ProfileScope upgradeWait( ProfilePhase::contentLockWait );
     boost::upgrade_to_unique_lock<boost::shared_mutex> const exclusiveLock( upgradeLock );
+    upgradeWait.stop();
     content_.push_front( newPtr );
     contentSize_ += newPtr->size();
-    unsigned int const maxContentCacheSize = 100 * 1024 * 1024;
-    while ( contentSize_ > maxContentCacheSize )
+    // Evicting a file which is still referenced (e.g. by a header cache
+    // entry) would not free any memory, so such files get a second
+    // chance, as in CLOCK. The number of skipped files is bounded, so that
+    // a cache full of referenced files does not make every insert O(n).
+    std::size_t const maxSkipped = 64;
+    std::size_t skipped = 0;
+    while ( ( contentSize_ > budget_ ) && ( skipped < maxSkipped ) &&
+        ( content_.size() > 1 ) )
     {
+        if ( content_.back()->referenced() )
+        {
+            content_.relocate( content_.begin(), --content_.end() );
+            ++skipped;
+            continue;
+        }
         contentSize_ -= content_.back()->size();
         content_.pop_back();
+        ++evictions_;
     }
     return newPtr;
 }
@@ -49,19 +71,84 @@ llvm::ErrorOr<ContentEntryPtr> ContentCache::addNewEntry( llvm::Twine const & pa
 llvm::ErrorOr<ContentEntryPtr> ContentCache::getOrCreate( llvm::Twine const & path )
 {
     typedef Content::index<ByName>::type ContentByName;
-    boost::shared_lock<boost::shared_mutex> readLock( contentMutex_ );
-    ContentByName & contentByName( content_.get<ByName>() );
-    ContentByName::const_iterator const iter( contentByName.find( path.str() ) );
-    if ( iter == contentByName.end() )
+    std::string const name( path.str() );
+    ContentEntryPtr result;
     {
-        readLock.unlock();
-        return addNewEntry( path );
+        ProfileScope lockWait( ProfilePhase::contentLockWait );
+        boost::shared_lock<boost::shared_mutex> const readLock( contentMutex_ );
+        lockWait.stop();
+        ContentByName & contentByName( content_.get<ByName>() );
+        ContentByName::const_iterator const iter( contentByName.find( name ) );
+        if ( iter != contentByName.end() )
+            result = *iter;
     }
-    readLock.unlock();
+    if ( !result )
+        return addNewEntry( name );
+
+    if ( !isUpToDate( *result ) )
+    {
+        remove( name, result.get() );
+        return addNewEntry( name );
+    }
+
+    ProfileScope lockWait( ProfilePhase::contentLockWait );
     boost::unique_lock<boost::shared_mutex> const exclusiveLock( contentMutex_ );
-    Content::iterator listIter = content_.project<0>( iter );
-    content_.splice( content_.begin(), content_, listIter );
-    return *iter;
+    lockWait.stop();
+    ContentByName & contentByName( content_.get<ByName>() );
+    ContentByName::iterator const iter( contentByName.find( name ) );
+    // Entry could have been removed while the lock was released.
+    if ( iter != contentByName.end() )
+        content_.splice( content_.begin(), content_, content_.project<0>( iter ) );
+    return result;
+}
+
+bool ContentCache::isUpToDate( ContentEntry & contentEntry )
+{
+    std::size_t const currentGeneration( generation() );
+    if ( contentEntry.generation == currentGeneration )
+        return true;
+
+    llvm::sys::fs::file_status fileStatus;
+    if ( llvm::sys::fs::status( contentEntry.status.getName(), fileStatus ) )
+        return false;
+    if
+    (
+        !( fileStatus.getUniqueID() == contentEntry.status.getUniqueID() ) ||
+        !( fileStatus.getLastModificationTime() == contentEntry.status.getLastModificationTime() )
+    )
+        return false;
+    contentEntry.generation = currentGeneration;
+    return true;
+}
+
+bool ContentCache::invalidate( llvm::Twine const & path )
+{
+    return remove( path.str(), 0 );
+}
+
+bool ContentCache::remove( llvm::StringRef path, ContentEntry const * expected )
+{
+    typedef Content::index<ByName>::type ContentByName;
+    ContentEntryPtr removed;
+    {
+        ProfileScope lockWait( ProfilePhase::contentLockWait );
+        boost::unique_lock<boost::shared_mutex> const exclusiveLock( contentMutex_ );
+        lockWait.stop();
+        ContentByName & contentByName( content_.get<ByName>() );
+        ContentByName::iterator const iter( contentByName.find( path ) );
+        if ( iter == contentByName.end() )
+            return false;
+        // Someone else already replaced the entry.
+        if ( expected && ( iter->get() != expected ) )
+            return false;
+        removed = *iter;
+        contentSize_ -= removed->size();
+        contentByName.erase( iter );
+    }
+    ++invalidated_;
+    // Notify outside of the lock, listeners might need content cache.
+    contentChanged_( *removed );
+    return true;
 }
 
 
@@ -152,7 +152,10 @@ public:
         >
     > Content;
 
-    ContentCache() : contentSize_( 0 ) {}
+    ContentCache() :
+        contentSize_( 0 ), budget_( 100 * 1024 * 1024 ), evictions_( 0 ),
+        generation_( 1 ), invalidated_( 0 )
+    {}
 
     llvm::ErrorOr<ContentEntryPtr> getOrCreate( llvm::Twine const & path );
 
@@ -163,6 +166,28 @@ public:
         contentSize_ = 0;
     }
 
+    // Files are checked for changes (by comparing their unique id and
+    // modification time) at most once per generation. Starting a new
+    // generation makes sure that changes done so far will be noticed.
+    std::size_t generation() const { return generation_.load( std::memory_order_relaxed ); }
+    void nextGeneration() { generation_.fetch_add( 1, std::memory_order_relaxed ); }
+
+    // Check whether content entry still matches the file on disk.
+    bool isUpToDate( ContentEntry & );
+
+    // Remove file content from the cache, and notify everyone depending on
+    // it. To be called by file change notification mechanisms.
+    bool invalidate( llvm::Twine const & path );
+
+    std::size_t invalidated() const { return invalidated_; }
+
+    // Least recently used unreferenced files are evicted when total size
+    // of cached files exceeds the budget.
+    std::size_t budget() const { return budget_; }
+    void setBudget( std::size_t budget ) { budget_ = budget; }
+    std::size_t size() const { return contentSize_; }
+    std::size_t evictions() const { return evictions_; }
+
     template <typename F>
     boost::signals2::connection registerFileChangedCallback( F & f )
     {
@@ -171,6 +196,7 @@ public:
 
 private:
     llvm::ErrorOr<ContentEntryPtr> addNewEntry( llvm::Twine const & path );
+    bool remove( llvm::StringRef path, ContentEntry const * );
 
     std::error_code openFileForRead( llvm::Twine const & path, std::unique_ptr<clang::vfs::File> & result ) override
     {
@@ -202,7 +228,11 @@ public:
 private:
     mutable boost::shared_mutex contentMutex_;
     Content content_;
-    std::size_t contentSize_;
+    std::atomic<std::size_t> contentSize_;
+    std::atomic<std::size_t> budget_;
+    std::atomic<std::size_t> evictions_;
+    std::atomic<std::size_t> generation_;
+    std::atomic<std::size_t> invalidated_;
     boost::signals2::signal<void ( ContentEntry const & )> contentChanged_;
 };
 
@@ -1,8 +1,10 @@
 #include "contentEntry_.hpp"
+#include "profile_.hpp"
 
 #include <llvm/Support/MemoryBuffer.h>
 
 #include <codecvt>
+#include <cstring>
 
 #if defined(_MSC_VER) || defined(__MINGW32__)
 // needed for ::close()
@@ -111,10 +113,46 @@ namespace
         > converter;
         std::string utf8( converter.to_bytes( &input[0], &input[0] + input.size() ) );
         utf8.push_back('\0');
+        delete pMemoryBuffer;
         pMemoryBuffer = llvm::MemoryBuffer::getMemBufferCopy( utf8, "" );
     }
 
 
+    // Mapping is off by default. Windows does not allow writing to a mapped
+    // file, and content cache keeps files mapped for a long time.
+    std::atomic<std::size_t> mapThreshold( 0 );
+
+
+    ////////////////////////////////////////////////////////////////////////////
+    //
+    // readFile()
+    // ----------
+    //
+    ////////////////////////////////////////////////////////////////////////////
+
+    llvm::ErrorOr<llvm::MemoryBuffer *> readFile( int fd, std::string const & name, std::size_t size )
+    {
+        // Single allocation, null terminated.
+        std::unique_ptr<llvm::MemoryBuffer> buffer( llvm::MemoryBuffer::getNewUninitMemBuffer( size, name ) );
+        char * data = const_cast<char *>( buffer->getBufferStart() );
+        std::size_t bytesRead = 0;
+        while ( bytesRead < size )
+        {
+            int const result = ::_read( fd, data + bytesRead, static_cast<unsigned int>( size - bytesRead ) );
+            if ( result < 0 )
+                return std::error_code( errno, std::generic_category() );
+            if ( result == 0 )
+            {
+                // File got shorter while reading.
+                std::memset( data + bytesRead, 0, size - bytesRead );
+                break;
+            }
+            bytesRead += result;
+        }
+        return buffer.release();
+    }
+
+
     ////////////////////////////////////////////////////////////////////////////
     //
     // openFile()
@@ -151,13 +189,29 @@ namespace
             if ( std::error_code ec = llvm::sys::fs::status( fd, fstat ) )
                 return ec;
             name = path.str();
-            llvm::ErrorOr<std::unique_ptr<llvm::MemoryBuffer> > openFile = llvm::MemoryBuffer::getOpenFile( fd, name.c_str(), fstat.getSize(), false, false );
-            if ( std::error_code error = openFile.getError() )
-                return error;
+            std::size_t const fileSize( static_cast<std::size_t>( fstat.getSize() ) );
+            std::size_t const threshold( mapThreshold );
+            if ( threshold && ( fileSize >= threshold ) )
+            {
+                // Requiring null terminator makes LLVM read the file instead
+                // if it ends exactly on a page boundary.
+                llvm::ErrorOr<std::unique_ptr<llvm::MemoryBuffer> > openFile = llvm::MemoryBuffer::getOpenFile( fd, name.c_str(), fileSize, true, false );
+                if ( std::error_code error = openFile.getError() )
+                    return error;
+                buf = openFile.get().release();
+            }
+            else
+            {
+                llvm::ErrorOr<llvm::MemoryBuffer *> readResult = readFile( fd, name, fileSize );
+                if ( std::error_code error = readResult.getError() )
+                    return error;
+                buf = readResult.get();
+            }
             if ( std::error_code error = closeFileGuard.close() )
+            {
+                delete buf;
                 return error;
-
-            buf = openFile.get().release();
+            }
         }
 
         convertEncodingIfNeeded( buf );
@@ -183,6 +237,7 @@ namespace
 
 llvm::ErrorOr<ContentEntryPtr> ContentEntry::create( llvm::Twine const & path )
 {
+    ProfileScope const fileRead( ProfilePhase::fileRead );
     llvm::ErrorOr<OpenFileResult> openResult( openFile( path ) );
     if ( std::error_code ec = openResult.getError() )
         return ec;
@@ -190,8 +245,30 @@ llvm::ErrorOr<ContentEntryPtr> ContentEntry::create( llvm::Twine const & path )
     return ContentEntryPtr( new ContentEntry( openResult.get().first, openResult.get().second ) );
 }
 
+std::size_t ContentEntry::mapThreshold()
+{
+    return ::mapThreshold;
+}
+
+void ContentEntry::setMapThreshold( std::size_t threshold )
+{
+    ::mapThreshold = threshold;
+}
+
 ContentEntry::ContentEntry( llvm::MemoryBuffer * b, clang::vfs::Status const & stat )
     :
-    refCount_( 0 ), buffer( b ), checksum( adler32( b ) ), status( stat )
+    refCount_( 0 ), checksumDone_( false ), checksum_( 0 ), buffer( b ),
+    status( stat ), generation( 0 )
+{
+}
+
+std::size_t ContentEntry::checksum() const
 {
+    if ( checksumDone_.load( std::memory_order_acquire ) )
+        return checksum_.load( std::memory_order_relaxed );
+    // Concurrent first calls calculate the same value.
+    std::size_t const result( adler32( buffer.get() ) );
+    checksum_.store( result, std::memory_order_relaxed );
+    checksumDone_.store( true, std::memory_order_release );
+    return result;
 }
@@ -24,16 +24,31 @@ private:
 public:
     static llvm::ErrorOr<ContentEntryPtr> create( llvm::Twine const & path );
 
+    // Files at least this big are memory mapped, smaller ones are read
+    // with a single read. Zero disables mapping.
+    static std::size_t mapThreshold();
+    static void setMapThreshold( std::size_t );
+
     std::size_t const size() const { return buffer->getBufferSize(); }
 
+    // Whether anyone other than the content cache holds this entry.
+    bool referenced() const { return refCount_.load( std::memory_order_relaxed ) > 1; }
+
+    // Calculated on first use, most files are never shipped to a server.
+    std::size_t checksum() const;
+
     std::unique_ptr<llvm::MemoryBuffer> buffer;
-    std::size_t checksum;
     clang::vfs::Status status;
+    // Last content cache generation in which the file was known to be
+    // unchanged.
+    std::atomic<std::size_t> generation;
 
 private:
     explicit ContentEntry( llvm::MemoryBuffer *, clang::vfs::Status const & );
 
     mutable std::atomic<size_t> refCount_;
+    mutable std::atomic<bool> checksumDone_;
+    mutable std::atomic<std::size_t> checksum_;
 
     friend void intrusive_ptr_add_ref( ContentEntry * );
     friend void intrusive_ptr_release( ContentEntry * );
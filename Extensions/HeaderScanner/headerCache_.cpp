@@ -2,11 +2,13 @@
 #include "contentCache_.hpp"
 #include "headerCache_.hpp"
 #include "headerTracker_.hpp"
+#include "profile_.hpp"
 
 #include <clang/Lex/Preprocessor.h>
 
 #include <boost/spirit/include/karma.hpp>
 
+#include <cstdint>
 #include <fstream>
 #include <functional>
 //------------------------------------------------------------------------------
@@ -23,11 +25,12 @@ clang::FileEntry const * CacheEntry::getFileEntry(
 
 CacheEntryPtr CacheTree::find( MacroState const & macroState ) const
 {
+    ProfileScope const cacheLookup( ProfilePhase::cacheLookup );
     CacheTree const * currentTree = this;
     while ( currentTree )
     {
         if ( currentTree->entry_ )
-            return currentTree->entry_;
+            return currentTree->entry_->stale() ? CacheEntryPtr() : CacheEntryPtr( currentTree->entry_ );
         CacheTree::Children::const_iterator const iter = currentTree->children_.find(
             macroState.getMacroValue( currentTree->macroName_ ) );
         if ( iter == currentTree->children_.end() )
@@ -37,6 +40,11 @@ CacheEntryPtr CacheTree::find( MacroState const & macroState ) const
     return CacheEntryPtr();
 }
 
+UsedMacros CacheEntry::usedMacros() const
+{
+    return tree_.getPath();
+}
+
 llvm::MemoryBuffer * CacheEntry::cachedContent()
 {
     if ( !memoryBuffer_ )
@@ -70,6 +78,7 @@ llvm::MemoryBuffer * CacheEntry::cachedContent()
 
 void CacheEntry::generateContent( std::string & buffer )
 {
+    ProfileScope const generateContent( ProfilePhase::generateContent );
     llvm::raw_string_ostream defineStream( buffer );
     macroState().forEachMacro(
         [&]( Macro const & macro )
@@ -85,23 +94,57 @@ void CacheEntry::generateContent( std::string & buffer )
 CacheEntry::CacheEntry
 (
     CacheTree & tree,
+    FileId const & fileId,
+    std::size_t searchPathId,
+    ContentEntryPtr const & contentEntry,
     std::string const & uniqueVirtualFileName,
     MacroState && macroState,
     Headers && headers,
     std::size_t currentTime
 ) :
     tree_( tree ),
+    fileId_( fileId ),
+    searchPathId_( searchPathId ),
+    contentEntry_( contentEntry ),
     refCount_( 0 ),
     fileName_( uniqueVirtualFileName ),
     macroState_( std::move( macroState ) ),
     headers_( std::move( headers ) ),
-    lastTimeHit_( currentTime )
+    lastTimeHit_( currentTime ),
+    generation_( 0 ),
+    stale_( false )
 {
     contentLock_.clear();
+    // Rough estimate - set and map nodes are counted as four pointers, and
+    // each macro adds a line to the generated content.
+    memorySize_ = sizeof( CacheEntry ) + fileName_.size() +
+        headers_.size() * ( sizeof( Header ) + 4 * sizeof( void * ) );
+    macroState_.forEachMacro( [this]( Macro const & macro )
+    {
+        memorySize_ += sizeof( Macro ) + 4 * sizeof( void * ) +
+            macro.first.get().size() + macro.second.get().size() + 10;
+    });
+}
+
+bool CacheEntry::isUpToDate( ContentCache & contentCache )
+{
+    std::size_t const currentGeneration( contentCache.generation() );
+    if ( generation_ == currentGeneration )
+        return true;
+    if ( contentEntry_ && !contentCache.isUpToDate( *contentEntry_ ) )
+        return false;
+    for ( Header const & header : headers_ )
+    {
+        if ( !contentCache.isUpToDate( *header.contentEntry ) )
+            return false;
+    }
+    generation_ = currentGeneration;
+    return true;
 }
 
 Cache::Cache() :
-    counter_( 0 ), hits_( 0 ), misses_( 0 ),
+    counter_( 0 ), hits_( 0 ), misses_( 0 ), memoryBudget_( 0 ),
+    memoryUsage_( 0 ), evictions_( 0 ), snapshotPending_( false ),
     conn_
     (
         ContentCache::singleton().registerFileChangedCallback
@@ -116,6 +159,7 @@ CacheEntryPtr Cache::addEntry
 (
     llvm::sys::fs::UniqueID const & fileId,
     std::size_t searchPathId,
+    ContentEntryPtr const & contentEntry,
     IndexedUsedMacros const & usedMacros,
     MacroState && macroState,
     Headers && headers
@@ -127,12 +171,19 @@ CacheEntryPtr Cache::addEntry
         usedMacros ) );
     CacheEntry * entry = cacheTree.getEntry();
     if ( entry )
-        return CacheEntryPtr( entry );
+    {
+        // Stale entry is still being used, so it cannot be replaced yet.
+        // Caller keeps its headers and macros.
+        return entry->stale() ? CacheEntryPtr() : CacheEntryPtr( entry );
+    }
     CacheEntryPtr result = CacheEntryPtr
     (
         new CacheEntry
         (
             cacheTree,
+            fileId,
+            searchPathId,
+            contentEntry,
             uniqueFileName(),
             std::move( macroState ),
             std::move( headers ),
@@ -142,6 +193,7 @@ CacheEntryPtr Cache::addEntry
     boost::upgrade_to_unique_lock<boost::shared_mutex> lock( upgradeLock );
     cacheTree.setEntry( result.get() );
     cacheEntries_.insert( result );
+    memoryUsage_ += result->memorySize();
     return result;
 }
 
@@ -159,7 +211,9 @@ void Cache::maintenance()
 {
     unsigned int const cacheCleanupPeriod = 1024 * 2;
     unsigned int const currentTime = hits_ + misses_;
-    if ( currentTime % cacheCleanupPeriod )
+    std::size_t const budget( memoryBudget_ );
+    bool const overBudget( budget && ( memoryUsage_ > budget ) );
+    if ( ( currentTime % cacheCleanupPeriod ) && !overBudget )
         return;
 
     // Update hit counts.
@@ -189,7 +243,26 @@ void Cache::maintenance()
             : currentTime / 5
     );
     // Remove everything what was not hit since cutoffTime.
-    index.erase( index.begin(), index.lower_bound( cutoffTime ) );
+    IndexType::iterator const cutoff( index.lower_bound( cutoffTime ) );
+    for ( IndexType::iterator iter( index.begin() ); iter != cutoff; ++iter )
+    {
+        memoryUsage_ -= ( *iter )->memorySize();
+        ++evictions_;
+    }
+    index.erase( index.begin(), cutoff );
+
+    // Over budget, evict least recently hit entries. Evict a bit more than
+    // needed, so that this does not happen on every lookup.
+    if ( budget && ( memoryUsage_ > budget ) )
+    {
+        std::size_t const target( budget - budget / 10 );
+        while ( !index.empty() && ( memoryUsage_ > target ) )
+        {
+            memoryUsage_ -= ( *index.begin() )->memorySize();
+            index.erase( index.begin() );
+            ++evictions_;
+        }
+    }
 }
 
 void Cache::invalidate( ContentEntry const & contentEntry )
@@ -207,8 +280,33 @@ void Cache::invalidate( ContentEntry const & contentEntry )
     if ( entriesToRemove.empty() )
         return;
     boost::upgrade_to_unique_lock<boost::shared_mutex> const lock( upgradeLock );
+    boost::unique_lock<boost::mutex> tempLastTimeHitLock( tempLastTimeHitMutex_ );
     for ( CacheEntryPtr const * entry : entriesToRemove )
+    {
+        ( *entry )->setStale();
+        tempLastTimeHit_.erase( *entry );
+        memoryUsage_ -= ( *entry )->memorySize();
         cacheEntries_.erase( cacheEntries_.iterator_to( *entry ) );
+    }
+}
+
+void Cache::removeStaleEntry( CacheEntryPtr const & entry )
+{
+    boost::unique_lock<boost::shared_mutex> const lock( cacheMutex_ );
+    entry->setStale();
+    {
+        // Do not keep stale entries alive longer than needed.
+        boost::unique_lock<boost::mutex> tempLastTimeHitLock( tempLastTimeHitMutex_ );
+        tempLastTimeHit_.erase( entry );
+    }
+    typedef CacheEntries::index<ById>::type IndexByIdType;
+    IndexByIdType & indexById( cacheEntries_.get<ById>() );
+    IndexByIdType::iterator const iter = indexById.find( entry.get() );
+    if ( iter != indexById.end() )
+    {
+        memoryUsage_ -= entry->memorySize();
+        indexById.erase( iter );
+    }
 }
 
 CacheEntryPtr Cache::findEntry( llvm::sys::fs::UniqueID const & fileId,
@@ -221,6 +319,9 @@ CacheEntryPtr Cache::findEntry( llvm::sys::fs::UniqueID const & fileId,
         ~CacheMaintenance() { cache_.maintenance(); }
     } maintenanceGuard( *this );
 
+    if ( snapshotPending_ )
+        restoreFromSnapshot( fileId, searchPathId );
+
     CacheEntryPtr result;
     {
         boost::shared_lock<boost::shared_mutex> const lock( cacheMutex_ );
@@ -233,6 +334,11 @@ CacheEntryPtr Cache::findEntry( llvm::sys::fs::UniqueID const & fileId,
         }
         result = iter->second.find( macroState );
     }
+    if ( result && !result->isUpToDate( ContentCache::singleton() ) )
+    {
+        removeStaleEntry( result );
+        result.reset();
+    }
     if ( result )
     {
         boost::unique_lock<boost::mutex> tempLastTimeHitLock( tempLastTimeHitMutex_ );
@@ -244,5 +350,409 @@ CacheEntryPtr Cache::findEntry( llvm::sys::fs::UniqueID const & fileId,
     return result;
 }
 
+namespace
+{
+    char const snapshotMagic[] = { 'B', 'P', 'H', 'C' };
+    std::uint32_t const snapshotVersion = 1;
+
+    template <typename T>
+    void writeValue( std::ostream & stream, T const value )
+    {
+        stream.write( reinterpret_cast<char const *>( &value ), sizeof(value) );
+    }
+
+    template <typename T>
+    bool readValue( std::istream & stream, T & value )
+    {
+        return stream.read( reinterpret_cast<char *>( &value ), sizeof(value) ).good();
+    }
+
+    void writeString( std::ostream & stream, llvm::StringRef const str )
+    {
+        writeValue<std::uint32_t>( stream, str.size() );
+        stream.write( str.data(), str.size() );
+    }
+
+    bool readString( std::istream & stream, std::string & str )
+    {
+        std::uint32_t size;
+        if ( !readValue( stream, size ) )
+            return false;
+        str.resize( size );
+        return !size || stream.read( &str[0], size ).good();
+    }
+
+    void writeMacros( std::ostream & stream, UsedMacros const & macros )
+    {
+        writeValue<std::uint32_t>( stream, macros.size() );
+        for ( Macro const & macro : macros )
+        {
+            writeString( stream, macro.first.get().str() );
+            writeString( stream, macro.second.get().str() );
+        }
+    }
+
+    bool readMacros( std::istream & stream, UsedMacros & macros )
+    {
+        std::uint32_t count;
+        if ( !readValue( stream, count ) )
+            return false;
+        std::string name;
+        std::string value;
+        for ( std::uint32_t index( 0 ); index < count; ++index )
+        {
+            if ( !readString( stream, name ) || !readString( stream, value ) )
+                return false;
+            macros.push_back( std::make_pair( MacroName( name ), MacroValue( value ) ) );
+        }
+        return true;
+    }
+
+    void writeFile( std::ostream & stream, SnapshotFile const & file )
+    {
+        writeString( stream, file.path );
+        writeValue<std::uint64_t>( stream, file.id.getDevice() );
+        writeValue<std::uint64_t>( stream, file.id.getFile() );
+        writeValue<std::int64_t>( stream, file.modified.seconds() );
+        writeValue<std::int32_t>( stream, file.modified.nanoseconds() );
+        writeValue<std::uint64_t>( stream, file.checksum );
+    }
+
+    bool readFile( std::istream & stream, SnapshotFile & file )
+    {
+        std::uint64_t device;
+        std::uint64_t fileIndex;
+        std::int64_t seconds;
+        std::int32_t nanoseconds;
+        std::uint64_t checksum;
+        if
+        (
+            !readString( stream, file.path ) ||
+            !readValue( stream, device ) ||
+            !readValue( stream, fileIndex ) ||
+            !readValue( stream, seconds ) ||
+            !readValue( stream, nanoseconds ) ||
+            !readValue( stream, checksum )
+        )
+            return false;
+        file.id = FileId( device, fileIndex );
+        file.modified = llvm::sys::TimeValue( seconds, nanoseconds );
+        file.checksum = static_cast<std::size_t>( checksum );
+        file.state = SnapshotFile::unknown;
+        return true;
+    }
+
+    // Files are shared by many cache entries, so they are stored only once,
+    // and referenced by index.
+    class SnapshotFileTable
+    {
+    public:
+        std::size_t add( SnapshotFile const & file )
+        {
+            // The same path can appear with different checksums if the file
+            // was changed while some cache entries still refer to the old
+            // content.
+            std::pair<Indices::iterator, bool> const insertResult( indices_.insert(
+                std::make_pair( std::make_pair( file.path, file.checksum ), files_.size() ) ) );
+            if ( insertResult.second )
+                files_.push_back( file );
+            return insertResult.first->second;
+        }
+
+        std::size_t add( ContentEntry const & contentEntry )
+        {
+            SnapshotFile const file =
+            {
+                contentEntry.status.getName().str(),
+                contentEntry.status.getUniqueID(),
+                contentEntry.status.getLastModificationTime(),
+                contentEntry.checksum(),
+                SnapshotFile::valid
+            };
+            return add( file );
+        }
+
+        std::vector<SnapshotFile> const & files() const { return files_; }
+
+    private:
+        typedef std::map<std::pair<std::string, std::size_t>, std::size_t> Indices;
+        Indices indices_;
+        std::vector<SnapshotFile> files_;
+    };
+}  // anonymous namespace
+
+std::size_t Cache::saveSnapshot( llvm::StringRef filename )
+{
+    SnapshotFileTable fileTable;
+    std::vector<SnapshotEntry> entries;
+    {
+        boost::shared_lock<boost::shared_mutex> const lock( cacheMutex_ );
+        for ( CacheEntryPtr const & cacheEntry : cacheEntries_ )
+        {
+            if ( !cacheEntry->contentEntry() )
+                continue;
+            SnapshotEntry entry;
+            entry.file = fileTable.add( *cacheEntry->contentEntry() );
+            entry.searchPathId = cacheEntry->searchPathId();
+            entry.usedMacros = cacheEntry->usedMacros();
+            cacheEntry->macroState().forEachMacro( [&]( Macro const & macro )
+            {
+                entry.changedMacros.push_back( macro );
+            });
+            for ( Header const & header : cacheEntry->headers() )
+            {
+                SnapshotHeader const snapshotHeader =
+                {
+                    header.dir,
+                    header.name,
+                    header.relative,
+                    fileTable.add( *header.contentEntry )
+                };
+                entry.headers.push_back( snapshotHeader );
+            }
+            entries.push_back( entry );
+        }
+    }
+
+    {
+        // Loaded entries which were not needed in this session are kept,
+        // unless they are already known to be stale.
+        boost::unique_lock<boost::mutex> const lock( snapshotMutex_ );
+        for ( SnapshotEntries::value_type const & pending : snapshotEntries_ )
+        {
+            for ( SnapshotEntry const & pendingEntry : pending.second )
+            {
+                SnapshotEntry entry( pendingEntry );
+                bool valid = snapshotFiles_[ entry.file ].state != SnapshotFile::invalid;
+                entry.file = fileTable.add( snapshotFiles_[ entry.file ] );
+                for ( SnapshotHeader & header : entry.headers )
+                {
+                    valid = valid && ( snapshotFiles_[ header.file ].state != SnapshotFile::invalid );
+                    header.file = fileTable.add( snapshotFiles_[ header.file ] );
+                }
+                if ( valid )
+                    entries.push_back( entry );
+            }
+        }
+    }
+
+    std::ofstream stream( filename.str().c_str(), std::ios::binary | std::ios::trunc );
+    if ( !stream )
+    {
+        std::string error( "Failed to create cache snapshot '" );
+        error.append( filename.str() );
+        error.append( "'." );
+        throw std::runtime_error( error );
+    }
+
+    stream.write( snapshotMagic, sizeof(snapshotMagic) );
+    writeValue( stream, snapshotVersion );
+    writeValue<std::uint32_t>( stream, sizeof(std::size_t) );
+    writeValue<std::uint64_t>( stream, fileTable.files().size() );
+    for ( SnapshotFile const & file : fileTable.files() )
+        writeFile( stream, file );
+    writeValue<std::uint64_t>( stream, entries.size() );
+    for ( SnapshotEntry const & entry : entries )
+    {
+        writeValue<std::uint64_t>( stream, entry.file );
+        writeValue<std::uint64_t>( stream, entry.searchPathId );
+        writeMacros( stream, entry.usedMacros );
+        writeMacros( stream, entry.changedMacros );
+        writeValue<std::uint32_t>( stream, entry.headers.size() );
+        for ( SnapshotHeader const & header : entry.headers )
+        {
+            writeString( stream, header.dir.get().str() );
+            writeString( stream, header.name.get().str() );
+            writeValue<std::uint8_t>( stream, header.relative ? 1 : 0 );
+            writeValue<std::uint64_t>( stream, header.file );
+        }
+    }
+    stream.close();
+    if ( stream.fail() )
+    {
+        std::string error( "Failed to write cache snapshot '" );
+        error.append( filename.str() );
+        error.append( "'." );
+        throw std::runtime_error( error );
+    }
+    return entries.size();
+}
+
+std::size_t Cache::loadSnapshot( llvm::StringRef filename )
+{
+    // A missing, stale or otherwise unusable snapshot is not an error, the
+    // cache is simply populated from scratch.
+    std::ifstream stream( filename.str().c_str(), std::ios::binary );
+    char magic[ sizeof(snapshotMagic) ];
+    std::uint32_t version;
+    std::uint32_t sizeOfSizeT;
+    if
+    (
+        !stream ||
+        !stream.read( magic, sizeof(magic) ) ||
+        !std::equal( magic, magic + sizeof(magic), snapshotMagic ) ||
+        !readValue( stream, version ) || ( version != snapshotVersion ) ||
+        !readValue( stream, sizeOfSizeT ) || ( sizeOfSizeT != sizeof(std::size_t) )
+    )
+        return 0;
+
+    SnapshotFiles files;
+    std::uint64_t fileCount;
+    if ( !readValue( stream, fileCount ) )
+        return 0;
+    for ( std::uint64_t fileIndex( 0 ); fileIndex < fileCount; ++fileIndex )
+    {
+        SnapshotFile file;
+        if ( !readFile( stream, file ) )
+            return 0;
+        files.push_back( file );
+    }
+
+    SnapshotEntries entries;
+    std::uint64_t entryCount;
+    if ( !readValue( stream, entryCount ) )
+        return 0;
+    for ( std::uint64_t entryIndex( 0 ); entryIndex < entryCount; ++entryIndex )
+    {
+        SnapshotEntry entry;
+        std::uint64_t file;
+        std::uint64_t searchPathId;
+        std::uint32_t headerCount;
+        if
+        (
+            !readValue( stream, file ) || ( file >= files.size() ) ||
+            !readValue( stream, searchPathId ) ||
+            !readMacros( stream, entry.usedMacros ) ||
+            !readMacros( stream, entry.changedMacros ) ||
+            !readValue( stream, headerCount )
+        )
+            return 0;
+        entry.file = static_cast<std::size_t>( file );
+        entry.searchPathId = static_cast<std::size_t>( searchPathId );
+
+        std::string dir;
+        std::string name;
+        for ( std::uint32_t headerIndex( 0 ); headerIndex < headerCount; ++headerIndex )
+        {
+            std::uint8_t relative;
+            std::uint64_t headerFile;
+            if
+            (
+                !readString( stream, dir ) ||
+                !readString( stream, name ) ||
+                !readValue( stream, relative ) ||
+                !readValue( stream, headerFile ) || ( headerFile >= files.size() )
+            )
+                return 0;
+            SnapshotHeader const header =
+            {
+                Dir( dir ),
+                HeaderName( name ),
+                relative != 0,
+                static_cast<std::size_t>( headerFile )
+            };
+            entry.headers.push_back( header );
+        }
+        entries[ std::make_pair( files[ entry.file ].id, entry.searchPathId ) ].push_back( entry );
+    }
+
+    boost::unique_lock<boost::mutex> const lock( snapshotMutex_ );
+    snapshotFiles_.swap( files );
+    snapshotEntries_.swap( entries );
+    snapshotStatistics_.loaded = static_cast<std::size_t>( entryCount );
+    snapshotPending_ = !snapshotEntries_.empty();
+    return static_cast<std::size_t>( entryCount );
+}
+
+void Cache::restoreFromSnapshot( FileId const & fileId, std::size_t searchPathId )
+{
+    std::vector<SnapshotEntry> entries;
+    {
+        boost::unique_lock<boost::mutex> const lock( snapshotMutex_ );
+        SnapshotEntries::iterator const iter = snapshotEntries_.find(
+            std::make_pair( fileId, searchPathId ) );
+        if ( iter == snapshotEntries_.end() )
+            return;
+        entries.swap( iter->second );
+        snapshotEntries_.erase( iter );
+        snapshotPending_ = !snapshotEntries_.empty();
+    }
+
+    for ( SnapshotEntry const & entry : entries )
+    {
+        ContentEntryPtr const contentEntry( validateSnapshotFile( entry.file ) );
+        bool valid = contentEntry.get() != 0;
+        Headers headers;
+        for ( SnapshotHeader const & snapshotHeader : entry.headers )
+        {
+            if ( !valid )
+                break;
+            Header const header =
+            {
+                snapshotHeader.dir,
+                snapshotHeader.name,
+                validateSnapshotFile( snapshotHeader.file ),
+                snapshotHeader.relative
+            };
+            valid = header.contentEntry.get() != 0;
+            headers.insert( header );
+        }
+        if ( !valid )
+        {
+            ++snapshotStatistics_.rejected;
+            continue;
+        }
+
+        IndexedUsedMacros usedMacros;
+        for ( Macro const & macro : entry.usedMacros )
+            usedMacros.addMacro( macro.first, macro.second );
+        MacroState macroState;
+        for ( Macro const & macro : entry.changedMacros )
+            macroState.defineMacro( macro.first, macro.second );
+        addEntry( fileId, searchPathId, contentEntry, usedMacros,
+            std::move( macroState ), std::move( headers ) );
+        ++snapshotStatistics_.restored;
+    }
+}
+
+ContentEntryPtr Cache::validateSnapshotFile( std::size_t index )
+{
+    // Snapshot file table is not modified after loading, only the
+    // validation state is.
+    SnapshotFile const & file( snapshotFiles_[ index ] );
+    SnapshotFile::State state;
+    {
+        boost::unique_lock<boost::mutex> const lock( snapshotMutex_ );
+        state = file.state;
+    }
+    if ( state == SnapshotFile::invalid )
+        return ContentEntryPtr();
+
+    if ( state == SnapshotFile::unknown )
+    {
+        // Cheap check first, avoid reading files which obviously changed.
+        llvm::sys::fs::file_status status;
+        bool const unchanged =
+            !llvm::sys::fs::status( file.path, status ) &&
+            ( status.getUniqueID() == file.id ) &&
+            ( status.getLastModificationTime() == file.modified );
+        if ( !unchanged )
+            state = SnapshotFile::invalid;
+    }
+
+    ContentEntryPtr result;
+    if ( state != SnapshotFile::invalid )
+    {
+        llvm::ErrorOr<ContentEntryPtr> const contentEntry(
+            ContentCache::singleton().getOrCreate( file.path ) );
+        if ( contentEntry && ( contentEntry.get()->checksum() == file.checksum ) )
+            result = contentEntry.get();
+    }
+
+    boost::unique_lock<boost::mutex> const lock( snapshotMutex_ );
+    snapshotFiles_[ index ].state = result ? SnapshotFile::valid : SnapshotFile::invalid;
+    return result;
+}
+
 
 //------------------------------------------------------------------------------
@@ -22,6 +22,7 @@
 #include <boost/thread/mutex.hpp>
 
 #include <llvm/Support/MemoryBuffer.h>
+#include <llvm/Support/TimeValue.h>
 #include <llvm/Support/raw_ostream.h>
 
 #include <atomic>
@@ -96,6 +97,7 @@ typedef llvm::sys::fs::UniqueID FileId;
 
 class Cache;
 class CacheTree;
+class ContentCache;
 
 class CacheEntry
 {
@@ -103,6 +105,9 @@ public:
     CacheEntry
     (
         CacheTree & tree,
+        FileId const & fileId,
+        std::size_t searchPathId,
+        ContentEntryPtr const & contentEntry,
         std::string const & uniqueVirtualFileName,
         MacroState && macroState,
         Headers && headers,
@@ -116,6 +121,8 @@ public:
 
     bool usesBuffer( llvm::MemoryBuffer const * buffer ) const
     {
+        if ( contentEntry_ && ( contentEntry_->buffer.get() == buffer ) )
+            return true;
         return std::find_if(
             headers_.begin(),
             headers_.end(),
@@ -136,8 +143,18 @@ public:
     Headers    const & headers   () const { return headers_; }
     MacroState const & macroState() const { return macroState_; }
 
+    UsedMacros usedMacros() const;
+
+    FileId          const & fileId      () const { return fileId_; }
+    std::size_t             searchPathId() const { return searchPathId_; }
+    ContentEntryPtr const & contentEntry() const { return contentEntry_; }
+
     std::size_t lastTimeHit() const { return lastTimeHit_; }
 
+    // Approximate memory used by this entry, including its generated
+    // content.
+    std::size_t memorySize() const { return memorySize_; }
+
     void setLastTimeHit( unsigned int lastTimeHit )
     {
         lastTimeHit_ = lastTimeHit;
@@ -148,6 +165,14 @@ public:
         return refCount_.load( std::memory_order_relaxed );
     }
 
+    // Check that none of the files this entry was created from changed.
+    bool isUpToDate( ContentCache & );
+
+    // Stale entries are never returned from the cache. Their place in the
+    // cache tree is freed once the last reference to them is gone.
+    bool stale() const { return stale_; }
+    void setStale() { stale_ = true; }
+
 private:
     void generateContent( std::string & );
 
@@ -172,13 +197,19 @@ private:
     mutable std::atomic<size_t> refCount_;
 
     CacheTree & tree_;
+    FileId fileId_;
+    std::size_t searchPathId_;
+    ContentEntryPtr contentEntry_;
     std::string fileName_;
     MacroState macroState_;
     Headers headers_;
     std::size_t lastTimeHit_;
+    std::atomic<std::size_t> generation_;
+    bool stale_;
     std::atomic_flag contentLock_;
     std::string buffer_;
     std::unique_ptr<llvm::MemoryBuffer> memoryBuffer_;
+    std::size_t memorySize_;
 };
 
 
@@ -303,6 +334,57 @@ inline CacheEntry::~CacheEntry()
 }
 
 
+////////////////////////////////////////////////////////////////////////////////
+//
+// Cache snapshot
+// --------------
+//
+//   Cache entries can be saved to disk and loaded back when the manager is
+// restarted. Loaded entries are kept aside until their file is looked up
+// for the first time. At that point all files the entry depends on are
+// validated (unique id, modification time and content checksum) and valid
+// entries are moved into the cache proper.
+//
+////////////////////////////////////////////////////////////////////////////////
+
+struct SnapshotFile
+{
+    enum State { unknown, valid, invalid };
+
+    std::string path;
+    FileId id;
+    llvm::sys::TimeValue modified;
+    std::size_t checksum;
+    State state;
+};
+
+struct SnapshotHeader
+{
+    Dir dir;
+    HeaderName name;
+    bool relative;
+    std::size_t file;
+};
+
+struct SnapshotEntry
+{
+    std::size_t file;
+    std::size_t searchPathId;
+    UsedMacros usedMacros;
+    UsedMacros changedMacros;
+    std::vector<SnapshotHeader> headers;
+};
+
+struct SnapshotStatistics
+{
+    SnapshotStatistics() : loaded( 0 ), restored( 0 ), rejected( 0 ) {}
+
+    std::atomic<std::size_t> loaded;
+    std::atomic<std::size_t> restored;
+    std::atomic<std::size_t> rejected;
+};
+
+
 class Cache
 {
 public:
@@ -320,6 +402,7 @@ public:
     (
         FileId const & id,
         std::size_t searchPathId,
+        ContentEntryPtr const & contentEntry,
         IndexedUsedMacros const & usedMacros,
         MacroState && macroState,
         Headers && headers
@@ -335,16 +418,34 @@ public:
     std::size_t hits() const { return hits_; }
     std::size_t misses() const { return misses_; }
 
+    // Least recently hit entries are evicted when memory used by cache
+    // entries exceeds the budget. Zero means no limit.
+    std::size_t memoryBudget() const { return memoryBudget_; }
+    void setMemoryBudget( std::size_t budget ) { memoryBudget_ = budget; }
+    std::size_t memoryUsage() const { return memoryUsage_; }
+    std::size_t evictions() const { return evictions_; }
+
+    // Returns the number of saved/loaded cache entries.
+    std::size_t saveSnapshot( llvm::StringRef filename );
+    std::size_t loadSnapshot( llvm::StringRef filename );
+
+    SnapshotStatistics const & snapshotStatistics() const { return snapshotStatistics_; }
+
 private:
     friend class CacheEntry;
 
 private:
     void invalidate( ContentEntry const & );
+    void removeStaleEntry( CacheEntryPtr const & );
     void maintenance();
     std::string uniqueFileName();
+    void restoreFromSnapshot( FileId const &, std::size_t searchPathId );
+    ContentEntryPtr validateSnapshotFile( std::size_t index );
 
 private:
     typedef std::map<std::pair<FileId, std::size_t>, CacheTree> CacheContainer;
+    typedef std::vector<SnapshotFile> SnapshotFiles;
+    typedef std::map<std::pair<FileId, std::size_t>, std::vector<SnapshotEntry> > SnapshotEntries;
 
     struct GetId
     {
@@ -398,6 +499,14 @@ private:
     std::atomic<std::size_t> counter_;
     std::size_t hits_;
     std::size_t misses_;
+    std::atomic<std::size_t> memoryBudget_;
+    std::atomic<std::size_t> memoryUsage_;
+    std::atomic<std::size_t> evictions_;
+    boost::mutex snapshotMutex_;
+    SnapshotFiles snapshotFiles_;
+    SnapshotEntries snapshotEntries_;
+    std::atomic<bool> snapshotPending_;
+    SnapshotStatistics snapshotStatistics_;
     boost::signals2::scoped_connection conn_;
 };
 
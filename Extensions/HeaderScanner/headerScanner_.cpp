@@ -3,6 +3,7 @@
 #include "headerScanner_.hpp"
 #include "headerTracker_.hpp"
 #include "naivePreprocessor_.hpp"
+#include "profile_.hpp"
 #include "utility_.hpp"
 
 #include <clang/Basic/Diagnostic.h>
@@ -336,6 +337,8 @@ bool Preprocessor::scanHeaders( PreprocessingContext const & ppc, llvm::StringRe
         mainFileEntry, clang::SourceLocation(), clang::SrcMgr::C_User );
     sourceManager.setMainFileID( mainFileID );
 
+    // Covers both naive and regular preprocessing.
+    ProfileScope const lexing( ProfilePhase::lexing );
     if ( NaivePreprocessor( sourceManager, headerSearch, langOpts(), ppc.forcedIncludes(), headers ).run() )
     {
         ++statistics().filesPreprocessedNaively;
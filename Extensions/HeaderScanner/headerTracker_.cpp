@@ -278,9 +278,12 @@ void HeaderCtx::addToCache( Cache & cache, std::size_t const searchPathId, clang
     for ( MacroName const & macroName : changedHere_ )
         changedMacros.defineMacro( macroName, getMacroValue( macroName ) );
 
+    // If the entry cannot be added, included headers are left untouched
+    // and the header is treated as not cached.
     cacheHit_ = cache.addEntry(
         file->getUniqueID(),
         searchPathId,
+        ContentCache::singleton().getOrCreate( file->getName() ).get(),
         usedHere_,
         std::move( changedMacros ),
         std::move( includedHeaders_ )
@@ -0,0 +1,98 @@
+//------------------------------------------------------------------------------
+#include "profile_.hpp"
+
+#include <windows.h>
+//------------------------------------------------------------------------------
+
+namespace
+{
+    #if defined(_MSC_VER)
+    __declspec(thread) ProfileScope * currentScope = 0;
+    #else
+    __thread ProfileScope * currentScope = 0;
+    #endif
+
+    std::uint64_t queryFrequency()
+    {
+        LARGE_INTEGER result;
+        ::QueryPerformanceFrequency( &result );
+        return static_cast<std::uint64_t>( result.QuadPart );
+    }
+
+    // Initialized on module load, before any scanning thread starts.
+    std::uint64_t const ticksPerSecond = queryFrequency();
+}
+
+std::uint64_t Profile::now()
+{
+    LARGE_INTEGER result;
+    ::QueryPerformanceCounter( &result );
+    return static_cast<std::uint64_t>( result.QuadPart );
+}
+
+double Profile::toSeconds( std::uint64_t ticks )
+{
+    return static_cast<double>( ticks ) / ticksPerSecond;
+}
+
+char const * Profile::phaseName( ProfilePhase::Enum phase )
+{
+    switch ( phase )
+    {
+        case ProfilePhase::fileRead       : return "file_read";
+        case ProfilePhase::lexing         : return "lexing";
+        case ProfilePhase::cacheLookup    : return "cache_lookup";
+        case ProfilePhase::contentLockWait: return "content_lock_wait";
+        case ProfilePhase::generateContent: return "generate_content";
+        default: return "unknown";
+    }
+}
+
+void Profile::record( ProfilePhase::Enum phase, std::uint64_t ticks )
+{
+    Counters & counters( counters_[ phase ] );
+    counters.count.fetch_add( 1, std::memory_order_relaxed );
+    counters.ticks.fetch_add( ticks, std::memory_order_relaxed );
+    std::uint64_t microseconds = ticks * 1000000 / ticksPerSecond;
+    std::size_t bucket = 0;
+    while ( microseconds && ( bucket < histogramBuckets - 1 ) )
+    {
+        microseconds >>= 1;
+        ++bucket;
+    }
+    counters.histogram[ bucket ].fetch_add( 1, std::memory_order_relaxed );
+}
+
+void Profile::reset()
+{
+    for ( Counters & counters : counters_ )
+    {
+        counters.count.store( 0, std::memory_order_relaxed );
+        counters.ticks.store( 0, std::memory_order_relaxed );
+        for ( std::atomic<std::uint64_t> & bucket : counters.histogram )
+            bucket.store( 0, std::memory_order_relaxed );
+    }
+}
+
+ProfileScope::ProfileScope( ProfilePhase::Enum phase )
+    :
+    phase_( phase ), start_( Profile::now() ), nested_( 0 ),
+    parent_( currentScope ), running_( true )
+{
+    currentScope = this;
+}
+
+void ProfileScope::stop()
+{
+    if ( !running_ )
+        return;
+    running_ = false;
+    std::uint64_t const duration( Profile::now() - start_ );
+    currentScope = parent_;
+    if ( parent_ )
+        parent_->nested_ += duration;
+    Profile::singleton().record( phase_, duration - nested_ );
+}
+
+
+//------------------------------------------------------------------------------
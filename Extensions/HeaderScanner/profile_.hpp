@@ -0,0 +1,109 @@
+//------------------------------------------------------------------------------
+#pragma once
+//------------------------------------------------------------------------------
+#ifndef profile_HPP__5B0E4A62_8C39_4F55_9A17_2D6C0F3E7B41
+#define profile_HPP__5B0E4A62_8C39_4F55_9A17_2D6C0F3E7B41
+//------------------------------------------------------------------------------
+#include <atomic>
+#include <cstdint>
+//------------------------------------------------------------------------------
+
+////////////////////////////////////////////////////////////////////////////////
+//
+// Profile
+// -------
+//
+//   Process wide counters and duration histograms of the header scanner hot
+// path. Time is accounted exclusively - time spent in a nested phase (e.g.
+// reading a file while lexing) is not counted in the enclosing phase, so
+// phase totals can be compared directly.
+//
+////////////////////////////////////////////////////////////////////////////////
+
+struct ProfilePhase
+{
+    enum Enum
+    {
+        fileRead,
+        lexing,
+        cacheLookup,
+        contentLockWait,
+        generateContent,
+        count
+    };
+};
+
+class Profile
+{
+public:
+    // Bucket 0 counts durations below 1us, bucket n durations in
+    // [2^(n-1), 2^n) us. The last bucket counts everything longer.
+    static std::size_t const histogramBuckets = 24;
+
+    struct Counters
+    {
+        std::atomic<std::uint64_t> count;
+        std::atomic<std::uint64_t> ticks;
+        std::atomic<std::uint64_t> histogram[ histogramBuckets ];
+    };
+
+    Profile() { reset(); }
+
+    void record( ProfilePhase::Enum, std::uint64_t ticks );
+    void reset();
+
+    Counters const & counters( ProfilePhase::Enum phase ) const { return counters_[ phase ]; }
+
+    static char const * phaseName( ProfilePhase::Enum );
+    static std::uint64_t now();
+    static double toSeconds( std::uint64_t ticks );
+
+    static Profile & singleton()
+    {
+        static Profile profile;
+        return profile;
+    }
+
+private:
+    Profile( Profile const & ); // = delete;
+    Profile & operator=( Profile const & ); // = delete;
+
+private:
+    Counters counters_[ ProfilePhase::count ];
+};
+
+
+////////////////////////////////////////////////////////////////////////////////
+//
+// ProfileScope
+// ------------
+//
+//   Records duration of its lifetime to the given phase, or until stop() is
+// called. Scopes must be stopped in reverse order of their creation.
+//
+////////////////////////////////////////////////////////////////////////////////
+
+class ProfileScope
+{
+public:
+    explicit ProfileScope( ProfilePhase::Enum );
+    ~ProfileScope() { stop(); }
+
+    void stop();
+
+private:
+    ProfileScope( ProfileScope const & ); // = delete;
+    ProfileScope & operator=( ProfileScope const & ); // = delete;
+
+private:
+    ProfilePhase::Enum phase_;
+    std::uint64_t start_;
+    std::uint64_t nested_;
+    ProfileScope * parent_;
+    bool running_;
+};
+
+
+//------------------------------------------------------------------------------
+#endif
+//------------------------------------------------------------------------------
@@ -1,6 +1,7 @@
 #include "contentCache_.hpp"
 #include "headerCache_.hpp"
 #include "headerScanner_.hpp"
+#include "profile_.hpp"
 
 #include <Python.h>
 
@@ -19,8 +20,17 @@
 typedef struct {
     PyObject_HEAD
     PreprocessingContext * ppContext;
+    bool frozen;
 } PyPreprocessingContext;
 
+bool checkNotFrozen( PyPreprocessingContext const * self )
+{
+    if ( !self->frozen )
+        return true;
+    PyErr_SetString( PyExc_Exception, "Preprocessing context is frozen." );
+    return false;
+}
+
 void PyPreprocessingContext_dealloc( PyPreprocessingContext * self )
 {
     delete self->ppContext;
@@ -38,6 +48,7 @@ int PyPreprocessingContext_init( PyPreprocessingContext * self, PyObject * args,
 {
     delete self->ppContext;
     self->ppContext = new PreprocessingContext();
+    self->frozen = false;
     return 0;
 }
 
@@ -51,7 +62,7 @@ PyObject * PyPreprocessingContext_add_include_path( PyPreprocessingContext * sel
     if ( !PyArg_ParseTupleAndKeywords( args, kwds, "sO", kwlist, &path, &sysInclude ) )
         return NULL;
 
-    if ( !self->ppContext )
+    if ( !self->ppContext || !checkNotFrozen( self ) )
         return NULL;
 
     self->ppContext->addIncludePath( path, PyObject_IsTrue( sysInclude ) != 0 );
@@ -68,7 +79,7 @@ PyObject * PyPreprocessingContext_add_macro( PyPreprocessingContext * self, PyOb
     if ( !PyArg_ParseTupleAndKeywords( args, kwds, "ss", kwlist, &macroName, &macroValue ) )
         return NULL;
 
-    if ( !self->ppContext )
+    if ( !self->ppContext || !checkNotFrozen( self ) )
         return NULL;
 
     self->ppContext->addMacro( macroName, macroValue );
@@ -84,18 +95,33 @@ PyObject * PyPreprocessingContext_add_forced_include( PyPreprocessingContext * s
     if ( !PyArg_ParseTupleAndKeywords( args, kwds, "s", kwlist, &include ) )
         return NULL;
 
-    if ( !self->ppContext )
+    if ( !self->ppContext || !checkNotFrozen( self ) )
         return NULL;
 
     self->ppContext->addForcedInclude( include );
     Py_RETURN_NONE;
 }
 
+PyObject * PyPreprocessingContext_freeze( PyPreprocessingContext * self, PyObject * whatever )
+{
+    self->frozen = true;
+    Py_RETURN_NONE;
+}
+
+PyObject * PyPreprocessingContext_frozen( PyPreprocessingContext * self, PyObject * whatever )
+{
+    PyObject * result( self->frozen ? Py_True : Py_False );
+    Py_INCREF( result );
+    return result;
+}
+
 PyMethodDef PyPreprocessingContext_methods[] =
 {
     { "add_include_path"  , (PyCFunction)PyPreprocessingContext_add_include_path, METH_VARARGS | METH_KEYWORDS, "Add a search path." },
     { "add_macro", (PyCFunction)PyPreprocessingContext_add_macro, METH_VARARGS | METH_KEYWORDS, "Add a macro." },
     { "add_forced_include", (PyCFunction)PyPreprocessingContext_add_forced_include, METH_VARARGS | METH_KEYWORDS, "Add a forced include." },
+    { "freeze", (PyCFunction)PyPreprocessingContext_freeze, METH_NOARGS, "Disallow further changes, so that context can be shared between threads." },
+    { "frozen", (PyCFunction)PyPreprocessingContext_frozen, METH_NOARGS, "Whether context is frozen." },
     {NULL}
 };
 
@@ -182,7 +208,7 @@ PyObject * PyContentEntry_getBuffer( PyContentEntry * contentEntry, PyObject * a
 
 PyObject * PyContentEntry_getChecksum( PyContentEntry * contentEntry, PyObject * args )
 {
-    return PyLong_FromSize_t( contentEntry->ptr->checksum );
+    return PyLong_FromSize_t( contentEntry->ptr->checksum() );
 }
 
 PyMethodDef PyContentEntry_methods[] =
@@ -266,8 +292,16 @@ PyObject * PyCache_new( PyTypeObject * type, PyObject * args, PyObject * kwds )
 
 int PyCache_init( PyCache * self, PyObject * args, PyObject * kwds )
 {
+    static char * kwlist[] = { "memory_budget", NULL };
+
+    Py_ssize_t memoryBudget = 0;
+
+    if ( !PyArg_ParseTupleAndKeywords( args, kwds, "|n", kwlist, &memoryBudget ) )
+        return -1;
+
     delete self->cache;
     self->cache = new Cache();
+    self->cache->setMemoryBudget( memoryBudget );
     return 0;
 }
 
@@ -275,16 +309,105 @@ int PyCache_init( PyCache * self, PyObject * args, PyObject * kwds )
 PyObject * PyCache_getStats( PyCache * self, PyObject * args, PyObject * kwds )
 {
     assert( self->cache );
-    PyObject * result = PyTuple_New( 2 );
+    ContentCache const & contentCache( ContentCache::singleton() );
+    PyObject * result = PyTuple_New( 6 );
     PyTuple_SET_ITEM( result, 0, PyLong_FromSize_t( self->cache->hits() ) );
     PyTuple_SET_ITEM( result, 1, PyLong_FromSize_t( self->cache->misses() ) );
+    PyTuple_SET_ITEM( result, 2, PyLong_FromSize_t( self->cache->memoryUsage() ) );
+    PyTuple_SET_ITEM( result, 3, PyLong_FromSize_t( self->cache->evictions() ) );
+    PyTuple_SET_ITEM( result, 4, PyLong_FromSize_t( contentCache.size() ) );
+    PyTuple_SET_ITEM( result, 5, PyLong_FromSize_t( contentCache.evictions() ) );
+    return result;
+}
+
+PyObject * PyCache_setMemoryBudget( PyCache * self, PyObject * args, PyObject * kwds )
+{
+    static char * kwlist[] = { "memory_budget", NULL };
+
+    Py_ssize_t memoryBudget = 0;
+
+    if ( !PyArg_ParseTupleAndKeywords( args, kwds, "n", kwlist, &memoryBudget ) )
+        return NULL;
+
+    assert( self->cache );
+    self->cache->setMemoryBudget( memoryBudget );
+    Py_RETURN_NONE;
+}
+
+
+PyObject * PyCache_saveSnapshot( PyCache * self, PyObject * args, PyObject * kwds )
+{
+    static char * kwlist[] = { "filename", NULL };
+
+    char const * filename = 0;
+
+    if ( !PyArg_ParseTupleAndKeywords( args, kwds, "s", kwlist, &filename ) )
+        return NULL;
+
+    assert( self->cache );
+    std::size_t saved;
+    PyThreadState * _save;
+    try
+    {
+        Py_UNBLOCK_THREADS
+        saved = self->cache->saveSnapshot( filename );
+    }
+    catch ( std::exception const & error )
+    {
+        Py_BLOCK_THREADS
+        PyErr_SetString( PyExc_RuntimeError, error.what() );
+        return NULL;
+    }
+    Py_BLOCK_THREADS
+    return PyLong_FromSize_t( saved );
+}
+
+PyObject * PyCache_loadSnapshot( PyCache * self, PyObject * args, PyObject * kwds )
+{
+    static char * kwlist[] = { "filename", NULL };
+
+    char const * filename = 0;
+
+    if ( !PyArg_ParseTupleAndKeywords( args, kwds, "s", kwlist, &filename ) )
+        return NULL;
+
+    assert( self->cache );
+    std::size_t loaded;
+    PyThreadState * _save;
+    try
+    {
+        Py_UNBLOCK_THREADS
+        loaded = self->cache->loadSnapshot( filename );
+    }
+    catch ( std::exception const & error )
+    {
+        Py_BLOCK_THREADS
+        PyErr_SetString( PyExc_RuntimeError, error.what() );
+        return NULL;
+    }
+    Py_BLOCK_THREADS
+    return PyLong_FromSize_t( loaded );
+}
+
+PyObject * PyCache_getSnapshotStats( PyCache * self, PyObject * args )
+{
+    assert( self->cache );
+    SnapshotStatistics const & statistics( self->cache->snapshotStatistics() );
+    PyObject * result = PyTuple_New( 3 );
+    PyTuple_SET_ITEM( result, 0, PyLong_FromSize_t( statistics.loaded ) );
+    PyTuple_SET_ITEM( result, 1, PyLong_FromSize_t( statistics.restored ) );
+    PyTuple_SET_ITEM( result, 2, PyLong_FromSize_t( statistics.rejected ) );
     return result;
 }
 
 
 PyMethodDef PyCache_methods[] =
 {
-    {"get_stats", (PyCFunction)PyCache_getStats, METH_VARARGS | METH_KEYWORDS, "Get cache statistics."},
+    {"get_stats", (PyCFunction)PyCache_getStats, METH_VARARGS | METH_KEYWORDS, "Get cache statistics - hits, misses, memory usage and evictions of header cache and of content cache."},
+    {"set_memory_budget", (PyCFunction)PyCache_setMemoryBudget, METH_VARARGS | METH_KEYWORDS, "Set header cache memory budget in bytes, zero for no limit."},
+    {"save_snapshot", (PyCFunction)PyCache_saveSnapshot, METH_VARARGS | METH_KEYWORDS, "Save cache entries to a file."},
+    {"load_snapshot", (PyCFunction)PyCache_loadSnapshot, METH_VARARGS | METH_KEYWORDS, "Load cache entries saved by save_snapshot()."},
+    {"get_snapshot_stats", (PyCFunction)PyCache_getSnapshotStats, METH_NOARGS, "Get number of loaded, restored and rejected snapshot entries."},
     {NULL}
 };
 
@@ -391,18 +514,127 @@ int PyPreprocessor_init( PyPreprocessor * self, PyObject * args, PyObject * kwds
     return 0;
 }
 
+typedef std::vector<Header const *> HeaderPtrList;
+typedef std::unordered_map<Dir, HeaderPtrList> DirsAndHeaders;
+
+void groupByDir( Headers const & headers, DirsAndHeaders & dirsAndHeaders )
+{
+    for ( Header const & header : headers )
+        dirsAndHeaders[ header.dir ].push_back( &header );
+}
+
+////////////////////////////////////////////////////////////////////////////////
+//
+// Shared file manifest. Lists headers which are candidates for server's
+// header cache, i.e. all headers not found relative to the includer.
+// See buildpal.common.manifest for the layout.
+//
+////////////////////////////////////////////////////////////////////////////////
+
+void appendInteger( std::string & manifest, unsigned long long value, std::size_t bytes )
+{
+    for ( std::size_t byte( 0 ); byte < bytes; ++byte )
+        manifest.push_back( static_cast<char>( ( value >> ( 8 * byte ) ) & 0xFF ) );
+}
+
+void appendString( std::string & manifest, llvm::StringRef str )
+{
+    appendInteger( manifest, str.size(), 4 );
+    manifest.append( str.data(), str.size() );
+}
+
+void makeManifest( DirsAndHeaders const & dirsAndHeaders, std::string & manifest )
+{
+    std::size_t const dirCountPos( manifest.size() );
+    std::size_t dirCount( 0 );
+    appendInteger( manifest, 0, 4 );
+    for ( DirsAndHeaders::value_type const & dirAndHeaders : dirsAndHeaders )
+    {
+        std::size_t sharedCount( 0 );
+        for ( Header const * header : dirAndHeaders.second )
+            if ( !header->relative )
+                ++sharedCount;
+        if ( sharedCount == 0 )
+            continue;
+        ++dirCount;
+        appendString( manifest, dirAndHeaders.first.get() );
+        appendInteger( manifest, sharedCount, 4 );
+        for ( Header const * header : dirAndHeaders.second )
+        {
+            if ( header->relative )
+                continue;
+            appendString( manifest, header->name.get() );
+            appendInteger( manifest, header->contentEntry->checksum(), 8 );
+        }
+    }
+    std::string dirCountBytes;
+    appendInteger( dirCountBytes, dirCount, 4 );
+    manifest.replace( dirCountPos, 4, dirCountBytes );
+}
+
+PyObject * makeScanResult( DirsAndHeaders const & dirsAndHeaders, HeaderList const & missing, std::string const * manifest )
+{
+    PyObject * dirsTuple = PyTuple_New( dirsAndHeaders.size() );
+    std::size_t dirIndex( 0 );
+    for ( DirsAndHeaders::value_type const & dirAndHeaders : dirsAndHeaders )
+    {
+        PyObject * headersInDirTuple = PyTuple_New( dirAndHeaders.second.size() );
+        std::size_t headersInDirTupleIndex( 0 );
+        for ( Header const * header : dirAndHeaders.second )
+        {
+            PyObject * headerEntry = PyTuple_New( 3 );
+            PyTuple_SET_ITEM( headerEntry, 0, PyUnicode_FromStringAndSize( header->name.get().data(), header->name.get().size() ) );
+
+            PyObject * const isRelative( header->relative ? Py_True : Py_False );
+            Py_INCREF( isRelative );
+            PyTuple_SET_ITEM( headerEntry, 1, isRelative );
+        
+            PyContentEntry * contentEntry( (PyContentEntry *)_PyObject_New( &PyContentEntryType ) );
+            contentEntry->ptr = header->contentEntry.get();
+            intrusive_ptr_add_ref( contentEntry->ptr );
+
+            PyTuple_SET_ITEM( headerEntry, 2, (PyObject *)contentEntry );
+            PyTuple_SET_ITEM( headersInDirTuple, headersInDirTupleIndex++, headerEntry );
+        }
+        PyObject * dirTuple = PyTuple_New( 2 );
+        llvm::StringRef const dirStr( dirAndHeaders.first.get() );
+        PyObject * dir = PyUnicode_FromStringAndSize( dirStr.data(), dirStr.size() );
+        PyTuple_SET_ITEM( dirTuple, 0, dir );
+        PyTuple_SET_ITEM( dirTuple, 1, headersInDirTuple );
+        PyTuple_SET_ITEM( dirsTuple, dirIndex++, dirTuple );
+    }
+
+    PyObject * missingHeadersTuple = PyTuple_New( missing.size() );
+    std::size_t missingIndex( 0 );
+    for ( HeaderList::value_type const & missingHeader : missing )
+    {
+        PyObject * val = PyUnicode_FromStringAndSize( missingHeader.data(), missingHeader.size() );
+        PyTuple_SET_ITEM( missingHeadersTuple, missingIndex++, val );
+    }
+    
+    PyObject * resultTuple = PyTuple_New( manifest ? 3 : 2 );
+    PyTuple_SET_ITEM( resultTuple, 0, dirsTuple );
+    PyTuple_SET_ITEM( resultTuple, 1, missingHeadersTuple );
+    if ( manifest )
+        PyTuple_SET_ITEM( resultTuple, 2, PyBytes_FromStringAndSize( manifest->data(), manifest->size() ) );
+    return resultTuple;
+}
+
 PyObject * PyPreprocessor_scanHeaders( PyPreprocessor * self, PyObject * args, PyObject * kwds )
 {
-    static char * kwlist[] = { "pp_ctx", "filename", NULL };
+    static char * kwlist[] = { "pp_ctx", "filename", "manifest", NULL };
 
     PyObject * pObject = 0;
     PyObject * filename = 0;
+    PyObject * pManifest = 0;
 
     assert( self->pp );
 
-    if ( !PyArg_ParseTupleAndKeywords( args, kwds, "OO", kwlist, &pObject, &filename ) )
+    if ( !PyArg_ParseTupleAndKeywords( args, kwds, "OO|O", kwlist, &pObject, &filename, &pManifest ) )
         return NULL;
 
+    bool const withManifest( pManifest && ( PyObject_IsTrue( pManifest ) != 0 ) );
+
     if ( !pObject || ( (PyTypeObject *)PyObject_Type( pObject ) != &PyPreprocessingContextType ) )
     {
         PyErr_SetString( PyExc_Exception, "Invalid preprocessing context parameter." );
@@ -452,56 +684,184 @@ PyObject * PyPreprocessor_scanHeaders( PyPreprocessor * self, PyObject * args, P
         return NULL;
     }
 
-    // Group result by dir.
-    typedef std::vector<Header const *> HeaderPtrList;
-    typedef std::unordered_map<Dir, HeaderPtrList> DirsAndHeaders;
     DirsAndHeaders dirsAndHeaders;
-    for ( Header const & header : headers )
-        dirsAndHeaders[ header.dir ].push_back( &header );
+    groupByDir( headers, dirsAndHeaders );
+    std::string manifest;
+    if ( withManifest )
+        makeManifest( dirsAndHeaders, manifest );
 
     Py_BLOCK_THREADS
-    PyObject * dirsTuple = PyTuple_New( dirsAndHeaders.size() );
-    std::size_t dirIndex( 0 );
-    for ( DirsAndHeaders::value_type const & dirAndHeaders : dirsAndHeaders )
+    return makeScanResult( dirsAndHeaders, missing, withManifest ? &manifest : 0 );
+}
+
+struct BatchItem
+{
+    BatchItem() : errorType( 0 ) {}
+
+    Headers headers;
+    HeaderList missing;
+    DirsAndHeaders dirsAndHeaders;
+    std::string manifest;
+    PyObject * errorType;
+    std::string error;
+};
+
+void scanBatchItem( Preprocessor & pp, PreprocessingContext const & ppc, llvm::StringRef filename, bool withManifest, BatchItem & item )
+{
+    try
     {
-        PyObject * headersInDirTuple = PyTuple_New( dirAndHeaders.second.size() );
-        std::size_t headersInDirTupleIndex( 0 );
-        for ( Header const * header : dirAndHeaders.second )
+        if ( !pp.scanHeaders( ppc, filename, item.headers, item.missing ) )
         {
-            PyObject * headerEntry = PyTuple_New( 3 );
-            PyTuple_SET_ITEM( headerEntry, 0, PyUnicode_FromStringAndSize( header->name.get().data(), header->name.get().size() ) );
+            item.errorType = PyExc_Exception;
+            item.error = "Failed to preprocess file.";
+            return;
+        }
+        groupByDir( item.headers, item.dirsAndHeaders );
+        if ( withManifest )
+            makeManifest( item.dirsAndHeaders, item.manifest );
+    }
+    catch ( std::runtime_error const & error )
+    {
+        item.errorType = PyExc_RuntimeError;
+        item.error = error.what();
+    }
+    catch ( std::exception const & error )
+    {
+        item.errorType = PyExc_Exception;
+        item.error = error.what();
+    }
+    catch ( ... )
+    {
+        item.errorType = PyExc_Exception;
+        item.error = "Unhandled exception";
+    }
+}
 
-            PyObject * const isRelative( header->relative ? Py_True : Py_False );
-            Py_INCREF( isRelative );
-            PyTuple_SET_ITEM( headerEntry, 1, isRelative );
-        
-            PyContentEntry * contentEntry( (PyContentEntry *)_PyObject_New( &PyContentEntryType ) );
-            contentEntry->ptr = header->contentEntry.get();
-            intrusive_ptr_add_ref( contentEntry->ptr );
+PyObject * makeBatchResult( BatchItem const & item, bool withManifest )
+{
+    if ( item.errorType )
+        return PyObject_CallFunction( item.errorType, "s", item.error.c_str() );
+    return makeScanResult( item.dirsAndHeaders, item.missing, withManifest ? &item.manifest : 0 );
+}
 
-            PyTuple_SET_ITEM( headerEntry, 2, (PyObject *)contentEntry );
-            PyTuple_SET_ITEM( headersInDirTuple, headersInDirTupleIndex++, headerEntry );
+PyObject * PyPreprocessor_scanHeadersBatch( PyPreprocessor * self, PyObject * args, PyObject * kwds )
+{
+    static char * kwlist[] = { "pp_ctx", "filenames", "callback", "manifest", NULL };
+
+    PyObject * pObject = 0;
+    PyObject * pFilenames = 0;
+    PyObject * callback = 0;
+    PyObject * pManifest = 0;
+
+    assert( self->pp );
+
+    if ( !PyArg_ParseTupleAndKeywords( args, kwds, "OO|OO", kwlist, &pObject, &pFilenames, &callback, &pManifest ) )
+        return NULL;
+
+    bool const withManifest( pManifest && ( PyObject_IsTrue( pManifest ) != 0 ) );
+
+    if ( !pObject || ( (PyTypeObject *)PyObject_Type( pObject ) != &PyPreprocessingContextType ) )
+    {
+        PyErr_SetString( PyExc_Exception, "Invalid preprocessing context parameter." );
+        return NULL;
+    }
+
+    PyPreprocessingContext const * ppContext( reinterpret_cast<PyPreprocessingContext *>( pObject ) );
+
+    // Context is used without holding the GIL for the entire batch, and
+    // possibly by several batches at once.
+    if ( !ppContext->frozen )
+    {
+        PyErr_SetString( PyExc_Exception, "Preprocessing context must be frozen." );
+        return NULL;
+    }
+
+    if ( callback == Py_None )
+        callback = 0;
+
+    if ( callback && !PyCallable_Check( callback ) )
+    {
+        PyErr_SetString( PyExc_Exception, "Expected a callable as 'callback' parameter." );
+        return NULL;
+    }
+
+    PyObject * filenameSeq = PySequence_Fast( pFilenames, "Expected a sequence as 'filenames' parameter." );
+    if ( !filenameSeq )
+        return NULL;
+
+    std::vector<std::string> filenames;
+    filenames.reserve( PySequence_Fast_GET_SIZE( filenameSeq ) );
+    for ( Py_ssize_t index( 0 ); index < PySequence_Fast_GET_SIZE( filenameSeq ); ++index )
+    {
+        PyObject * filename( PySequence_Fast_GET_ITEM( filenameSeq, index ) );
+        if ( !PyUnicode_Check( filename ) )
+        {
+            Py_DECREF( filenameSeq );
+            PyErr_SetString( PyExc_Exception, "Expected a string in 'filenames' parameter." );
+            return NULL;
         }
-        PyObject * dirTuple = PyTuple_New( 2 );
-        llvm::StringRef const dirStr( dirAndHeaders.first.get() );
-        PyObject * dir = PyUnicode_FromStringAndSize( dirStr.data(), dirStr.size() );
-        PyTuple_SET_ITEM( dirTuple, 0, dir );
-        PyTuple_SET_ITEM( dirTuple, 1, headersInDirTuple );
-        PyTuple_SET_ITEM( dirsTuple, dirIndex++, dirTuple );
+        char const * utf8Filename( PyUnicode_AsUTF8( filename ) );
+        if ( !utf8Filename )
+        {
+            Py_DECREF( filenameSeq );
+            return NULL;
+        }
+        filenames.push_back( utf8Filename );
     }
+    Py_DECREF( filenameSeq );
 
-    PyObject * missingHeadersTuple = PyTuple_New( missing.size() );
-    std::size_t missingIndex( 0 );
-    for ( HeaderList::value_type const & missingHeader : missing )
+    // Callback might drop the last reference to the context.
+    Py_INCREF( pObject );
+
+    PyThreadState * _save;
+    if ( callback )
     {
-        PyObject * val = PyUnicode_FromStringAndSize( missingHeader.data(), missingHeader.size() );
-        PyTuple_SET_ITEM( missingHeadersTuple, missingIndex++, val );
+        // Deliver each result as soon as it is ready. GIL is held only
+        // while the result is converted and passed to the callback.
+        for ( std::size_t index( 0 ); index < filenames.size(); ++index )
+        {
+            BatchItem item;
+            Py_UNBLOCK_THREADS
+            scanBatchItem( *self->pp, *ppContext->ppContext, filenames[ index ], withManifest, item );
+            Py_BLOCK_THREADS
+            PyObject * result = makeBatchResult( item, withManifest );
+            if ( !result )
+            {
+                Py_DECREF( pObject );
+                return NULL;
+            }
+            PyObject * callbackResult = PyObject_CallFunction( callback, "nO", static_cast<Py_ssize_t>( index ), result );
+            Py_DECREF( result );
+            if ( !callbackResult )
+            {
+                Py_DECREF( pObject );
+                return NULL;
+            }
+            Py_DECREF( callbackResult );
+        }
+        Py_DECREF( pObject );
+        Py_RETURN_NONE;
     }
-    
-    PyObject * resultTuple = PyTuple_New( 2 );
-    PyTuple_SET_ITEM( resultTuple, 0, dirsTuple );
-    PyTuple_SET_ITEM( resultTuple, 1, missingHeadersTuple );
-    return resultTuple;
+
+    std::vector<BatchItem> items( filenames.size() );
+    Py_UNBLOCK_THREADS
+    for ( std::size_t index( 0 ); index < filenames.size(); ++index )
+        scanBatchItem( *self->pp, *ppContext->ppContext, filenames[ index ], withManifest, items[ index ] );
+    Py_BLOCK_THREADS
+
+    Py_DECREF( pObject );
+    PyObject * resultList = PyList_New( items.size() );
+    for ( std::size_t index( 0 ); index < items.size(); ++index )
+    {
+        PyObject * result = makeBatchResult( items[ index ], withManifest );
+        if ( !result )
+        {
+            Py_DECREF( resultList );
+            return NULL;
+        }
+        PyList_SET_ITEM( resultList, index, result );
+    }
+    return resultList;
 }
 
 PyObject * PyPreprocessor_setMicrosoftExt( PyPreprocessor * self, PyObject * args, PyObject * kwds )
@@ -551,6 +911,7 @@ PyObject * PyPreprocessor_filesPreprocessed( PyPreprocessor * self, PyObject * w
 PyMethodDef PyPreprocessor_methods[] =
 {
     {"scan_headers"      , (PyCFunction)PyPreprocessor_scanHeaders      , METH_VARARGS | METH_KEYWORDS, "Retrieve a list of include files."},
+    {"scan_headers_batch", (PyCFunction)PyPreprocessor_scanHeadersBatch , METH_VARARGS | METH_KEYWORDS, "Retrieve lists of include files for several sources sharing a frozen context."},
     {"set_ms_ext"        , (PyCFunction)PyPreprocessor_setMicrosoftExt  , METH_VARARGS | METH_KEYWORDS, "Set MS extension mode."},
     {"set_ms_mode"       , (PyCFunction)PyPreprocessor_setMicrosoftMode , METH_VARARGS | METH_KEYWORDS, "Set MS mode."},
     {"files_preprocessed", (PyCFunction)PyPreprocessor_filesPreprocessed, METH_NOARGS                 , "Number of preprocessed files."},
@@ -605,8 +966,126 @@ PyObject * Preprocessing_clearContentCache( PyObject * something, PyObject * som
     Py_RETURN_NONE;
 }
 
+PyObject * Preprocessing_revalidateContentCache( PyObject * something, PyObject * somethingElse )
+{
+    ContentCache::singleton().nextGeneration();
+    Py_RETURN_NONE;
+}
+
+PyObject * Preprocessing_invalidateContent( PyObject * something, PyObject * args, PyObject * kwds )
+{
+    static char * kwlist[] = { "filename", NULL };
+
+    char const * filename = 0;
+
+    if ( !PyArg_ParseTupleAndKeywords( args, kwds, "s", kwlist, &filename ) )
+        return NULL;
+
+    bool result;
+    Py_BEGIN_ALLOW_THREADS
+    result = ContentCache::singleton().invalidate( filename );
+    Py_END_ALLOW_THREADS
+    return PyBool_FromLong( result ? 1 : 0 );
+}
+
+PyObject * Preprocessing_setContentCacheBudget( PyObject * something, PyObject * args, PyObject * kwds )
+{
+    static char * kwlist[] = { "budget", NULL };
+
+    Py_ssize_t budget = 0;
+
+    if ( !PyArg_ParseTupleAndKeywords( args, kwds, "n", kwlist, &budget ) )
+        return NULL;
+
+    ContentCache::singleton().setBudget( budget );
+    Py_RETURN_NONE;
+}
+
+PyObject * Preprocessing_setMapThreshold( PyObject * something, PyObject * args, PyObject * kwds )
+{
+    static char * kwlist[] = { "threshold", NULL };
+
+    Py_ssize_t threshold = 0;
+
+    if ( !PyArg_ParseTupleAndKeywords( args, kwds, "n", kwlist, &threshold ) )
+        return NULL;
+
+    ContentEntry::setMapThreshold( threshold );
+    Py_RETURN_NONE;
+}
+
+PyObject * Preprocessing_getContentEntry( PyObject * something, PyObject * args, PyObject * kwds )
+{
+    static char * kwlist[] = { "filename", NULL };
+
+    char const * filename = 0;
+
+    if ( !PyArg_ParseTupleAndKeywords( args, kwds, "s", kwlist, &filename ) )
+        return NULL;
+
+    ContentEntryPtr contentEntry;
+    Py_BEGIN_ALLOW_THREADS
+    llvm::ErrorOr<ContentEntryPtr> entry( ContentCache::singleton().getOrCreate( filename ) );
+    if ( entry )
+        contentEntry = entry.get();
+    Py_END_ALLOW_THREADS
+
+    if ( !contentEntry )
+        Py_RETURN_NONE;
+
+    PyContentEntry * result( (PyContentEntry *)_PyObject_New( &PyContentEntryType ) );
+    result->ptr = contentEntry.get();
+    intrusive_ptr_add_ref( result->ptr );
+    return (PyObject *)result;
+}
+
+PyObject * Preprocessing_contentCacheStats( PyObject * something, PyObject * somethingElse )
+{
+    ContentCache const & contentCache( ContentCache::singleton() );
+    PyObject * result = PyTuple_New( 2 );
+    PyTuple_SET_ITEM( result, 0, PyLong_FromSize_t( contentCache.generation() ) );
+    PyTuple_SET_ITEM( result, 1, PyLong_FromSize_t( contentCache.invalidated() ) );
+    return result;
+}
+
+PyObject * Preprocessing_getProfile( PyObject * something, PyObject * somethingElse )
+{
+    Profile const & profile( Profile::singleton() );
+    PyObject * result = PyDict_New();
+    if ( !result )
+        return NULL;
+    for ( int phase = 0; phase < ProfilePhase::count; ++phase )
+    {
+        Profile::Counters const & counters( profile.counters( static_cast<ProfilePhase::Enum>( phase ) ) );
+        PyObject * histogram = PyTuple_New( Profile::histogramBuckets );
+        for ( std::size_t bucket = 0; bucket < Profile::histogramBuckets; ++bucket )
+            PyTuple_SET_ITEM( histogram, bucket, PyLong_FromUnsignedLongLong( counters.histogram[ bucket ].load( std::memory_order_relaxed ) ) );
+        PyObject * phaseData = PyTuple_New( 3 );
+        PyTuple_SET_ITEM( phaseData, 0, PyLong_FromUnsignedLongLong( counters.count.load( std::memory_order_relaxed ) ) );
+        PyTuple_SET_ITEM( phaseData, 1, PyFloat_FromDouble( Profile::toSeconds( counters.ticks.load( std::memory_order_relaxed ) ) ) );
+        PyTuple_SET_ITEM( phaseData, 2, histogram );
+        PyDict_SetItemString( result, Profile::phaseName( static_cast<ProfilePhase::Enum>( phase ) ), phaseData );
+        Py_DECREF( phaseData );
+    }
+    return result;
+}
+
+PyObject * Preprocessing_resetProfile( PyObject * something, PyObject * somethingElse )
+{
+    Profile::singleton().reset();
+    Py_RETURN_NONE;
+}
+
 static PyMethodDef preprocessingMethods[] = {
     {"clear_content_cache", Preprocessing_clearContentCache, METH_NOARGS, "Execute a shell command."},
+    {"revalidate_content_cache", Preprocessing_revalidateContentCache, METH_NOARGS, "Check cached files for changes the next time they are used."},
+    {"invalidate_content", (PyCFunction)Preprocessing_invalidateContent, METH_VARARGS | METH_KEYWORDS, "Remove a changed file from content cache."},
+    {"content_cache_stats", Preprocessing_contentCacheStats, METH_NOARGS, "Get content cache generation and number of invalidated files."},
+    {"set_content_cache_budget", (PyCFunction)Preprocessing_setContentCacheBudget, METH_VARARGS | METH_KEYWORDS, "Set content cache size budget in bytes."},
+    {"set_map_threshold", (PyCFunction)Preprocessing_setMapThreshold, METH_VARARGS | METH_KEYWORDS, "Memory map files of at least this many bytes, instead of reading them. Zero disables mapping."},
+    {"get_content_entry", (PyCFunction)Preprocessing_getContentEntry, METH_VARARGS | METH_KEYWORDS, "Get content entry for a file, None if it cannot be read."},
+    {"get_profile", Preprocessing_getProfile, METH_NOARGS, "Get header scanner profile, a dict of phase name to (count, seconds, histogram)."},
+    {"reset_profile", Preprocessing_resetProfile, METH_NOARGS, "Reset header scanner profile."},
     {NULL, NULL, 0, NULL}
 };
 
@@ -0,0 +1,82 @@
+"""
+Compares reading headers into the content cache with and without memory
+mapping of large files, and measures how much lazy checksums save when
+only a part of the read headers is shipped to servers.
+
+Generates many small headers and a few large generated ones. Each mode
+starts with an empty content cache, the OS file cache is warmed up first
+so that disk speed does not dominate.
+
+Usage: content_reading.py [small_headers] [large_headers] [large_size_kb]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from pprint import pprint
+
+import preprocessing
+
+small_headers = 5000 if len(sys.argv) < 2 else int(sys.argv[1])
+large_headers = 20 if len(sys.argv) < 3 else int(sys.argv[2])
+large_size = 4096 * 1024 if len(sys.argv) < 4 else int(sys.argv[3]) * 1024
+shipped_fraction = 0.1
+
+def generate_headers(work_dir):
+    files = []
+    for index in range(small_headers):
+        filename = os.path.join(work_dir, 'small{}.h'.format(index))
+        with open(filename, 'wt') as file:
+            for line in range(100):
+                file.write('int small_{}_{}(int a, int b);\n'.format(index,
+                    line))
+        files.append(filename)
+    for index in range(large_headers):
+        filename = os.path.join(work_dir, 'large{}.h'.format(index))
+        line = 'static const unsigned char generated_{}[] = {{ 0x00 }};\n'
+        with open(filename, 'wt') as file:
+            written = 0
+            while written < large_size:
+                data = line.format(written)
+                file.write(data)
+                written += len(data)
+        files.append(filename)
+    return files
+
+def read_all(files, map_threshold):
+    preprocessing.clear_content_cache()
+    preprocessing.set_map_threshold(map_threshold)
+    start = time.time()
+    entries = [preprocessing.get_content_entry(file) for file in files]
+    read_time = time.time() - start
+
+    # Only some headers end up in a shipped file list.
+    shipped = entries[::int(1 / shipped_fraction)]
+    start = time.time()
+    for entry in shipped:
+        entry.checksum()
+    lazy_checksum_time = time.time() - start
+
+    start = time.time()
+    for entry in entries:
+        entry.checksum()
+    all_checksum_time = time.time() - start + lazy_checksum_time
+    return dict(read_time=read_time, lazy_checksum_time=lazy_checksum_time,
+        eager_checksum_time=all_checksum_time,
+        lazy_total=read_time + lazy_checksum_time,
+        eager_total=read_time + all_checksum_time)
+
+work_dir = tempfile.mkdtemp()
+files = generate_headers(work_dir)
+# Warm up OS file cache.
+read_all(files, 0)
+
+results = dict(read=read_all(files, 0), mapped=read_all(files, 64 * 1024))
+results['speedup'] = results['read']['eager_total'] / \
+    results['mapped']['lazy_total']
+pprint(results)
+preprocessing.set_map_threshold(0)
+preprocessing.clear_content_cache()
+shutil.rmtree(work_dir)
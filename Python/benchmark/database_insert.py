@@ -0,0 +1,108 @@
+"""
+Measures how fast the manager's command database absorbs timing records,
+inserting 100k tasks' worth of commands, tasks with their time points, and
+sessions.
+
+Compares the batched DatabaseInserter with inserting row by row (one
+execute() per row and a UI update per command, as done before batching).
+
+Usage: database_insert.py [tasks] [tasks_per_command]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from array import array
+from pprint import pprint
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..'))
+from buildpal.manager.compile_session import SessionResult
+from buildpal.manager.database import Database, DatabaseInserter
+
+tasks = 100000 if len(sys.argv) < 2 else int(sys.argv[1])
+tasks_per_command = 10 if len(sys.argv) < 3 else int(sys.argv[2])
+time_points = ('collecting', 'preprocessed', 'waiting for server',
+    'server accepted', 'compiled', 'sending object', 'completed')
+
+def make_command(index):
+    now = time.time()
+    return {
+        'command': 'cl /c source{}.cpp'.format(index),
+        'tasks': [{
+            'source': 'source{}_{}.cpp'.format(index, task),
+            'sessions': [{
+                'hostname': 'server{}'.format(task % 8),
+                'port': '12345',
+                'started': now,
+                'completed': now + 1,
+                'result': SessionResult.success}],
+            'times': (time_points, array('d', (now + ord for ord in range(
+                len(time_points)))))} for task in range(tasks_per_command)]}
+
+def new_database():
+    handle, db_file = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    database = Database(db_file)
+    with database.get_connection() as conn:
+        database.create_structure(conn)
+    return database
+
+def row_by_row(commands):
+    database = new_database()
+
+    def insert(conn, table, data, **extra_data):
+        converted_data = []
+        for col_desc in database.desc_for_table(table):
+            col_data = data.get(col_desc['col_name'])
+            if col_data is None:
+                 col_data = extra_data.get(col_desc['col_name'])
+            converter = col_desc.get('converter')
+            converted_data.append(converter.to_db(col_data) if converter and
+                col_data is not None else col_data)
+        sql = "INSERT INTO {} VALUES ({})".format(table,
+            ", ".join('?' for x in range(len(converted_data))))
+        cursor = conn.execute(sql, converted_data)
+        cursor.close()
+        return cursor.lastrowid
+
+    ui_updates = 0
+    start = time.time()
+    with database.get_connection() as conn:
+        timeline_id = insert(conn, 'timeline', dict(names='\n'.join(
+            time_points)))
+        for command in commands:
+            command_id = insert(conn, 'command', command)
+            ui_updates += 1
+            for task in command['tasks']:
+                task_id = insert(conn, 'task', task, command_id=command_id,
+                    timeline_id=timeline_id,
+                    time_points=task['times'][1].tobytes())
+                for session in task['sessions']:
+                    insert(conn, 'session', session, task_id=task_id)
+        conn.commit()
+    duration = time.time() - start
+    database.close()
+    return dict(duration=duration, tasks_per_second=tasks / duration,
+        ui_updates=ui_updates)
+
+def batched(commands):
+    database = new_database()
+    ui_updates = []
+    start = time.time()
+    with DatabaseInserter(database, lambda *args : ui_updates.append(args)) \
+            as inserter:
+        for command in commands:
+            inserter.async_insert(command)
+    duration = time.time() - start
+    database.close()
+    return dict(duration=duration, tasks_per_second=tasks / duration,
+        ui_updates=len(ui_updates))
+
+commands = [make_command(index) for index in range(tasks //
+    tasks_per_command)]
+results = dict(row_by_row=row_by_row(commands), batched=batched(commands))
+results['speedup'] = results['row_by_row']['duration'] / \
+    results['batched']['duration']
+pprint(results)
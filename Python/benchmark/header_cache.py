@@ -0,0 +1,73 @@
+"""
+Compares header scanning throughput with an empty header cache (first build
+after manager start) and with the cache loaded from a snapshot saved by the
+previous run.
+
+A synthetic tree of 10k headers is generated, see synthetic_tree.py.
+
+Usage: header_cache.py [sources] [work_dir]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+from pprint import pprint
+
+import preprocessing
+
+from synthetic_tree import generate_tree, layer_macros
+
+sources = 1000 if len(sys.argv) < 2 else int(sys.argv[1])
+remove_work_dir = len(sys.argv) < 3
+work_dir = tempfile.mkdtemp() if remove_work_dir else sys.argv[2]
+
+def scan_all(cache, include_dir, source_files):
+    preprocessor = preprocessing.Preprocessor(cache)
+    preprocessor.set_ms_mode(True)
+    preprocessor.set_ms_ext(True)
+
+    def scan(source_file):
+        ppc = preprocessing.PreprocessingContext()
+        ppc.add_include_path(include_dir, False)
+        for macro in layer_macros():
+            ppc.add_macro(macro, '1')
+        header_info, missing = preprocessor.scan_headers(ppc, source_file)
+        return sum(len(headers) for dir, headers in header_info)
+
+    with ThreadPoolExecutor(cpu_count() + 1) as executor:
+        start = time.time()
+        headers = sum(executor.map(scan, source_files))
+        duration = time.time() - start
+    return dict(duration=duration, sources_per_second=len(source_files) /
+        duration, headers=headers, cache_stats=cache.get_stats())
+
+include_dir, source_files = generate_tree(work_dir, sources)
+snapshot = os.path.join(work_dir, 'header_cache.bin')
+
+preprocessing.clear_content_cache()
+cache = preprocessing.Cache()
+cold = scan_all(cache, include_dir, source_files)
+start = time.time()
+cold['snapshot_entries'] = cache.save_snapshot(snapshot)
+cold['snapshot_save_time'] = time.time() - start
+cold['snapshot_size'] = os.path.getsize(snapshot)
+del cache
+
+# Simulate manager restart.
+preprocessing.clear_content_cache()
+cache = preprocessing.Cache()
+start = time.time()
+cache.load_snapshot(snapshot)
+load_time = time.time() - start
+warm = scan_all(cache, include_dir, source_files)
+warm['snapshot_load_time'] = load_time
+warm['snapshot_stats'] = cache.get_snapshot_stats()
+
+pprint(dict(cold=cold, warm=warm, speedup=cold['duration'] / warm['duration']))
+
+if remove_work_dir:
+    shutil.rmtree(work_dir)
@@ -0,0 +1,91 @@
+"""
+Measures header scanning throughput of the manager's source scanners for
+1 to 32 workers, using threads (SourceScanner) and worker processes
+(ProcessSourceScanner).
+
+Sources are spread over several directories, as in a real project, so
+that process mode can route them by directory affinity. Every run starts
+with empty header caches.
+
+Usage: header_scanning.py [sources] [source_dirs] [work_dir]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from pprint import pprint
+from threading import Event
+
+import preprocessing
+
+from synthetic_tree import generate_tree, layer_macros
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..'))
+from buildpal.manager.process_scanner import ProcessSourceScanner
+from buildpal.manager.source_scanner import SourceScanner
+from buildpal.manager.task import PreprocessContext, PreprocessTask
+
+worker_counts = (1, 2, 4, 8, 16, 32)
+
+class BenchmarkTask:
+    class ServerTask: pass
+
+    def __init__(self, source, context):
+        self.preprocess_task = PreprocessTask(source, context, None)
+        self.server_task = self.ServerTask()
+
+    def note_time(self, *args):
+        pass
+
+def run(scanner_type, workers, include_dir, source_files):
+    preprocessing.clear_content_cache()
+    context = PreprocessContext(layer_macros(), [include_dir], [], [])
+    tasks = [BenchmarkTask(source, context) for source in source_files]
+    done = Event()
+    completed = []
+    errors = []
+
+    def notify(task, exception=None):
+        if exception is not None:
+            errors.append(exception)
+        completed.append(task)
+        if len(completed) == len(tasks):
+            done.set()
+
+    with scanner_type(notify, lambda *args : None, workers) as scanner:
+        start = time.time()
+        for task in tasks:
+            scanner.add_task(task)
+        done.wait()
+        duration = time.time() - start
+        hits, misses, ratio = scanner.get_cache_stats()
+    return dict(duration=duration, sources_per_second=len(tasks) / duration,
+        errors=len(errors), cache_hit_ratio=ratio)
+
+if __name__ == '__main__':
+    sources = 2000 if len(sys.argv) < 2 else int(sys.argv[1])
+    source_dirs = 50 if len(sys.argv) < 3 else int(sys.argv[2])
+    remove_work_dir = len(sys.argv) < 4
+    work_dir = tempfile.mkdtemp() if remove_work_dir else sys.argv[3]
+
+    include_dir, source_files = generate_tree(work_dir, sources, source_dirs)
+    results = {}
+    for workers in worker_counts:
+        results[workers] = dict(
+            threads=run(SourceScanner, workers, include_dir, source_files),
+            processes=run(ProcessSourceScanner, workers, include_dir,
+                source_files))
+    pprint(results)
+
+    baseline = results[1]['threads']['sources_per_second']
+    print('workers  threads  processes  (speedup over 1 thread)')
+    for workers in worker_counts:
+        print('{:7}  {:7.2f}  {:9.2f}'.format(workers,
+            results[workers]['threads']['sources_per_second'] / baseline,
+            results[workers]['processes']['sources_per_second'] / baseline))
+
+    if remove_work_dir:
+        shutil.rmtree(work_dir)
@@ -0,0 +1,121 @@
+"""
+Reports manager memory (RSS) used by scan results of queued tasks, with
+every task keeping its own header info and shared file list (as before
+header set interning), and with interned header sets.
+
+Sources are split between a few modules. Sources of a module include the
+same module header, which pulls in a large part of the synthetic header
+tree, and a header from their own directory.
+
+Usage: header_sets.py [tasks] [modules]
+"""
+import ast
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from pprint import pprint
+
+from synthetic_tree import generate_tree, header_name, layer_macros
+
+def rss():
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD),
+                ('PageFaultCount', wintypes.DWORD),
+                ('PeakWorkingSetSize', ctypes.c_size_t),
+                ('WorkingSetSize', ctypes.c_size_t),
+                ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                ('PagefileUsage', ctypes.c_size_t),
+                ('PeakPagefileUsage', ctypes.c_size_t)]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(
+            ctypes.windll.kernel32.GetCurrentProcess(),
+            ctypes.byref(counters), counters.cb)
+        return counters.WorkingSetSize
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def generate_sources(work_dir, tasks, modules):
+    include_dir, _ = generate_tree(work_dir, 0)
+    source_files = []
+    for index in range(tasks):
+        module = index % modules
+        source_dir = os.path.join(work_dir, 'module{}'.format(module))
+        os.makedirs(source_dir, exist_ok=True)
+        with open(os.path.join(source_dir, 'local.h'), 'wt') as file:
+            file.write('int local();\n')
+        source_file = os.path.join(source_dir, 'source{}.cpp'.format(index))
+        with open(source_file, 'wt') as file:
+            file.write('#include <{}>\n#include "local.h"\n'.format(
+                header_name(0, module % 10, module // 10)))
+        source_files.append(source_file)
+    return include_dir, source_files
+
+def measure(mode, include_dir, source_files):
+    import preprocessing
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(
+        __file__)), '..'))
+    from buildpal.manager.header_sets import HeaderSetRegistry
+    from buildpal.manager.source_scanner import create_preprocessing_context
+
+    preprocessor = preprocessing.Preprocessor(preprocessing.Cache())
+    pp_ctx = create_preprocessing_context([include_dir], [], [],
+        layer_macros())
+    registry = HeaderSetRegistry()
+    # Warm up caches, so that only memory kept by tasks is measured.
+    preprocessor.scan_headers_batch(pp_ctx, source_files, manifest=True)
+
+    tasks = []
+    def keep_old(index, result):
+        header_info, missing_headers, manifest = result
+        filelist = tuple((dir, tuple((file, content_entry.checksum()) for
+            file, relative, content_entry in data if not relative)) for dir,
+            data in header_info)
+        tasks.append((header_info, missing_headers, filelist))
+
+    def keep_interned(index, result):
+        header_info, missing_headers, manifest = result
+        tasks.append(registry.intern(header_info, manifest) +
+            (missing_headers,))
+
+    before = rss()
+    preprocessor.scan_headers_batch(pp_ctx, source_files, keep_old if mode ==
+        'before' else keep_interned, manifest=True)
+    return dict(tasks=len(tasks), rss_per_task=(rss() - before) / len(tasks),
+        header_sets=registry.stats()[0])
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] in ('before', 'after'):
+        # Child process, measures a single mode.
+        include_dir, sources_list = sys.argv[2:]
+        with open(sources_list, 'rt') as file:
+            source_files = file.read().splitlines()
+        print(repr(measure(sys.argv[1], include_dir, source_files)))
+        sys.exit(0)
+
+    tasks = 5000 if len(sys.argv) < 2 else int(sys.argv[1])
+    modules = 10 if len(sys.argv) < 3 else int(sys.argv[2])
+    work_dir = tempfile.mkdtemp()
+    include_dir, source_files = generate_sources(work_dir, tasks, modules)
+    sources_list = os.path.join(work_dir, 'sources.txt')
+    with open(sources_list, 'wt') as file:
+        file.write('\n'.join(source_files))
+
+    results = {}
+    for mode in ('before', 'after'):
+        output = subprocess.check_output([sys.executable, __file__, mode,
+            include_dir, sources_list], universal_newlines=True)
+        results[mode] = ast.literal_eval(output.splitlines()[-1])
+    results['reduction'] = results['before']['rss_per_task'] / \
+        max(results['after']['rss_per_task'], 1)
+    pprint(results)
+    shutil.rmtree(work_dir)
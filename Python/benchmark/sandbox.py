@@ -0,0 +1,74 @@
+"""
+Measures server sessions per second for each sandbox backend.
+
+Every session mimics what the server does for a single task: it writes
+the source file and non-shared headers to the sandbox, runs a stand-in
+compiler which reads all of them and writes an object file, reads the
+object file back and finally releases the sandbox.
+
+Usage: sandbox.py [sessions] [memory_dir]
+"""
+import os
+import subprocess
+import sys
+import time
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+from pprint import pprint
+
+# Import sandbox module directly, buildpal.server package requires Windows
+# only extensions.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..', 'buildpal', 'server'))
+from sandbox import create_sandbox
+
+sessions = 500 if len(sys.argv) < 2 else int(sys.argv[1])
+memory_dir = '/dev/shm/BuildPal' if len(sys.argv) < 3 else sys.argv[2]
+
+headers_per_session = 40
+header_size = 16 * 1024
+source_size = 64 * 1024
+memory_budget = 256 * 1024 * 1024
+
+# Stand-in compiler: concatenate all inputs into the object file.
+stand_in_compiler = ['/bin/sh', '-c', 'out="$1"; shift; cat "$@" > "$out"',
+    'stand_in_compiler']
+
+header_content = os.urandom(header_size)
+source_content = os.urandom(source_size)
+
+def run_session(sandbox, session_id):
+    inputs = [sandbox.create_file(session_id, header_content) for x in
+        range(headers_per_session)]
+    inputs.append(sandbox.create_file(session_id, source_content))
+    obj_handle, object_file = tempfile.mkstemp(
+        dir=sandbox.artifact_dir(session_id), suffix='.obj')
+    os.close(obj_handle)
+    subprocess.check_call(stand_in_compiler + [object_file] + inputs)
+    with open(object_file, 'rb') as obj:
+        obj.read()
+    sandbox.release(session_id)
+
+def measure(name, sandbox):
+    with ThreadPoolExecutor(cpu_count()) as executor:
+        start = time.time()
+        for future in [executor.submit(run_session, sandbox, session_id)
+                for session_id in range(sessions)]:
+            future.result()
+        duration = time.time() - start
+    stats = sandbox.stats()
+    sandbox.close()
+    return name, dict(sessions_per_second=sessions / duration,
+        duration=duration, stats=stats)
+
+scratch_dir = tempfile.mkdtemp()
+results = [
+    measure('disk', create_sandbox(scratch_dir)),
+    measure('memory', create_sandbox(scratch_dir, memory_dir, memory_budget)),
+    measure('memory (tight budget)', create_sandbox(scratch_dir, memory_dir,
+        headers_per_session * header_size // 2)),
+]
+os.rmdir(scratch_dir)
+pprint(results)
@@ -0,0 +1,61 @@
+"""
+Synthetic source tree for header scanning benchmarks.
+
+Headers have include guards, include a few headers from the layer below and
+use configuration macros, so that every one of them needs full
+preprocessing.
+"""
+import os
+import random
+
+layers = 10
+dirs_per_layer = 10
+headers_per_dir = 100
+includes_per_header = 4
+includes_per_source = 20
+
+def layer_macros():
+    return ['USE_LAYER_{}'.format(layer) for layer in range(layers)]
+
+def header_name(layer, dir, index):
+    return 'layer{}/dir{}/header{}.h'.format(layer, dir, index)
+
+def random_header(layer):
+    return header_name(layer, random.randrange(dirs_per_layer),
+        random.randrange(headers_per_dir))
+
+def generate_tree(work_dir, sources, source_dirs=1):
+    """
+    Generate headers and sources in work_dir. Sources are spread over
+    source_dirs directories. Returns include directory and list of sources.
+    """
+    random.seed(0)
+    include_dir = os.path.join(work_dir, 'include')
+    for layer in range(layers):
+        for dir in range(dirs_per_layer):
+            os.makedirs(os.path.join(include_dir, 'layer{}'.format(layer),
+                'dir{}'.format(dir)), exist_ok=True)
+            for index in range(headers_per_dir):
+                guard = 'HEADER_{}_{}_{}'.format(layer, dir, index)
+                lines = ['#ifndef {}'.format(guard),
+                    '#define {}'.format(guard)]
+                if layer + 1 < layers:
+                    lines.append('#ifdef USE_LAYER_{}'.format(layer + 1))
+                    lines.extend('#include <{}>'.format(random_header(layer + 1))
+                        for x in range(includes_per_header))
+                    lines.append('#endif')
+                lines.append('int function_{}(int);'.format(guard))
+                lines.append('#endif')
+                with open(os.path.join(include_dir, header_name(layer, dir,
+                        index)), 'wt') as file:
+                    file.write('\n'.join(lines) + '\n')
+    source_files = []
+    for index in range(sources):
+        source_dir = os.path.join(work_dir, 'src{}'.format(index % source_dirs))
+        os.makedirs(source_dir, exist_ok=True)
+        source_file = os.path.join(source_dir, 'source{}.cpp'.format(index))
+        with open(source_file, 'wt') as file:
+            file.write(''.join('#include <{}>\n'.format(random_header(
+                random.randrange(layers))) for x in range(includes_per_source)))
+        source_files.append(source_file)
+    return include_dir, source_files
@@ -0,0 +1,69 @@
+"""
+Reports memory used by timing data of 50k tasks, with each task keeping
+lists of times and names (as before the columnar Timer), and with the
+columnar Timer. Also reports the cost of converting the data for command
+history.
+
+Usage: timing_store.py [tasks]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+from pprint import pprint
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..'))
+from buildpal.common import Timer
+
+tasks = 50000 if len(sys.argv) < 2 else int(sys.argv[1])
+events = [('queued for preprocessing', None),
+    ('dequeued by preprocessor', 'waiting for preprocessor thread'),
+    ('preprocessed', 'preprocessing time'),
+    ('collected from preprocessor', 'preprocessed notification time'),
+    ('taken from unassigned task queue', 'unassigned time'),
+    ('assigned to a server session', 'waiting for server'),
+    ('session successful', 'waiting for session result'),
+    ('completed notification', 'remote completion notification')]
+
+class ListTimer:
+    def __init__(self):
+        self.times = []
+        self.time_point_names = []
+        self.time_interval_names = []
+
+    def note_time(self, time_point_name, time_interval_name=None):
+        self.times.append(time.time())
+        self.time_point_names.append(time_point_name)
+        self.time_interval_names.append(time_interval_name)
+
+    def info(self):
+        return list(dict(time_point_ord=o, time_point_name=n, time_point=t)
+            for o, (n, t) in enumerate(zip(self.time_point_names,
+            self.times)))
+
+class ColumnarTimer(Timer):
+    def info(self):
+        return self.time_point_names(), self.times[:]
+
+def measure(timer_type):
+    tracemalloc.start()
+    timers = [timer_type() for task in range(tasks)]
+    for time_point_name, time_interval_name in events:
+        for timer in timers:
+            timer.note_time(time_point_name, time_interval_name)
+    memory, peak = tracemalloc.get_traced_memory()
+    start = time.time()
+    infos = [timer.info() for timer in timers]
+    info_duration = time.time() - start
+    info_memory = tracemalloc.get_traced_memory()[0] - memory
+    tracemalloc.stop()
+    return dict(bytes_per_task=memory / tasks,
+        info_bytes_per_task=info_memory / tasks,
+        info_tasks_per_second=tasks / info_duration)
+
+results = dict(lists=measure(ListTimer), columnar=measure(ColumnarTimer))
+results['reduction'] = results['lists']['bytes_per_task'] / \
+    results['columnar']['bytes_per_task']
+pprint(results)
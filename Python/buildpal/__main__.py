@@ -17,6 +17,47 @@ def main(argv, terminator=None):
         default=False, help='Enable debug logging.')
     manager_parser.add_argument('--profile', type=str, default=None,
         help='Profile to use. Must be present in the .ini file.')
+    manager_parser.add_argument('--separate-pdb', action='store_true',
+        dest='separate_pdb', default=False, help='Compile /Zi sources with '
+        'a PDB file per object file, instead of storing debug info in '
+        'object files (/Z7).')
+    manager_parser.add_argument('--cache-snapshot', metavar='FILE', type=str,
+        default=None, help='File in which header cache is kept between '
+        'manager runs. (default=<temp dir>/BuildPal/HeaderCache/<port>.bin)')
+    manager_parser.add_argument('--no-cache-snapshot', action='store_true',
+        default=False, help='Start with an empty header cache, and do not '
+        'save it on exit.')
+    manager_parser.add_argument('--scan-processes', metavar='#', type=int,
+        default=0, help='Scan headers in this many worker processes, each '
+        'with its own header cache, instead of in threads. (default=0, use '
+        'threads)')
+    manager_parser.add_argument('--cache-budget', metavar='MB', type=int,
+        default=512, help='Memory budget for header cache, least recently '
+        'used entries are evicted once it is exceeded. 0 means no limit. '
+        '(default=512)')
+    manager_parser.add_argument('--content-cache-budget', metavar='MB',
+        type=int, default=100, help='Memory budget for cached file '
+        'contents. (default=100)')
+    manager_parser.add_argument('--map-threshold', metavar='KB', type=int,
+        default=0, help='Memory map headers of at least this size instead '
+        'of reading them. Note that mapped files cannot be modified while '
+        'the manager keeps them cached. (default=0, never map)')
+    manager_parser.add_argument('--history-db', metavar='FILE', type=str,
+        default=None, help='Keep command history in this database between '
+        'manager runs. (default=history is discarded on exit)')
+    manager_parser.add_argument('--history-days', metavar='#', type=int,
+        default=30, help='Remove history older than this many days from '
+        'history database. 0 means no limit. (default=30)')
+    manager_parser.add_argument('--history-commands', metavar='#', type=int,
+        default=0, help='Keep at most this many commands in history '
+        'database. (default=0, no limit)')
+    manager_parser.add_argument('--metrics', metavar='[HOST:]PORT', type=str,
+        default=None, help='Serve statistics in Prometheus text format '
+        'over HTTP on this address. HOST defaults to localhost. '
+        '(default=disabled)')
+    manager_parser.add_argument('--trace', metavar='FILE', type=str,
+        default=None, help='On exit, write trace of commands run by the '
+        'manager to this file, in Chrome trace event format.')
 
     server_parser = subparsers.add_parser('server', aliases=['srv', 's'])
     server_parser.add_argument('--port', '-p', metavar="#", type=int, default=0,
@@ -29,6 +70,30 @@ def main(argv, terminator=None):
         dest='silent', default=False, help='Do not print any output.')
     server_parser.add_argument('--debug', '-d', action='store_true',
         dest='debug', default=False, help='Enable debug logging.')
+    server_parser.add_argument('--sandbox-dir', metavar='DIR', type=str,
+        dest='sandbox_dir', default=None, help='Memory backed directory '
+        '(RAM disk, tmpfs) used for session temporary files.')
+    server_parser.add_argument('--sandbox-size', metavar='MB', type=int,
+        dest='sandbox_size', default=256, help='Maximum size of session '
+        'files kept in sandbox directory. Files which do not fit are stored '
+        'on disk. (default=256)')
+    server_parser.add_argument('--queue-limit', metavar='#', type=int,
+        dest='queue_limit', default=None, help='Maximum number of sessions '
+        'waiting for a job slot. New sessions above this limit are rejected. '
+        '0 means no limit. (default=2 * max-jobs)')
+    server_parser.add_argument('--client-weight', metavar='HOST=W',
+        dest='client_weights', action='append', help='Relative share of '
+        'job slots given to client HOST. (default=1)')
+    server_parser.add_argument('--client-cap', metavar='HOST=#',
+        dest='client_caps', action='append', help='Maximum number of jobs '
+        'client HOST can run concurrently.')
+    server_parser.add_argument('--default-client-cap', metavar='#', type=int,
+        dest='default_client_cap', default=None, help='Maximum number of '
+        'jobs any single client can run concurrently. (default=no limit)')
+    server_parser.add_argument('--metrics', metavar='[HOST:]PORT', type=str,
+        default=None, help='Serve statistics in Prometheus text format '
+        'over HTTP on this address. HOST defaults to localhost. '
+        '(default=disabled)')
 
     client_parser = subparsers.add_parser('client', aliases=['cli', 'c'])
     client_parser.add_argument('--connect', type=str, default='default',
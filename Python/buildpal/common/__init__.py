@@ -2,7 +2,7 @@ from .utils import *
 from .message import MessageProtocol, msg_to_bytes
 
 class ServerTask:
-    def __init__(self, fqdn, compiler_info, call, pch_file, pch_header, forced_includes, include_dirs, src_decorator):
+    def __init__(self, fqdn, compiler_info, call, pch_file, pch_header, forced_includes, include_dirs, src_decorator, artifacts):
         self.fqdn = fqdn
         self.compiler_info = compiler_info
         self.call = call
@@ -11,7 +11,12 @@ class ServerTask:
         self.forced_includes = forced_includes
         self.include_dirs = include_dirs
         self.src_decorator = src_decorator
-        self.filelist = None
+        # List of (name, client filename) pairs. If client filename is not
+        # None, the compiler refers to the artifact by that name.
+        self.artifacts = artifacts
+        # (header set id, manifest). Manifest is None if the server is
+        # expected to already have the header set.
+        self.header_set = None
 
 class CompilerInfo:
     def __init__(self, toolset, executable, compiler_id, macros):
@@ -20,11 +20,21 @@ def _get_multicast_socket(multicast_address=BUILDPAL_MULTICAST_ADDRESS):
 class Beacon:
     discover_string = b'BP_MGR_DISCOVER'
 
-    def __init__(self, slots, server_port):
+    def __init__(self, slots, server_port, load_getter=None):
+        """
+        If given, load_getter should return a 2-tuple (queued sessions,
+        free job slots), which is appended to every response.
+        """
         self.response = b'BP_MGR_SERVER' + struct.pack('!2H32p', server_port, slots, socket.getfqdn().encode())
+        self.load_getter = load_getter
         self.running_cond = Condition()
         self.running = False
 
+    def get_response(self):
+        if self.load_getter is None:
+            return self.response
+        return self.response + struct.pack('!2H', *self.load_getter())
+
     def start(self, multicast_address=BUILDPAL_MULTICAST_ADDRESS,
             port=BUILDPAL_MULTICAST_PORT):
         """
@@ -55,7 +65,7 @@ class Beacon:
             try:
                 data, (addr, port) = self.socket.recvfrom(64)
                 if data[:len(self.discover_string)] == self.discover_string:
-                    self.socket.sendto(self.response, (addr, port))
+                    self.socket.sendto(self.get_response(), (addr, port))
             except OSError:
                 pass
 
@@ -64,6 +74,16 @@ def _parse_response(response, address):
     prefix_len = len(prefix)
     if response[:prefix_len] != prefix:
         return None
+    if len(response) == prefix_len + 2 + 2 + 32 + 2 + 2:
+        port, job_slots, hostname, queued, free_slots = struct.unpack(
+            '!2H32p2H', response[prefix_len:])
+        return {
+            'address' : address,
+            'port' : port,
+            'hostname' : hostname.decode().strip(),
+            'job_slots' : job_slots,
+            'queued' : queued,
+            'free_slots' : free_slots}
     if len(response) == prefix_len + 2 + 2 + 32:
         port, job_slots, hostname = struct.unpack('!2H32p', response[prefix_len:])
         return {
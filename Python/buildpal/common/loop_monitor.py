@@ -0,0 +1,240 @@
+"""
+Event loop lag and executor saturation monitoring.
+
+Manager and server run all protocol handling on a single event loop, and
+offload blocking work to small thread pools. A callback which blocks the
+loop, or a pool which cannot keep up, delays every session.
+"""
+import logging
+import sys
+import traceback
+
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from threading import Condition, Event, Thread, get_ident
+from time import monotonic, time
+
+from .openmetrics import Histogram
+
+# Upper bounds (in seconds) of loop lag and executor wait buckets.
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+class AdaptiveExecutor(Executor):
+    """
+    Thread pool which measures how long submitted calls wait for a worker,
+    and adapts the number of workers to it.
+
+    At most 'workers' calls run at once, the rest wait in a queue. adjust()
+    adds a worker if calls waited more than target_wait seconds on average
+    since the previous adjustment, or the oldest queued call has, and
+    removes one if the pool was never fully busy, staying within
+    [min_workers, max_workers].
+    """
+    def __init__(self, name, min_workers, max_workers, target_wait=0.01):
+        assert 0 < min_workers <= max_workers
+        self.name = name
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.target_wait = target_wait
+        self.workers = min_workers
+        self.executor = ThreadPoolExecutor(max_workers)
+        self.condition = Condition()
+        self.queue = deque()
+        self.running = 0
+        self.shutting_down = False
+        self.completed = 0
+        self.wait_durations = Histogram(LAG_BUCKETS)
+        self.run_durations = Histogram(LAG_BUCKETS)
+        # Since the previous adjustment.
+        self.peak_running = 0
+        self.wait_sum = 0
+        self.waited = 0
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        item = future, fn, args, kwargs, monotonic()
+        with self.condition:
+            if self.shutting_down:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+            if self.running >= self.workers:
+                self.queue.append(item)
+                return future
+            self.__started()
+        self.executor.submit(self.__run, item)
+        return future
+
+    def __started(self):
+        self.running += 1
+        self.peak_running = max(self.peak_running, self.running)
+
+    def __run(self, item):
+        while item is not None:
+            future, fn, args, kwargs, submitted = item
+            started = monotonic()
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+            with self.condition:
+                self.wait_durations.observe(started - submitted)
+                self.run_durations.observe(monotonic() - started)
+                self.wait_sum += started - submitted
+                self.waited += 1
+                self.completed += 1
+                self.running -= 1
+                # Keep this worker busy while there is work, unless the
+                # pool shrank.
+                item = None
+                if self.queue and self.running < self.workers:
+                    item = self.queue.popleft()
+                    self.__started()
+                self.condition.notify_all()
+            del future, fn, args, kwargs
+
+    def queued(self):
+        return len(self.queue)
+
+    def threads(self):
+        return list(getattr(self.executor, '_threads', ()))
+
+    def adjust(self):
+        """
+        Adapt the number of workers to wait time since the previous call.
+        Returns the new number of workers.
+        """
+        start = []
+        with self.condition:
+            average_wait = self.wait_sum / self.waited if self.waited else 0
+            oldest_wait = monotonic() - self.queue[0][4] if self.queue else 0
+            if max(average_wait, oldest_wait) > self.target_wait and \
+                    self.workers < self.max_workers:
+                self.workers += 1
+            elif self.peak_running < self.workers and not self.queue and \
+                    self.workers > self.min_workers:
+                self.workers -= 1
+            while self.queue and self.running < self.workers:
+                start.append(self.queue.popleft())
+                self.__started()
+            self.peak_running = self.running
+            self.wait_sum = 0
+            self.waited = 0
+            workers = self.workers
+        for item in start:
+            self.executor.submit(self.__run, item)
+        return workers
+
+    def shutdown(self, wait=True):
+        with self.condition:
+            self.shutting_down = True
+            if wait:
+                self.condition.wait_for(lambda : not self.queue and not
+                    self.running)
+        self.executor.shutdown(wait)
+
+class LoopMonitor:
+    """
+    Measures event loop lag - how late a callback scheduled every interval
+    seconds runs. A watchdog thread notices when the loop has not run the
+    callback for more than slow_threshold seconds, and logs the stack of
+    the loop thread, i.e. of the callback blocking it. Executors are
+    adjusted every adjust_interval seconds.
+    """
+    def __init__(self, loop, interval=0.1, slow_threshold=0.5,
+            executors=(), adjust_interval=1, max_stalls=10):
+        self.loop = loop
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.executors = list(executors)
+        self.adjust_interval = adjust_interval
+        self.lag = Histogram(LAG_BUCKETS)
+        self.max_lag = 0
+        self.slow_callbacks = 0
+        # (time, stack) of recent stalls, newest last.
+        self.stalls = deque(maxlen=max_stalls)
+        self.loop_thread = None
+        self.heartbeat = None
+        self.expected = None
+        self.last_adjust = None
+        self.handle = None
+        self.stop_event = Event()
+        self.watchdog = None
+
+    def start(self):
+        """
+        Start monitoring, must be called on the loop thread.
+        """
+        self.loop_thread = get_ident()
+        self.heartbeat = self.last_adjust = monotonic()
+        self.expected = self.loop.time() + self.interval
+        self.handle = self.loop.call_later(self.interval, self.__tick)
+        self.watchdog = Thread(target=self.__watch, name='Loop watchdog',
+            daemon=True)
+        self.watchdog.start()
+
+    def stop(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        self.stop_event.set()
+
+    def __tick(self):
+        now = self.loop.time()
+        lag = max(now - self.expected, 0)
+        self.lag.observe(lag)
+        self.max_lag = max(self.max_lag, lag)
+        self.heartbeat = monotonic()
+        if self.heartbeat - self.last_adjust >= self.adjust_interval:
+            self.last_adjust = self.heartbeat
+            for executor in self.executors:
+                executor.adjust()
+        self.expected = now + self.interval
+        self.handle = self.loop.call_later(self.interval, self.__tick)
+
+    def __watch(self):
+        reported = None
+        while not self.stop_event.wait(self.slow_threshold / 2):
+            heartbeat = self.heartbeat
+            if heartbeat == reported or monotonic() - heartbeat < \
+                    self.interval + self.slow_threshold:
+                continue
+            # Report each stall once.
+            reported = heartbeat
+            frame = sys._current_frames().get(self.loop_thread)
+            if frame is None:
+                continue
+            stack = ''.join(traceback.format_stack(frame))
+            del frame
+            self.slow_callbacks += 1
+            self.stalls.append((time(), stack))
+            logging.warning("Event loop blocked for more than {:.2f}s, "
+                "in:\n{}".format(self.slow_threshold, stack))
+
+def add_loop_metrics(exposition, monitor):
+    """
+    Add loop lag, and saturation of monitored executors.
+    """
+    exposition.histogram('loop_lag_seconds', 'Event loop lag.', [(None,
+        monitor.lag)])
+    exposition.gauge('loop_max_lag_seconds', 'Largest event loop lag.',
+        monitor.max_lag)
+    exposition.counter('loop_stalls_total', 'Times the event loop was '
+        'blocked for longer than the slow callback threshold.',
+        monitor.slow_callbacks)
+    executors = [({'executor' : executor.name}, executor) for executor in
+        monitor.executors]
+    exposition.add('executor_workers', 'gauge', 'Current executor size.',
+        ((labels, executor.workers) for labels, executor in executors))
+    exposition.add('executor_running', 'gauge', 'Calls running.',
+        ((labels, executor.running) for labels, executor in executors))
+    exposition.add('executor_queued', 'gauge', 'Calls waiting for a worker.',
+        ((labels, executor.queued()) for labels, executor in executors))
+    exposition.add('executor_completed_total', 'counter', 'Calls completed.',
+        ((labels, executor.completed) for labels, executor in executors))
+    exposition.histogram('executor_wait_seconds',
+        'Time calls waited for a worker.', ((labels, executor.wait_durations)
+        for labels, executor in executors))
+    exposition.histogram('executor_run_seconds', 'Duration of calls.',
+        ((labels, executor.run_durations) for labels, executor in executors))
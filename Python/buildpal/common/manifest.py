@@ -0,0 +1,69 @@
+"""
+Shared file manifest - list of headers (with their checksums) which are
+candidates for the server's header cache. The manager gets it from the
+preprocessing extension, already built during the scan, and sends it to
+the server as is.
+
+Layout, all integers are little endian:
+
+    u32 directory count
+    for each directory:
+        u32 length, directory name (UTF-8)
+        u32 file count
+        for each file:
+            u32 length, file name (UTF-8)
+            u64 checksum
+"""
+import struct
+
+_u32 = struct.Struct('<I')
+_u64 = struct.Struct('<Q')
+
+def create_manifest(shared_files):
+    """
+    Create manifest from an iterable of (dir, [(name, checksum), ...]).
+    """
+    result = bytearray()
+    shared_files = [(dir, files) for dir, files in shared_files]
+    result += _u32.pack(len(shared_files))
+    for dir, files in shared_files:
+        files = list(files)
+        dir = dir.encode()
+        result += _u32.pack(len(dir))
+        result += dir
+        result += _u32.pack(len(files))
+        for name, checksum in files:
+            name = name.encode()
+            result += _u32.pack(len(name))
+            result += name
+            result += _u64.pack(checksum)
+    return bytes(result)
+
+def iter_manifest(manifest):
+    """
+    Iterate over manifest, yields (dir, [(name, checksum), ...]).
+    """
+    data = memoryview(manifest)
+    offset = 0
+
+    def read_string():
+        nonlocal offset
+        length, = _u32.unpack_from(data, offset)
+        offset += _u32.size
+        value = data[offset:offset + length].tobytes().decode()
+        offset += length
+        return value
+
+    dir_count, = _u32.unpack_from(data, offset)
+    offset += _u32.size
+    for dir_index in range(dir_count):
+        dir = read_string()
+        file_count, = _u32.unpack_from(data, offset)
+        offset += _u32.size
+        files = []
+        for file_index in range(file_count):
+            name = read_string()
+            checksum, = _u64.unpack_from(data, offset)
+            offset += _u64.size
+            files.append((name, checksum))
+        yield dir, files
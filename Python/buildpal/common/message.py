@@ -1,7 +1,9 @@
 import asyncio
+import re
 import struct
 import sys
 
+from collections import defaultdict
 from io import BytesIO
 
 class MemoryViewWrapper:
@@ -44,7 +46,48 @@ def msg_from_bytes(memview):
         yield MemoryViewWrapper(memview[offset:offset+part_len])
         offset += part_len
 
+MESSAGE_TYPE = re.compile(b'[A-Z][A-Z_]+$')
+
+def message_type(msg):
+    """
+    Name of the message type, for statistics. Messages may be prefixed by
+    (binary) session ids, so this is the first part which looks like a
+    message name. Chunks of files have no name.
+    """
+    for part in msg[:3]:
+        if isinstance(part, MemoryViewWrapper):
+            part = part.memory()
+        if len(part) <= 32:
+            part = bytes(part)
+            if MESSAGE_TYPE.match(part):
+                return part.decode()
+    return 'DATA'
+
+class MessageStats:
+    """
+    Number of messages and bytes sent and received per message type, by
+    all MessageProtocol connections of the process.
+    """
+    def __init__(self):
+        # Message type to [messages, bytes].
+        self.sent = defaultdict(lambda : [0, 0])
+        self.received = defaultdict(lambda : [0, 0])
+
+    @staticmethod
+    def __add(stats, msg, size):
+        entry = stats[message_type(msg)]
+        entry[0] += 1
+        entry[1] += size
+
+    def add_sent(self, msg, size):
+        self.__add(self.sent, msg, size)
+
+    def add_received(self, msg, size):
+        self.__add(self.received, msg, size)
+
 class MessageProtocol(asyncio.Protocol):
+    stats = MessageStats()
+
     def __init__(self):
         self.len_buff = bytearray(4)
         self.len_offset = 0
@@ -69,6 +112,7 @@ class MessageProtocol(asyncio.Protocol):
 
     def send_msg(self, msg):
         if self.transport:
+            self.stats.add_sent(msg, 6 + sum(len(m) + 4 for m in msg))
             self.transport.writelines(msg_to_bytes(msg))
 
     def data_received(self, data):
@@ -93,7 +137,10 @@ class MessageProtocol(asyncio.Protocol):
                 data_offset += to_add
 
                 if to_add == remaining:
-                    self.process_msg(tuple(msg_from_bytes(self.msg_data.getbuffer()[:self.msg_len])))
+                    msg = tuple(msg_from_bytes(self.msg_data.getbuffer()[:self.msg_len]))
+                    self.stats.add_received(msg, 4 + self.msg_len)
+                    self.process_msg(msg)
+                    del msg
                     assert sys.getrefcount(self.msg_data) == 2, "never store message references!"
                     self.msg_len = None
 
@@ -0,0 +1,198 @@
+"""
+Statistics in Prometheus text exposition format, served over HTTP.
+
+Nothing is computed until the endpoint is scraped. Producers only keep
+plain counters and Histograms, so the endpoint can be left enabled.
+
+Given a SamplingProfiler, the endpoint also serves /profile?seconds=N,
+which profiles the process for N seconds and returns collapsed stacks.
+"""
+import asyncio
+import logging
+
+from bisect import bisect_left
+from urllib.parse import parse_qs
+
+# Upper bounds (in seconds) of latency histogram buckets.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        # Last bucket counts values above all bounds.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+def escape_label(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace(
+        '"', r'\"')
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join('{}="{}"'.format(name,
+        escape_label(value)) for name, value in sorted(labels.items())))
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(int(value))
+
+class Exposition:
+    """
+    Builds a metrics page. Metric names are prefixed with 'buildpal_'.
+    """
+    def __init__(self):
+        self.lines = []
+
+    def add(self, name, type, help, samples):
+        """
+        Add a metric family of the given type ('counter' or 'gauge').
+        samples are (labels, value) pairs, labels is a dict.
+        """
+        name = 'buildpal_' + name
+        self.lines.append('# HELP {} {}'.format(name, help))
+        self.lines.append('# TYPE {} {}'.format(name, type))
+        for labels, value in samples:
+            self.lines.append('{}{} {}'.format(name, format_labels(labels),
+                format_value(value)))
+
+    def counter(self, name, help, value, labels=None):
+        self.add(name, 'counter', help, [(labels, value)])
+
+    def gauge(self, name, help, value, labels=None):
+        self.add(name, 'gauge', help, [(labels, value)])
+
+    def histogram(self, name, help, histograms):
+        """
+        histograms are (labels, Histogram) pairs.
+        """
+        name = 'buildpal_' + name
+        self.lines.append('# HELP {} {}'.format(name, help))
+        self.lines.append('# TYPE {} histogram'.format(name))
+        for labels, histogram in histograms:
+            labels = labels or {}
+            cumulative = 0
+            for bound, count in zip(histogram.bounds + (float('inf'),),
+                    histogram.counts):
+                cumulative += count
+                self.lines.append('{}_bucket{} {}'.format(name,
+                    format_labels(dict(labels, le=format_value(float(
+                    bound)))), cumulative))
+            self.lines.append('{}_sum{} {}'.format(name,
+                format_labels(labels), format_value(float(histogram.sum))))
+            self.lines.append('{}_count{} {}'.format(name,
+                format_labels(labels), histogram.count))
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+def add_message_metrics(exposition, stats):
+    """
+    Add message counts and sizes from a buildpal.common.MessageStats.
+    """
+    for direction, per_type in (('sent', stats.sent), ('received',
+            stats.received)):
+        per_type = sorted(per_type.items())
+        exposition.add('messages_{}_total'.format(direction), 'counter',
+            'Messages {} per message type.'.format(direction),
+            (({'type' : type}, messages) for type, (messages, size) in
+            per_type))
+        exposition.add('message_bytes_{}_total'.format(direction), 'counter',
+            'Bytes {} per message type.'.format(direction),
+            (({'type' : type}, size) for type, (messages, size) in
+            per_type))
+
+METRICS_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class MetricsProtocol(asyncio.Protocol):
+    max_request = 8 * 1024
+    max_profile_seconds = 300
+
+    def __init__(self, loop, collect, profiler=None):
+        self.loop = loop
+        self.collect = collect
+        self.profiler = profiler
+        self.request = b''
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.transport = None
+
+    def data_received(self, data):
+        self.request += data
+        if b'\r\n\r\n' not in self.request:
+            if len(self.request) > self.max_request:
+                self.respond('400 Bad Request', b'')
+            return
+        method, path = (self.request.split(b'\r\n', 1)[0].split(b' ') +
+            [b'', b''])[:2]
+        path, _, query = path.partition(b'?')
+        if method != b'GET':
+            self.respond('405 Method Not Allowed', b'')
+        elif path == b'/profile' and self.profiler is not None:
+            self.profile(query)
+        elif path not in (b'/', b'/metrics'):
+            self.respond('404 Not Found', b'')
+        else:
+            try:
+                body = self.collect().text().encode()
+            except Exception:
+                logging.exception("Failed to collect metrics.")
+                self.respond('500 Internal Server Error', b'')
+            else:
+                self.respond('200 OK', body, METRICS_TYPE)
+
+    def profile(self, query):
+        try:
+            seconds = float(parse_qs(query.decode()).get('seconds', ['10'])[0])
+        except ValueError:
+            self.respond('400 Bad Request', b'')
+            return
+        seconds = min(max(seconds, 0), self.max_profile_seconds)
+        def completed(stacks):
+            self.loop.call_soon_threadsafe(self.respond, '200 OK',
+                stacks.encode())
+        if not self.profiler.start(seconds, completed):
+            self.respond('409 Conflict', b'Profiler is already running.\n')
+
+    def respond(self, status, body, content_type='text/plain; charset=utf-8'):
+        if self.transport is None:
+            return
+        self.transport.write('HTTP/1.0 {}\r\nContent-Type: {}\r\n'
+            'Content-Length: {}\r\nConnection: close\r\n\r\n'.format(
+            status, content_type, len(body)).encode())
+        self.transport.write(body)
+        self.transport.close()
+        self.transport = None
+
+def parse_address(address):
+    """
+    Parse '[host:]port', host defaults to localhost.
+    """
+    host, sep, port = address.rpartition(':')
+    return host or 'localhost', int(port)
+
+def start_metrics_server(loop, address, collect, profiler=None):
+    """
+    Serve metrics returned by collect() (an Exposition) on the (host,
+    port) address, and profiles taken by profiler, if given. Returns the
+    asyncio server.
+    """
+    host, port = address
+    return loop.run_until_complete(loop.create_server(
+        lambda : MetricsProtocol(loop, collect, profiler), host=host,
+        port=port))
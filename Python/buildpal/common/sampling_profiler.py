@@ -0,0 +1,111 @@
+import os
+import sys
+import threading
+
+from collections import Counter
+from threading import Event, Lock, Thread, get_ident
+from time import time
+
+class SamplingProfiler:
+    """
+    Wall clock sampling profiler for all Python threads.
+
+    While running, a background thread takes stacks of all other threads
+    every interval seconds (sys._current_frames()) and counts them. Nothing
+    is done while the profiler is stopped, so it can be kept around and
+    started when needed.
+
+    Results are collapsed stacks - 'thread;outermost;...;innermost count'
+    lines, as consumed by flame graph tools. Threads blocked waiting (e.g.
+    an idle event loop) are sampled as well.
+    """
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.lock = Lock()
+        self.thread = None
+        self.stop_event = Event()
+        self.executors = {}
+        # Code object to frame label.
+        self.labels = {}
+
+    def add_executor(self, name, executor):
+        """
+        Show worker threads of a concurrent.futures executor under name.
+        """
+        self.executors[name] = executor
+
+    def is_running(self):
+        return self.thread is not None
+
+    def start(self, duration, on_completion=None):
+        """
+        Sample for duration seconds, or until stopped. on_completion is
+        called from the profiler thread with collapsed stacks. Returns False
+        if the profiler is already running.
+        """
+        with self.lock:
+            if self.thread is not None:
+                return False
+            self.stop_event.clear()
+            self.thread = Thread(target=self.__run, args=(duration,
+                on_completion), name='Profiler', daemon=True)
+            self.thread.start()
+        return True
+
+    def stop(self):
+        self.stop_event.set()
+
+    def __thread_names(self):
+        names = {thread.ident : thread.name for thread in threading.enumerate()}
+        for name, executor in list(self.executors.items()):
+            if hasattr(executor, 'threads'):
+                threads = executor.threads()
+            else:
+                threads = list(getattr(executor, '_threads', ()))
+            for thread in threads:
+                names[thread.ident] = name
+        return names
+
+    def __label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            label = self.labels[code] = '{} ({}:{})'.format(code.co_name,
+                os.path.basename(code.co_filename), code.co_firstlineno)
+        return label
+
+    def sample(self, stacks, names):
+        own_ident = get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            if ident not in names:
+                names.update(self.__thread_names())
+            stack = []
+            while frame is not None:
+                stack.append(self.__label(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, 'Thread-{}'.format(ident)))
+            stack.reverse()
+            stacks[';'.join(stack)] += 1
+
+    def __run(self, duration, on_completion):
+        stacks = Counter()
+        names = self.__thread_names()
+        end = time() + duration
+        try:
+            while True:
+                self.sample(stacks, names)
+                if time() >= end or self.stop_event.wait(self.interval):
+                    break
+        finally:
+            with self.lock:
+                self.thread = None
+        if on_completion is not None:
+            on_completion(collapsed_stacks(stacks))
+
+def collapsed_stacks(stacks):
+    """
+    Format stack counts as collapsed stacks, most frequent first.
+    """
+    return ''.join('{} {}\n'.format(stack, count) for stack, count in
+        stacks.most_common())
@@ -2,6 +2,8 @@ import zlib
 import pstats
 import cProfile
 
+from array import array
+from threading import Lock
 from time import time
 
 def compress_file(fileobj):
@@ -48,21 +50,57 @@ class Profiler:
         self.stats.print_stats()
 
 class Timer:
+    """
+    Records named time points.
+
+    Time point and interval names are interned, and a timer keeps only an
+    array of timestamps and an array of event ids. Timers which noted the
+    same sequence of events share a single tuple of time point names.
+    """
+    __slots__ = ('times', 'events')
+
+    __lock = Lock()
+    # (time point name, time interval name) pairs, indexed by event id.
+    __events = []
+    __event_ids = {}
+    # Event id sequence (as bytes) to tuple of time point names.
+    __timelines = {}
+
     def __init__(self):
-        self.times = []
-        self.time_point_names = []
-        self.time_interval_names = []
+        self.times = array('d')
+        self.events = array('H')
+
+    @classmethod
+    def event_id(cls, time_point_name, time_interval_name=None):
+        key = time_point_name, time_interval_name
+        id = cls.__event_ids.get(key)
+        if id is None:
+            with cls.__lock:
+                id = cls.__event_ids.get(key)
+                if id is None:
+                    id = len(cls.__events)
+                    cls.__events.append(key)
+                    cls.__event_ids[key] = id
+        return id
 
     def note_time(self, time_point_name, time_interval_name=None):
-        curr_time = time()
-        self.times.append(curr_time)
-        self.time_point_names.append(time_point_name)
-        self.time_interval_names.append(time_interval_name)
+        self.events.append(self.event_id(time_point_name,
+            time_interval_name))
+        self.times.append(time())
+
+    def time_point_names(self):
+        key = self.events.tobytes()
+        names = self.__timelines.get(key)
+        if names is None:
+            names = tuple(self.__events[id][0] for id in self.events)
+            with self.__lock:
+                names = self.__timelines.setdefault(key, names)
+        return names
 
     def time_points(self):
-        return enumerate(zip(self.time_point_names, self.times))
+        return enumerate(zip(self.time_point_names(), self.times))
 
     def time_durations(self):
-        return ((x - 1, (self.time_interval_names[x],
-            self.times[x] - self.times[x - 1])) \
-            for x in range(1, len(self.time_interval_names)))
+        events, times = self.__events, self.times
+        return ((x - 1, (events[self.events[x]][1], times[x] - times[x - 1]))
+            for x in range(1, len(times)))
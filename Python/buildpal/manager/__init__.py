@@ -4,11 +4,13 @@ from .runner import ManagerRunner
 from .node_info import NodeInfo
 
 from buildpal.common.beacon import get_nodes_from_beacons
+from buildpal.common.openmetrics import parse_address
 
 import os
 import sys
 import subprocess
 import configparser
+import tempfile
 
 from threading import Thread
 from time import sleep
@@ -84,6 +86,8 @@ class NodeDetector(NodeInfoGetter):
             node_info = self.all_node_infos.get(node_id)
             if not node_info:
                 node_info = self.all_node_infos[node_id] = NodeInfo(node)
+            if 'queued' in node:
+                node_info.set_server_load(node['queued'], node['free_slots'])
             return node_info
         nodes = [get_node_info(node) for node in get_nodes_from_beacons()]
         nodes_disappeared = []
@@ -119,6 +123,21 @@ def main(opts, terminator=None):
     else:
         port = opts.port
 
+    if opts.no_cache_snapshot:
+        cache_snapshot = None
+    elif opts.cache_snapshot is None:
+        cache_snapshot = os.path.join(tempfile.gettempdir(), 'BuildPal',
+            'HeaderCache', '{}.bin'.format(port))
+    else:
+        cache_snapshot = opts.cache_snapshot
+
+    cache_budget = opts.cache_budget * 1024 * 1024
+    content_cache_budget = opts.content_cache_budget * 1024 * 1024
+    runner_options = dict(history_db=opts.history_db,
+        history_days=opts.history_days, history_commands=opts.history_commands,
+        metrics_address=parse_address(opts.metrics) if opts.metrics else None,
+        trace_file=opts.trace)
+
     if opts.profile is None:
         node_info_getter = NodeDetector()
     else:
@@ -128,7 +147,11 @@ def main(opts, terminator=None):
         node_info_getter = FixedNodeList(get_config(opts.ini_file), opts.profile)
 
     if opts.ui == 'gui':
-        app = BPManagerApp(node_info_getter, port)
+        manager_runner = ManagerRunner(port, 0, opts.separate_pdb,
+            cache_snapshot, opts.scan_processes, cache_budget,
+            content_cache_budget, opts.map_threshold * 1024,
+            **runner_options)
+        app = BPManagerApp(node_info_getter, port, manager_runner.profile)
         app.title('BuildPal Manager')
 
         def run(runner):
@@ -140,8 +163,7 @@ def main(opts, terminator=None):
         def wait():
             app.mainloop()
 
-        manager_runner = ManagerRunner(port, 0)
-        thread = Thread(target=run, args=(manager_runner,))
+        thread = Thread(target=run, args=(manager_runner,), name='Manager')
         thread.start()
         try:
             wait()
@@ -151,7 +173,10 @@ def main(opts, terminator=None):
 
     else:
         try:
-            manager_runner = ManagerRunner(port, 0)
+            manager_runner = ManagerRunner(port, 0, opts.separate_pdb,
+                cache_snapshot, opts.scan_processes, cache_budget,
+                content_cache_budget, opts.map_threshold * 1024,
+                **runner_options)
             if terminator:
                 terminator.initialize(manager_runner.stop)
             manager_runner.run(node_info_getter, silent=opts.ui == 'none')
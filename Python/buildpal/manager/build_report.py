@@ -0,0 +1,293 @@
+"""
+Post-build analysis of command history.
+
+Manager does not know dependencies between commands, they are decided by
+the build system on the client. Critical path is therefore reconstructed
+backwards from the last command to complete: the command before it on the
+path is the last one to complete before it started. Time between the two
+is spent on the client (linking, build system). Within a command, the path
+follows the task which completed last.
+"""
+from .compile_session import SessionResult
+from .trace import Span, command_end, session_spans, task_spans
+
+from collections import defaultdict
+from operator import itemgetter
+from time import time
+
+# Time on the client between two commands on the critical path.
+CLIENT = 'client'
+# Manager work within a command, outside of its critical task.
+MANAGER = 'manager'
+# Part of a task spent in a session, not covered by session spans.
+REMOTE = 'remote'
+
+class BuildReport:
+    """
+    started, completed - build start and end time.
+    critical_path - (name, start, end, segments) tuples, segments are Spans
+        covering the step.
+    attribution - (category, seconds) pairs of critical path time, largest
+        first.
+    utilization - dict of node to (average, peak, buckets) of concurrently
+        running jobs, buckets are averages over bucket_length seconds.
+    slowest_tasks - (source, duration, ((category, seconds), ...)) tuples.
+    """
+    def __init__(self, started, completed, commands, tasks, critical_path,
+            attribution, utilization, bucket_length, slowest_tasks):
+        self.started = started
+        self.completed = completed
+        self.commands = commands
+        self.tasks = tasks
+        self.critical_path = critical_path
+        self.attribution = attribution
+        self.utilization = utilization
+        self.bucket_length = bucket_length
+        self.slowest_tasks = slowest_tasks
+
+    @property
+    def duration(self):
+        return self.completed - self.started
+
+def clip(spans, start, end, filler):
+    """
+    Clip spans to [start, end], and fill gaps between them with spans of
+    the filler category.
+    """
+    result = []
+    cursor = start
+    for span in spans:
+        span_start, span_end = max(span.start, cursor), min(span.end, end)
+        if span_end <= span_start:
+            continue
+        if span_start > cursor:
+            result.append(Span(filler, filler, cursor, span_start, None))
+        result.append(span._replace(start=span_start, end=span_end))
+        cursor = span_end
+    if cursor < end:
+        result.append(Span(filler, filler, cursor, end, None))
+    return result
+
+def task_segments(task):
+    """
+    Consecutive spans covering the task. Time spent in a session is split
+    according to the successful session's spans.
+    """
+    spans = task_spans(task)
+    if not spans:
+        return []
+    successful = [session for session in task['sessions'] if
+        session['result'] == SessionResult.success]
+    result = []
+    for span in spans[1:]:
+        if span.category == REMOTE and successful:
+            result.extend(clip(session_spans(successful[0],
+                task['source'])[1:], span.start, span.end, REMOTE))
+        else:
+            result.append(span)
+    return result
+
+def task_end(task):
+    times = task['times'][1]
+    return times[-1] if times else None
+
+def command_start(command):
+    if command.get('started') is not None:
+        return command['started']
+    return min((task['times'][1][0] for task in command['tasks'] if
+        task['times'][1]), default=command_end(command))
+
+def critical_path(commands):
+    """
+    Returns critical path steps, see BuildReport.
+    """
+    by_completion = sorted(commands, key=command_end)
+    path = []
+    end = None
+    while by_completion:
+        command = by_completion.pop()
+        completed = command_end(command)
+        if end is not None:
+            if completed > end:
+                continue
+            if completed < end:
+                path.append((CLIENT, completed, end, [Span(CLIENT, CLIENT,
+                    completed, end, None)]))
+        start = command_start(command)
+        tasks = [task for task in command['tasks'] if task_end(task) is not
+            None]
+        segments = []
+        if tasks:
+            task = max(tasks, key=task_end)
+            segments = clip(task_segments(task), start, completed, MANAGER)
+        elif completed > start:
+            segments = [Span(MANAGER, MANAGER, start, completed, None)]
+        path.append((command['command'], start, completed, segments))
+        end = start
+    path.reverse()
+    return path
+
+def attribute(steps):
+    totals = defaultdict(float)
+    for name, start, end, segments in steps:
+        for segment in segments:
+            totals[segment.category] += segment.end - segment.start
+    return sorted(totals.items(), key=itemgetter(1), reverse=True)
+
+def node_jobs(commands):
+    """
+    Returns dict of node to (start, end) intervals during which it ran a
+    job for the build. Sessions with server times contribute the time the
+    compiler ran, others the whole session.
+    """
+    jobs = defaultdict(list)
+    for command in commands:
+        for task in command['tasks']:
+            for session in task['sessions']:
+                node = '{}:{}'.format(session['hostname'], session['port'])
+                interval = session['started'], session['completed']
+                if session.get('server_times') is not None:
+                    points = dict(zip(*session['server_times']))
+                    if 'compile slot acquired' in points and \
+                            'compilation done' in points:
+                        interval = (points['compile slot acquired'],
+                            points['compilation done'])
+                jobs[node].append(interval)
+    return jobs
+
+def utilization(jobs, started, completed, buckets):
+    """
+    Returns (average, peak, per bucket averages) of concurrently running
+    jobs, and bucket length.
+    """
+    bucket_length = max(completed - started, 1e-6) / buckets
+    result = {}
+    for node, intervals in jobs.items():
+        busy = [0.0] * buckets
+        changes = []
+        for start, end in intervals:
+            start, end = max(start, started), min(end, completed)
+            if end <= start:
+                continue
+            changes.append((start, 1))
+            changes.append((end, -1))
+            first = int((start - started) / bucket_length)
+            last = min(int((end - started) / bucket_length), buckets - 1)
+            for bucket in range(first, last + 1):
+                bucket_start = started + bucket * bucket_length
+                busy[bucket] += min(end, bucket_start + bucket_length) - \
+                    max(start, bucket_start)
+        peak = running = 0
+        # Jobs ending at a moment are counted out before those starting.
+        for moment, change in sorted(changes):
+            running += change
+            peak = max(peak, running)
+        result[node] = (sum(busy) / (bucket_length * buckets), peak,
+            [value / bucket_length for value in busy])
+    return result, bucket_length
+
+def slowest_tasks(commands, count):
+    tasks = []
+    for command in commands:
+        for task in command['tasks']:
+            times = task['times'][1]
+            if not times:
+                continue
+            totals = defaultdict(float)
+            for segment in clip(task_segments(task), times[0], times[-1],
+                    MANAGER):
+                totals[segment.category] += segment.end - segment.start
+            tasks.append((task['source'], times[-1] - times[0], tuple(sorted(
+                totals.items(), key=itemgetter(1), reverse=True))))
+    tasks.sort(key=itemgetter(1), reverse=True)
+    return tasks[:count]
+
+def analyze_build(commands, buckets=20, top=10):
+    """
+    Analyze a build from command infos, as stored in command history.
+    Returns a BuildReport, or None if there are no commands.
+    """
+    commands = list(commands)
+    if not commands:
+        return None
+    started = min(command_start(command) for command in commands)
+    completed = max(command_end(command) for command in commands)
+    steps = critical_path(commands)
+    if steps and steps[0][1] > started:
+        steps.insert(0, (CLIENT, started, steps[0][1], [Span(CLIENT, CLIENT,
+            started, steps[0][1], None)]))
+    node_utilization, bucket_length = utilization(node_jobs(commands),
+        started, completed, buckets)
+    return BuildReport(started, completed, len(commands), sum(len(
+        command['tasks']) for command in commands), steps, attribute(steps),
+        node_utilization, bucket_length, slowest_tasks(commands, top))
+
+def analyze_history(database, conn, first=None, **kwargs):
+    """
+    Analyze commands from command history, starting with the command with
+    rowid first.
+    """
+    return analyze_build((database.get_command(conn, rowid) for rowid in
+        database.command_ids(conn, first)), **kwargs)
+
+def format_report(report):
+    """
+    Returns report as lines of text.
+    """
+    duration = report.duration or 1
+    lines = ["Build took {:.2f}s, {} commands, {} tasks".format(
+        report.duration, report.commands, report.tasks)]
+    lines.append("Critical path time")
+    for category, seconds in report.attribution:
+        lines.append('    {:-<35} {:->10.2f}s {:->6.1%}'.format(category,
+            seconds, seconds / duration))
+    lines.append("Critical path")
+    for name, start, end, segments in report.critical_path:
+        lines.append('    {:-<35} {:->10.2f}s {}'.format(name[:35],
+            end - start, ', '.join('{} {:.2f}s'.format(category, seconds)
+            for category, seconds in attribute([(name, start, end,
+            segments)]))))
+    lines.append("Jobs per node (every {:.1f}s)".format(report.bucket_length))
+    for node, (average, peak, buckets) in sorted(report.utilization.items()):
+        lines.append('    {:-<35} Average {:->6.2f} Peak {:->4} [{}]'.format(
+            node, average, peak, ' '.join('{:.0f}'.format(value) for value in
+            buckets)))
+    lines.append("Slowest sources")
+    for source, duration, categories in report.slowest_tasks:
+        lines.append('    {:-<35} {:->10.2f}s {}'.format(source[-35:],
+            duration, ', '.join('{} {:.2f}s'.format(category, seconds) for
+            category, seconds in categories)))
+    return lines
+
+class BuildTracker:
+    """
+    Groups commands into builds. A build ends once no client has been
+    connected for idle_time seconds.
+    """
+    def __init__(self, idle_time=5):
+        self.idle_time = idle_time
+        self.clients = 0
+        self.commands = []
+        self.last_activity = 0
+
+    def client_connected(self):
+        self.clients += 1
+        self.last_activity = time()
+
+    def client_disconnected(self):
+        self.clients -= 1
+        self.last_activity = time()
+
+    def command_completed(self, command_info):
+        self.commands.append(command_info)
+        self.last_activity = time()
+
+    def build_completed(self, now=None):
+        """
+        Returns commands of the build if it just completed, None otherwise.
+        """
+        if not self.commands or self.clients > 0 or (now or time()) - \
+                self.last_activity < self.idle_time:
+            return None
+        commands, self.commands = self.commands, []
+        return commands
@@ -1,4 +1,4 @@
-from .task import Task, PreprocessTask
+from .task import Task, PreprocessTask, PreprocessContext
 from .gui_event import GUIEvent
 
 from buildpal.common import ServerTask
@@ -7,6 +7,7 @@ import os
 import struct
 import logging
 from socket import getfqdn
+from time import time
 
 class ClientTaskCompiler:
     def __init__(self, client_conn):
@@ -59,7 +60,8 @@ class CommandProcessor:
     hostname = getfqdn()
 
     def __init__(self, client_conn, executable, cwd, sysinclude_dirs, compiler,
-            command, database_inserter, global_timer, update_ui):
+            command, database_inserter, global_timer, update_ui,
+            build_tracker=None):
         self.client_conn = client_conn
         self.compiler = compiler
         self.executable = executable
@@ -72,7 +74,11 @@ class CommandProcessor:
         self.__global_timer = global_timer
         self.__update_ui = update_ui
         self.__database_inserter = database_inserter
+        self.__build_tracker = build_tracker
         self.__client_task_compiler = ClientTaskCompiler(client_conn)
+        self.__started = time()
+        # When the client got the result, sessions may still be running.
+        self.__replied = None
 
     def set_compiler_info(self, compiler_info):
         self.compiler_info = compiler_info
@@ -157,9 +163,19 @@ class CommandProcessor:
                 pch_file_stat = os.stat(pch_file)
                 pch_file = (pch_file, pch_file_stat.st_size, pch_file_stat.st_mtime)
 
+        preprocess_context = PreprocessContext(
+            self.__options.implicit_macros() + self.__options.defines()
+                + compiler_info.macros,
+            [os.path.join(self.__cwd, rel_inc) for rel_inc in
+                self.__options.include_dirs()],
+            self.__sysinclude_dirs,
+            self.__options.forced_includes())
+
         def create_task(source, decorator, targets):
             if not os.path.isabs(source):
                 source = os.path.join(self.__cwd, source)
+            artifacts = [(name, os.path.join(self.__cwd, target)) for name,
+                target in targets['artifacts']]
             return Task(
                 ServerTask(
                     self.hostname,
@@ -170,21 +186,16 @@ class CommandProcessor:
                     include_dirs=[os.path.join(self.__cwd, rel_inc) for rel_inc in
                         self.__options.include_dirs()] + self.__sysinclude_dirs,
                     forced_includes=self.__options.forced_includes(),
-                    src_decorator=decorator
-                ),
-                PreprocessTask(
-                    source,
-                    self.__options.implicit_macros() + self.__options.defines()
-                        + compiler_info.macros,
-                    [os.path.join(self.__cwd, rel_inc) for rel_inc in
-                        self.__options.include_dirs()],
-                    self.__sysinclude_dirs,
-                    self.__options.forced_includes(),
-                    pch_header
+                    src_decorator=decorator,
+                    # Object file is always created in server scratch
+                    # directory.
+                    artifacts=[(name, None if name == 'object' else target)
+                        for name, target in artifacts]
                 ),
+                PreprocessTask(source, preprocess_context, pch_header),
                 self,
                 os.path.join(self.__cwd, targets['object_file']),
-                [os.path.join(self.__cwd, target) for target in targets['all']],
+                dict(artifacts),
                 pch_file,
                 source,)
         self.tasks = set(create_task(source, decorator, target) for source,
@@ -208,12 +219,16 @@ class CommandProcessor:
     def all_sessions_done(self, task):
         self.tasks_with_sessions_done.add(task)
         if self.tasks_with_sessions_done == self.tasks:
-            self.__database_inserter.async_insert(self.get_info())
+            command_info = self.get_info()
+            self.__database_inserter.async_insert(command_info)
+            if self.__build_tracker is not None:
+                self.__build_tracker.command_completed(command_info)
 
     def should_invoke_linker(self):
         return self.__options.should_invoke_linker()
 
     def postprocess(self):
+        self.__replied = time()
         exit_error_code = 0
         stdout = b''
         stderr = b''
@@ -251,6 +266,9 @@ class CommandProcessor:
         assert self.tasks_with_sessions_done == self.tasks
         return {
             'command' : ', '.join([x[0] for x in self.__options.source_files()]),
+            'started' : self.__started,
+            'replied' : self.__replied,
+            'completed' : time(),
             'tasks' : [task.get_info() for task in self.tasks]
         }
 
@@ -1,5 +1,6 @@
 from buildpal.common import SimpleTimer, send_file, send_compressed_file
 
+from array import array
 from enum import Enum
 from io import BytesIO
 
@@ -7,6 +8,7 @@ import asyncio
 import logging
 import os
 import pickle
+import struct
 import zipfile
 import zlib
 
@@ -19,11 +21,12 @@ class SessionResult(Enum):
     too_late = 4
     timed_out = 5
     terminated = 6
+    busy = 7
 
 class ServerSession:
     STATE_START = 0
     STATE_WAIT_FOR_MISSING_FILES = 1
-    STATE_RECEIVE_OBJECT_FILE = 2
+    STATE_RECEIVE_RESULT_FILES = 2
     STATE_WAIT_FOR_SERVER_RESPONSE = 3
     STATE_FINISH = 4
 
@@ -50,14 +53,34 @@ class ServerSession:
         self.send_msg = send_msg
         self.sender = None
         self.completion_callback = completion_callback
+        self.time_responded = None
+        self.time_result_received = None
+        # Estimated server clock offset, and server time points converted
+        # to manager clock, as (names, times).
+        self.clock_offset = None
+        self.server_times = None
 
     def start(self):
         assert self.state == self.STATE_START
         self.send_msg([b'NEW_SESSION', self.local_id,
-            b'SERVER_TASK', pickle.dumps(self.task.server_task)])
+            b'SERVER_TASK', self.__pickle_server_task()])
         self.state = self.STATE_WAIT_FOR_MISSING_FILES
         self.time_started = time()
 
+    def __pickle_server_task(self):
+        # Header set manifest is sent only if the server does not have it.
+        header_set = self.task.header_set
+        server_task = self.task.server_task
+        if self.node.has_header_set(header_set.id):
+            server_task.header_set = header_set.id, None
+        else:
+            server_task.header_set = header_set.id, header_set.manifest
+            self.node.add_header_set(header_set.id)
+        try:
+            return pickle.dumps(server_task)
+        finally:
+            server_task.header_set = None
+
     def cancel(self):
         if self.sender:
             self.sender.send_msg([b'CANCEL_SESSION'])
@@ -77,6 +100,23 @@ class ServerSession:
     def timer(self):
         return self.node.timer()
 
+    def __align_server_times(self, names, times):
+        # Server noted when it got the new session request, and when it
+        # replied with missing files.
+        points = dict(zip(names, times))
+        clock_offset = self.node.clock_offset()
+        if self.time_responded is not None and 'session created' in points \
+                and 'determined missing files' in points:
+            clock_offset.add_sample(self.time_started,
+                points['session created'], points['determined missing files'],
+                self.time_responded)
+        estimate = clock_offset.estimate()
+        if estimate is None:
+            return
+        self.clock_offset = estimate[0]
+        self.server_times = names, array('d', (server_time - self.clock_offset
+            for server_time in times))
+
     def got_data_from_server(self, msg):
         if msg[0] == b'SESSION_CANCELLED':
             assert self.cancelled
@@ -85,6 +125,13 @@ class ServerSession:
         elif msg[0] == b'TIMED_OUT':
             self.__complete(SessionResult.timed_out)
             return True
+        elif msg[0] == b'SERVER_BUSY':
+            # Server refused to create the session.
+            assert self.state == self.STATE_WAIT_FOR_MISSING_FILES
+            (retry_after,) = struct.unpack('!I', msg[1].memory())
+            self.node.set_busy(retry_after / 1000)
+            self.__complete(SessionResult.busy)
+            return True
 
         # It is possible that cancellation arrived too late,
         # that the server already sent the final message and
@@ -93,9 +140,18 @@ class ServerSession:
 
         # This state requires a response, so the session must be still alive
         # on the server.
-        if self.state == self.STATE_WAIT_FOR_MISSING_FILES:
+        if self.state == self.STATE_WAIT_FOR_MISSING_FILES and \
+                msg[1] == b'UNKNOWN_HEADER_SET':
+            # Server no longer has the header set, send the task again,
+            # this time with the manifest.
+            self.node.remove_header_set(self.task.header_set.id)
+            self.Sender(self.send_msg, msg[0].tobytes()).send_msg([
+                b'SERVER_TASK', self.__pickle_server_task()])
+
+        elif self.state == self.STATE_WAIT_FOR_MISSING_FILES:
             assert len(msg) == 3 and msg[1] == b'MISSING_FILES'
             assert self.sender is None
+            self.time_responded = time()
             self.sender = self.Sender(self.send_msg, msg[0].tobytes())
             if self.cancelled:
                 self.sender.send_msg([b'CANCEL_SESSION'])
@@ -129,16 +185,19 @@ class ServerSession:
                 return True
             else:
                 assert server_status == b'SERVER_DONE'
-                self.retcode, self.stdout, self.stderr, server_times = pickle.loads(msg[1].memory())
+                self.time_result_received = time()
+                result = pickle.loads(msg[1].memory())
+                self.retcode, self.stdout, self.stderr, server_times = result[:4]
                 logging.debug("Got {} retcode".format(self.retcode))
                 for name, duration in server_times.items():
                     self.timer.add_time(name, duration)
+                if len(result) > 4:
+                    self.__align_server_times(*result[4])
                 if self.task.register_completion(self):
                     assert not self.cancelled
                     if self.retcode == 0:
                         self.sender.send_msg([b'SEND_CONFIRMATION', b'\x01'])
-                        self.obj_desc = BytesIO()
-                        self.state = self.STATE_RECEIVE_OBJECT_FILE
+                        self.state = self.STATE_RECEIVE_RESULT_FILES
                         self.result_futures = []
                         self.receive_result_time = SimpleTimer()
                     else:
@@ -150,17 +209,31 @@ class ServerSession:
                     self.__complete(SessionResult.too_late)
                     return True
 
-        elif self.state == self.STATE_RECEIVE_OBJECT_FILE:
+        elif self.state == self.STATE_RECEIVE_RESULT_FILES:
             assert not self.cancelled
-            more, data = msg
-            self.obj_desc.write(data.memory())
+            if msg[0] == b'ARTIFACT':
+                # Start of a new result file.
+                _, name, encoding = msg
+                self.artifact = (self.task.result_files[name.decode()],
+                    encoding.tobytes())
+                self.artifact_data = BytesIO()
+                if self.artifact[1] != b'missing':
+                    return False
+                more = b'\x00'
+            else:
+                more, data = msg
+                self.artifact_data.write(data.memory())
             if more == b'\x00':
-                file_index = len(self.result_futures)
+                # Each file is written to disk by the executor, so that
+                # multiple files are decompressed in parallel.
+                output, encoding = self.artifact
                 future = self.loop.run_in_executor(self.executor,
-                    self._decompress_to_disk, self.obj_desc,
-                    self.task.result_files[file_index])
+                    self._write_artifact, self.artifact_data, encoding,
+                    output)
                 self.result_futures.append(future)
-            
+                del self.artifact
+                del self.artifact_data
+
                 # Complete the session once all files are decompressed.
                 if len(self.result_futures) == len(self.task.result_files):
                     self.timer.add_time('download result files',
@@ -168,13 +241,26 @@ class ServerSession:
                     asyncio.gather(*self.result_futures, loop=self.loop
                         ).add_done_callback(self.complete_session)
                     return True
-                else:
-                    # Prepare to receive another file.
-                    self.obj_desc = BytesIO()
         else:
             assert not "Invalid state"
         return False
 
+    @classmethod
+    def _write_artifact(cls, fileobj, encoding, output):
+        if encoding == b'missing':
+            # Server did not produce this file. Make sure a stale one does
+            # not get used instead.
+            try:
+                os.remove(output)
+            except FileNotFoundError:
+                pass
+        elif encoding == b'raw':
+            with open(output, "wb") as file:
+                file.write(fileobj.getbuffer())
+        else:
+            assert encoding == b'zlib'
+            cls._decompress_to_disk(fileobj, output)
+
     @classmethod
     def _decompress_to_disk(cls, fileobj, output):
         fileobj.seek(0)
@@ -223,6 +309,10 @@ class ServerSession:
             "hostname" : self.node.node_dict()['hostname'],
             "port" : self.node.node_dict()['port'],
             "started" : self.time_started,
+            "responded" : self.time_responded,
+            "result_received" : self.time_result_received,
             "completed" : self.time_completed,
             "result" : self.result,
+            "clock_offset" : self.clock_offset,
+            "server_times" : self.server_times,
         }
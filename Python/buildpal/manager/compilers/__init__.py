@@ -1 +1 @@
-from .msvc import MSVCCompiler
+from .msvc import MSVCCompiler, MSVCSeparatePDBCompiler
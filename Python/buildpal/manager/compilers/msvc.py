@@ -75,10 +75,15 @@ class CompileOptions:
         exclude_opts = ['c', 'I', 'Fo', 'link', 'Fp', 'Yc', 'Tc', 'Tp', 'Yu', 'FI']
         for name, value in zip(self.option_names, self.arg_values):
             if name == 'Zi':
-                # Disable generating PDB files when compiling cpp into obj.
-                # Store debug info in the obj file itself.
-                result.append('/Z7')
-            elif name == '/Fd':
+                if self.separate_pdb():
+                    # Each object file gets its own PDB, which is sent back
+                    # as a separate artifact.
+                    result.append('/Zi')
+                else:
+                    # Disable generating PDB files when compiling cpp into
+                    # obj. Store debug info in the obj file itself.
+                    result.append('/Z7')
+            elif name == 'Fd':
                 # Ignore users .pdb file. We will either store debug symbols in
                 # object files themselves, or manually specify pdb filename.
                 pass
@@ -98,6 +103,9 @@ class CompileOptions:
                 result.extend(value)
         return result
 
+    def separate_pdb(self):
+        return self.compiler.separate_pdb and 'Zi' in self.option_names
+
     def source_files(self):
         # All files explicitly set to C
         for x in self.value_dict['Tc']:
@@ -148,10 +156,16 @@ class CompileOptions:
                 src, _ in sources]
 
 
+        def get_artifacts(dest):
+            artifacts = [('object', dest)]
+            if self.separate_pdb():
+                artifacts.append(('pdb', os.path.splitext(dest)[0] + '.pdb'))
+            return artifacts
+
         outputs = get_output_files()
         assert len(sources) == len(outputs)
-        return [(src, decorator, dict(object_file=dest, all=[dest])) for
-            (src, decorator), dest in
+        return [(src, decorator, dict(object_file=dest,
+            artifacts=get_artifacts(dest))) for (src, decorator), dest in
             zip(sources, outputs)]
 
     def link_options(self):
@@ -161,6 +175,9 @@ class CompileOptions:
         return options
 
 class MSVCCompiler:
+    # Store debug info in object files (/Z7) instead of PDB files.
+    separate_pdb = False
+
     @classmethod
     def object_name_option(cls): return 'Fo'
 
@@ -170,6 +187,20 @@ class MSVCCompiler:
     @classmethod
     def set_object_name_option(cls, val): return '/Fo{}'.format(val)
 
+    @classmethod
+    def set_pdb_name_option(cls, val): return '/Fd{}'.format(val)
+
+    @classmethod
+    def set_artifact_option(cls, artifact, val):
+        return {
+            'object' : cls.set_object_name_option,
+            'pdb' : cls.set_pdb_name_option,
+        }[artifact](val)
+
+    @classmethod
+    def artifact_suffix(cls, artifact):
+        return {'object' : '.obj', 'pdb' : '.pdb'}[artifact]
+
     @classmethod
     def compile_no_link_option(cls): return 'c'
 
@@ -396,3 +427,10 @@ class MSVCCompiler:
             b'1033/nmakeui.dll',
             b'1033/vcomp120ui.dll'],
        }
+
+class MSVCSeparatePDBCompiler(MSVCCompiler):
+    """
+    Sources compiled with /Zi get a PDB file of their own, which is returned
+    from the server as a separate artifact.
+    """
+    separate_pdb = True
@@ -12,10 +12,17 @@ class Compressor:
         self.compressed_files = []
         self.compressed_file_data = {}
         self.waiters = defaultdict(list)
+        # Requests served from already compressed files, files compressed,
+        # and their total size before and after compression.
+        self.hits = 0
+        self.files = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
 
     def compress_file(self, file, on_completion):
         self.compressed_files_lock.acquire()
         if file in self.compressed_files:
+            self.hits += 1
             self.compressed_files_lock.release()
             on_completion(BytesIO(self.compressed_file_data[file]))
         else:
@@ -29,12 +36,17 @@ class Compressor:
     def __do_compress(self, file):
         buffer = BytesIO()
         compressor = zlib.compressobj(1)
+        bytes_in = 0
         with open(file, 'rb') as fileobj:
             for data in iter(lambda : fileobj.read(256 * 1024), b''):
+                bytes_in += len(data)
                 buffer.write(compressor.compress(data))
         buffer.write(compressor.flush())
         buffer.seek(0)
         with self.compressed_files_lock:
+            self.files += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += len(buffer.getbuffer())
             if len(self.compressed_file_data) > 4:
                 del self.compressed_file_data[self.compressed_files.pop(0)]
             self.compressed_files.append(file)
@@ -45,3 +57,7 @@ class Compressor:
         self.loop.call_soon_threadsafe(notify_waiters,
             self.compressed_file_data[file], self.waiters[file])
         del self.waiters[file]
+
+    def stats(self):
+        with self.compressed_files_lock:
+            return self.hits, self.files, self.bytes_in, self.bytes_out
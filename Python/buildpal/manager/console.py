@@ -1,3 +1,6 @@
+from .build_report import format_report
+from .scan_profile import profile_rows
+
 from time import time
 from operator import itemgetter
 
@@ -14,6 +17,15 @@ class ConsolePrinter:
         for name, tm, count, average in sorted_times:
             print('{:-<45} Total {:->14.2f} Num {:->5} Average {:->14.2f}'.format(name, tm, count, average))
 
+    @staticmethod
+    def print_build_report(report):
+        print("================")
+        print("Build report")
+        print("================")
+        for line in format_report(report):
+            print(line)
+        print("================")
+
     def __call__(self):
         try:
             current_time = time()
@@ -27,14 +39,16 @@ class ConsolePrinter:
             for node in node_info:
                 print('{:30} - Tasks sent {:<3} '
                     'Completed {:<3} Failed '
-                    '{:<3} Running {:<3} Avg. Tasks {:<3.2f} '
-                    'Avg. Time {:<3.2f}'
+                    '{:<3} Busy {:<3} Running {:<3} Srv. Queue {:<3} '
+                    'Avg. Tasks {:<3.2f} Avg. Time {:<3.2f}'
                 .format(
                     node.node_dict()['address'],
                     node.tasks_sent       (),
                     node.tasks_completed  (),
                     node.tasks_failed     (),
+                    node.tasks_busy       (),
                     node.tasks_pending    (),
+                    node.server_queued    (),
                     node.average_tasks    (),
                     node.average_task_time()))
             print("================")
@@ -56,6 +70,29 @@ class ConsolePrinter:
                 print("Hits: {:8} Misses: {:8} Ratio: {:>.2f}".format(
                     hits, misses, ratio))
                 print("================")
+            if hasattr(self.ui_data, 'cache_memory'):
+                cache_size, cache_evictions, content_size, content_evictions = \
+                    self.ui_data.cache_memory()
+                print("Header cache: {:8.1f} MB Evicted: {:8} "
+                    "Content cache: {:8.1f} MB Evicted: {:8}".format(
+                    cache_size / (1024 * 1024), cache_evictions,
+                    content_size / (1024 * 1024), content_evictions))
+                print("================")
+            if hasattr(self.ui_data, 'scan_cache_stats'):
+                hits, misses, ratio = self.ui_data.scan_cache_stats()
+                print("Unchanged sources: {:8} Scanned: {:8} Ratio: {:>.2f}".format(
+                    hits, misses, ratio))
+                print("================")
+            if hasattr(self.ui_data, 'scan_profile'):
+                rows = profile_rows(self.ui_data.scan_profile())
+                if rows:
+                    print("Header scanner profile")
+                    print("================")
+                    for phase, count, seconds, share, median, p99 in rows:
+                        print('{:-<25} Total {:->10.2f} Num {:->8} Share {:->6.1%} '
+                            'Median {:->8}us P99 {:->8}us'.format(phase, seconds,
+                            count, share, median, p99))
+                    print("================")
         except:
             import traceback
             traceback.print_exc()
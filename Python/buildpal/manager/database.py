@@ -1,31 +1,53 @@
+import logging
 import os
 import sqlite3
 
+from array import array
+from math import ceil
+
 from .compile_session import SessionResult
 from .gui_event import GUIEvent
 
-from queue import Queue, Empty
+from queue import Queue, Empty, Full
 from threading import Thread
+from time import time
 
 class Database:
-    tables = ['command', 'task', 'session', 'times']
+    """
+    Command history. By default it lives in a temporary file which is
+    removed when the database is opened and closed. A persistent database
+    is kept between manager runs, and its structure is recreated only when
+    schema_version changes.
+    """
+    tables = ['command', 'timeline', 'task', 'session']
+
+    # Bump when table layout changes.
+    schema_version = 4
+
+    indexes = [('task', 'command_id'), ('session', 'task_id'),
+        ('command', 'completed')]
 
     command_table = [
-        {'col_name': 'command', 'col_type': 'TEXT', 'null': False}
-    ]
+        {'col_name': 'command'  , 'col_type': 'TEXT', 'null': False},
+        {'col_name': 'started'  , 'col_type': 'REAL', 'null': True },
+        {'col_name': 'replied'  , 'col_type': 'REAL', 'null': True },
+        {'col_name': 'completed', 'col_type': 'REAL', 'null': True },]
 
+    # Sequence of time point names, shared by tasks which noted the same
+    # time points. Names are separated by newlines.
+    timeline_table = [
+        {'col_name': 'names', 'col_type': 'TEXT', 'null': False},]
+
+    # Task times are stored as a packed array of doubles, one per time
+    # point of the task's timeline.
     task_table = [
-        {'col_name': 'command_id', 'col_type': 'INTEGER', 'null': False,
+        {'col_name': 'command_id' , 'col_type': 'INTEGER', 'null': False,
             'ref': ('command', 'rowid')},
-        {'col_name': 'source'    , 'col_type': 'TEXT'   , 'null': False},
-        {'col_name': 'pch_file'  , 'col_type': 'TEXT'   , 'null': True },]
-
-    times_table = [
-        {'col_name': 'task_id'        , 'col_type': 'INTEGER', 'null': False,
-            'ref': ('task', 'rowid')},
-        {'col_name': 'time_point_ord' , 'col_type': 'INTEGER', 'null': False},
-        {'col_name': 'time_point_name', 'col_type': 'TEXT'   , 'null': False},
-        {'col_name': 'time_point'     , 'col_type': 'REAL'   , 'null': False},]
+        {'col_name': 'source'     , 'col_type': 'TEXT'   , 'null': False},
+        {'col_name': 'pch_file'   , 'col_type': 'TEXT'   , 'null': True },
+        {'col_name': 'timeline_id', 'col_type': 'INTEGER', 'null': False,
+            'ref': ('timeline', 'rowid')},
+        {'col_name': 'time_points', 'col_type': 'BLOB'   , 'null': False},]
 
     def convert_enum(enum_type):
         class ConvertEnum:
@@ -43,32 +65,48 @@ class Database:
 
         return ConvertEnum
 
+    # Server time points are converted to manager clock, clock_offset is
+    # the estimated offset of the server clock.
     session_table = [
-        {'col_name': 'task_id'  , 'col_type': 'INTEGER', 'null': False,
+        {'col_name': 'task_id'           , 'col_type': 'INTEGER', 'null': False,
             'ref': ('task', 'rowid')},
-        {'col_name': 'hostname' , 'col_type': 'TEXT'   , 'null': False},
-        {'col_name': 'port'     , 'col_type': 'TEXT'   , 'null': False},
-        {'col_name': 'started'  , 'col_type': 'REAL'   , 'null': False},
-        {'col_name': 'completed', 'col_type': 'REAL'   , 'null': False},
-        {'col_name': 'result'   , 'converter': convert_enum(SessionResult),
-            'null': False}]
+        {'col_name': 'hostname'          , 'col_type': 'TEXT'   , 'null': False},
+        {'col_name': 'port'              , 'col_type': 'TEXT'   , 'null': False},
+        {'col_name': 'started'           , 'col_type': 'REAL'   , 'null': False},
+        {'col_name': 'responded'         , 'col_type': 'REAL'   , 'null': True },
+        {'col_name': 'result_received'   , 'col_type': 'REAL'   , 'null': True },
+        {'col_name': 'completed'         , 'col_type': 'REAL'   , 'null': False},
+        {'col_name': 'result'            , 'converter': convert_enum(SessionResult),
+            'null': False},
+        {'col_name': 'clock_offset'      , 'col_type': 'REAL'   , 'null': True },
+        {'col_name': 'server_timeline_id', 'col_type': 'INTEGER', 'null': True ,
+            'ref': ('timeline', 'rowid')},
+        {'col_name': 'server_time_points', 'col_type': 'BLOB'   , 'null': True }]
 
     @classmethod
     def desc_for_table(cls, table_name):
         return cls.__dict__[table_name + '_table']
 
-    def __init__(self, db_file=None):
-        self.cleanup = True
+    def __init__(self, db_file=None, persistent=False):
+        self.cleanup = not persistent
+        self.persistent = persistent
         if db_file is None:
             self.db_file = ':memory:'
             self.cleanup = False
         else:
             self.db_file = db_file
-            try:
-                os.remove(self.db_file)
-            except FileNotFoundError:
-                pass
+            if self.cleanup:
+                try:
+                    os.remove(self.db_file)
+                except FileNotFoundError:
+                    pass
         sqlite3.enable_shared_cache(True)
+        # Rows are inserted in batches, so row ids are assigned here rather
+        # than taken from lastrowid. Only DatabaseInserter writes.
+        self.next_rowid = {}
+        self.insert_sql = {}
+        # Tuple of time point names to timeline rowid.
+        self.timelines = {}
 
     def close(self):
         if self.cleanup:
@@ -78,9 +116,33 @@ class Database:
                 pass
 
     def get_connection(self):
-        return sqlite3.connect(self.db_file)
+        conn = sqlite3.connect(self.db_file)
+        if self.persistent:
+            conn.execute("PRAGMA synchronous=NORMAL")
+        else:
+            # Rollback of a failed insert needs a journal, a temporary
+            # database keeps it in memory.
+            conn.execute("PRAGMA journal_mode=MEMORY")
+            conn.execute("PRAGMA synchronous=OFF")
+        return conn
 
     def create_structure(self, conn):
+        """
+        Create tables and indexes. Existing tables of a persistent database
+        are kept if they have the current schema version, and dropped
+        otherwise.
+        """
+        if self.persistent:
+            # WAL lets the GUI read history while commands are inserted.
+            conn.execute("PRAGMA journal_mode=WAL")
+            version, = conn.execute("PRAGMA user_version").fetchone()
+            if version == self.schema_version:
+                return
+            # Tables of older versions may be gone from self.tables.
+            for table_name, in conn.execute("SELECT name FROM sqlite_master "
+                    "WHERE type = 'table'").fetchall():
+                conn.execute("DROP TABLE {}".format(table_name))
+
         def col_desc_to_string(col_name, null, ref=None, col_type=None, converter=None):
             # Either column type or coverter must be specified.
             assert (col_type is None) != (converter is None)
@@ -104,29 +166,58 @@ class Database:
                 refs = ", " + refs
             cmd = "CREATE TABLE {}({}{})".format(table_name, descs, refs)
             conn.execute(cmd)
-        conn.execute("PRAGMA jorunal_mode=OFF")
-        conn.execute("PRAGMA synchronous=OFF")
+        for table_name, col_name in self.indexes:
+            conn.execute("CREATE INDEX {0}_{1} ON {0}({1})".format(
+                table_name, col_name))
+        conn.execute("PRAGMA user_version={}".format(self.schema_version))
+        conn.commit()
 
-    def __insert(self, conn, table, data, **extra_data):
-        table_desc = self.desc_for_table(table)
-        converted_data = []
-        for col_desc in table_desc:
-            col_name = col_desc['col_name']
+    def __row(self, table, rowid, data, **extra_data):
+        sql, columns = self.__insert_statement(table)
+        converted_data = [rowid]
+        for col_name, nullable, converter in columns:
             col_data = data.get(col_name)
             if col_data is None:
                  col_data = extra_data.get(col_name)
             if col_data is None:
-                if col_desc['null']:
-                    col_data = None
-                else:
+                if not nullable:
                     raise Exception("Missing non-nullable column value '{}'".format(col_name))
-            converter = col_desc.get('converter')
-            converted_data.append(converter.to_db(col_data) if converter else col_data)
-        sql = "INSERT INTO {} VALUES ({})".format(table,
-            ", ".join('?' for x in range(len(converted_data))))
-        cursor = conn.execute(sql, converted_data)
-        cursor.close()
-        return cursor.lastrowid
+            elif converter:
+                col_data = converter.to_db(col_data)
+            converted_data.append(col_data)
+        return converted_data
+
+    def discard_allocated_ids(self):
+        """
+        Forget cached row ids and timelines, as the rows they were allocated
+        for were rolled back.
+        """
+        self.next_rowid.clear()
+        self.timelines.clear()
+
+    def __allocate_rowid(self, conn, table):
+        rowid = self.next_rowid.get(table)
+        if rowid is None:
+            rowid, = conn.execute("SELECT ifnull(max(rowid), 0) + 1 FROM "
+                "{}".format(table)).fetchone()
+        self.next_rowid[table] = rowid + 1
+        return rowid
+
+    def __insert_statement(self, table):
+        """
+        Returns INSERT statement for the table, and its columns as
+        (name, nullable, converter) tuples.
+        """
+        insert = self.insert_sql.get(table)
+        if insert is None:
+            columns = tuple((col_desc['col_name'], col_desc['null'],
+                col_desc.get('converter')) for col_desc in
+                self.desc_for_table(table))
+            sql = "INSERT INTO {}(rowid, {}) VALUES ({})".format(table,
+                ", ".join(column[0] for column in columns),
+                ", ".join('?' for x in range(len(columns) + 1)))
+            insert = self.insert_sql[table] = sql, columns
+        return insert
 
     def __select(self, conn, table, col, value, orderby=None):
         cursor = conn.execute("SELECT rowid, * FROM {} WHERE {}=?{}".format(
@@ -151,14 +242,100 @@ class Database:
         return res, rowids
 
     def insert_command(self, conn, command):
-        command_id = self.__insert(conn, 'command', command)
-        for task in command['tasks']:
-            task_id = self.__insert(conn, 'task', task, command_id=command_id)
-            for session in task['sessions']:
-                self.__insert(conn, 'session', session, task_id=task_id)
-            for time_point in task['times']:
-                self.__insert(conn, 'times', time_point, task_id=task_id)
-        return command_id
+        command_ids, rows = self.insert_commands(conn, [command])
+        return command_ids[0]
+
+    def __timeline_id(self, conn, names, rows):
+        timeline_id = self.timelines.get(names)
+        if timeline_id is None:
+            text = '\n'.join(names)
+            row = conn.execute("SELECT rowid FROM timeline WHERE names = ?",
+                (text,)).fetchone()
+            if row is None:
+                timeline_id = self.__allocate_rowid(conn, 'timeline')
+                rows['timeline'].append([timeline_id, text])
+            else:
+                timeline_id, = row
+            self.timelines[names] = timeline_id
+        return timeline_id
+
+    def insert_commands(self, conn, commands):
+        """
+        Insert commands with their tasks and sessions, with a single
+        executemany() per table. Task 'times' and session 'server_times'
+        are (time point names, array('d') of times) pairs. Returns command
+        ids and the number of inserted rows.
+        """
+        rows = {table : [] for table in self.tables}
+        command_ids = []
+        for command in commands:
+            command_id = self.__allocate_rowid(conn, 'command')
+            command_ids.append(command_id)
+            rows['command'].append(self.__row('command', command_id, command))
+            for task in command['tasks']:
+                task_id = self.__allocate_rowid(conn, 'task')
+                names, times = task['times']
+                rows['task'].append(self.__row('task', task_id, task,
+                    command_id=command_id, timeline_id=self.__timeline_id(
+                    conn, names, rows), time_points=times.tobytes()))
+                for session in task['sessions']:
+                    server_times = {}
+                    if session.get('server_times') is not None:
+                        names, times = session['server_times']
+                        server_times = dict(server_timeline_id=
+                            self.__timeline_id(conn, names, rows),
+                            server_time_points=times.tobytes())
+                    rows['session'].append(self.__row('session',
+                        self.__allocate_rowid(conn, 'session'), session,
+                        task_id=task_id, **server_times))
+        for table in self.tables:
+            if rows[table]:
+                conn.executemany(self.__insert_statement(table)[0],
+                    rows[table])
+        return command_ids, sum(len(table_rows) for table_rows in
+            rows.values())
+
+    def command_range(self, conn):
+        """
+        Returns rowids of the first and the last command, or (None, None).
+        """
+        return conn.execute("SELECT min(rowid), max(rowid) FROM "
+            "command").fetchone()
+
+    def get_commands(self, conn, first, count):
+        """
+        Returns (rowid, command) pairs of at most count commands, starting
+        with the first command with rowid of at least first.
+        """
+        return conn.execute("SELECT rowid, command FROM command WHERE rowid "
+            ">= ? ORDER BY rowid LIMIT ?", (first, count)).fetchall()
+
+    def command_offset(self, conn, rowid, offset):
+        """
+        Returns rowid of the command offset commands after (or before, if
+        negative) the first command with rowid of at least rowid. Stops at
+        the first and the last command.
+        """
+        if offset >= 0:
+            row = conn.execute("SELECT rowid FROM command WHERE rowid >= ? "
+                "ORDER BY rowid LIMIT 1 OFFSET ?", (rowid, offset)).fetchone()
+            if row is None:
+                row = conn.execute("SELECT max(rowid) FROM command").fetchone()
+        else:
+            row = conn.execute("SELECT rowid FROM command WHERE rowid < ? "
+                "ORDER BY rowid DESC LIMIT 1 OFFSET ?", (rowid, -offset - 1)
+                ).fetchone()
+            if row is None:
+                row = conn.execute("SELECT min(rowid) FROM command").fetchone()
+        return row[0]
+
+    def command_ids(self, conn, first=None):
+        """
+        Returns rowids of commands, starting with the command with rowid
+        first.
+        """
+        return [rowid for rowid, in conn.execute("SELECT rowid FROM command "
+            "WHERE rowid >= ? ORDER BY rowid", (first or 0,))]
 
     def get_command(self, conn, rowid):
         assert rowid > 0
@@ -168,43 +345,244 @@ class Database:
             return None
         command = commands[0]
         tasks, task_row_ids = self.__select(conn, 'task', 'command_id', rowid)
+        timelines = dict(conn.execute("SELECT task.rowid, timeline.names FROM "
+            "task JOIN timeline ON task.timeline_id = timeline.rowid WHERE "
+            "task.command_id = ?", (rowid,)))
+        server_timelines = dict(conn.execute("SELECT session.rowid, "
+            "timeline.names FROM session JOIN task ON session.task_id = "
+            "task.rowid JOIN timeline ON session.server_timeline_id = "
+            "timeline.rowid WHERE task.command_id = ?", (rowid,)))
         for task, task_id in zip(tasks, task_row_ids):
             sessions, session_row_ids = self.__select(conn, 'session', 'task_id', task_id, orderby='started')
+            for session, session_id in zip(sessions, session_row_ids):
+                if 'server_time_points' in session:
+                    session['server_times'] = (split_names(server_timelines[
+                        session_id]), unpack_times(session.pop(
+                        'server_time_points')))
             task['sessions'] = sessions
-            times, time_row_ids = self.__select(conn, 'times', 'task_id', task_id, orderby='time_point_ord')
-            task['times'] = times
+            task['times'] = (split_names(timelines[task_id]),
+                unpack_times(task.pop('time_points')))
         command['tasks'] = tasks
         return command
 
+    def apply_retention(self, conn, max_age=None, max_commands=None,
+            now=None):
+        """
+        Remove commands completed more than max_age seconds ago, and all
+        but the newest max_commands commands. Returns number of removed
+        commands.
+        """
+        conditions = []
+        params = []
+        if max_age:
+            conditions.append("completed < ?")
+            params.append((now or time()) - max_age)
+        if max_commands:
+            conditions.append("rowid <= (SELECT rowid FROM command ORDER BY "
+                "rowid DESC LIMIT 1 OFFSET ?)")
+            params.append(max_commands)
+        if not conditions:
+            return 0
+        commands = "SELECT rowid FROM command WHERE {}".format(
+            " OR ".join(conditions))
+        tasks = "SELECT rowid FROM task WHERE command_id IN ({})".format(
+            commands)
+        conn.execute("DELETE FROM session WHERE task_id IN ({})".format(tasks),
+            params)
+        conn.execute("DELETE FROM task WHERE command_id IN ({})".format(
+            commands), params)
+        removed = conn.execute("DELETE FROM command WHERE rowid IN ({})"
+            .format(commands), params).rowcount
+        conn.commit()
+        return removed
+
+    def source_durations(self, conn, since=None):
+        """
+        Returns dict of source file to (tasks, median, 90th percentile,
+        maximum) of task durations in seconds, for commands completed
+        after since.
+        """
+        cursor = conn.execute("SELECT task.source, task.time_points FROM "
+            "command JOIN task ON task.command_id = command.rowid WHERE "
+            "ifnull(command.completed, 0) >= ?", (since or 0,))
+        durations = {}
+        for source, time_points in cursor:
+            times = unpack_times(time_points)
+            if times:
+                durations.setdefault(source, []).append(times[-1] - times[0])
+        result = {}
+        for source, values in durations.items():
+            values.sort()
+            result[source] = (len(values), percentile(values, 0.5),
+                percentile(values, 0.9), values[-1])
+        return result
+
+    def node_throughput(self, conn, since=None):
+        """
+        Returns dict of (hostname, port) to (sessions, successful sessions,
+        seconds spent in sessions, successful sessions per second) for
+        sessions started after since.
+        """
+        cursor = conn.execute("SELECT hostname, port, count(*), sum(result = "
+            "?), sum(completed - started), min(started), max(completed) FROM "
+            "session WHERE started >= ? GROUP BY hostname, port",
+            (SessionResult.success.value, since or 0))
+        result = {}
+        for hostname, port, sessions, succeeded, busy, first, last in cursor:
+            duration = last - first
+            result[hostname, port] = (sessions, succeeded, busy,
+                succeeded / duration if duration > 0 else 0)
+        return result
+
+def split_names(names):
+    return tuple(names.split('\n')) if names else ()
+
+def unpack_times(time_points):
+    times = array('d')
+    times.frombytes(time_points)
+    return times
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a sorted, non-empty list.
+    """
+    return values[min(len(values) - 1, max(0, ceil(fraction * len(values))
+        - 1))]
+
 class DatabaseInserter:
+    """
+    Inserts commands in a background thread.
+
+    Queued commands are inserted in batches of at most batch_size. Changes
+    are committed once commit_rows rows are pending, or commit_interval
+    seconds after the first uncommitted insert. on_completion callbacks are
+    called once their command is committed.
+
+    At most max_queued commands wait to be inserted. async_insert() is
+    called from the event loop and must not block, commands which do not
+    fit are dropped and counted in 'dropped'.
+
+    Each batch is inserted within a savepoint. If it fails, the batch is
+    rolled back and retried one command at a time. Commands which cannot
+    be inserted, or whose commit failed, are counted in 'failed'.
+    """
     class Quit: pass
 
-    def __init__(self, database, update_ui):
+    def __init__(self, database, update_ui, batch_size=256,
+            commit_rows=20000, commit_interval=1, max_queued=10000):
         self.database = database
-        self.queue = Queue()
-        self.thread = Thread(target=self.__worker_thread, args=(update_ui,))
+        self.batch_size = batch_size
+        self.commit_rows = commit_rows
+        self.commit_interval = commit_interval
+        self.queue = Queue(max_queued)
+        self.failed = 0
+        self.dropped = 0
+        self.thread = Thread(target=self.__worker_thread, args=(update_ui,),
+            name='History')
         self.thread.start()
 
+    def __get_batch(self, timeout):
+        try:
+            batch = [self.queue.get(timeout=timeout)]
+        except Empty:
+            return []
+        while len(batch) < self.batch_size and batch[-1] is not self.Quit:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def __insert(self, conn, batch):
+        """
+        Insert batch within a savepoint, so that a failure rolls back only
+        the batch. Returns command ids and the number of inserted rows.
+        """
+        conn.execute("SAVEPOINT batch")
+        try:
+            result = self.database.insert_commands(conn, [command_info for
+                command_info, on_completion in batch])
+        except Exception:
+            conn.execute("ROLLBACK TO SAVEPOINT batch")
+            conn.execute("RELEASE SAVEPOINT batch")
+            self.database.discard_allocated_ids()
+            raise
+        conn.execute("RELEASE SAVEPOINT batch")
+        return result
+
+    def __insert_batch(self, conn, batch):
+        """
+        Returns (on_completion, command id) pairs of inserted commands, and
+        the number of inserted rows.
+        """
+        try:
+            command_ids, rows = self.__insert(conn, batch)
+        except Exception:
+            pass
+        else:
+            return list(zip((on_completion for command_info, on_completion
+                in batch), command_ids)), rows
+        # Do not lose the whole batch because of a single command.
+        inserted = []
+        rows = 0
+        for command_info, on_completion in batch:
+            try:
+                command_ids, command_rows = self.__insert(conn,
+                    [(command_info, on_completion)])
+            except Exception:
+                logging.exception("Failed to insert command into command "
+                    "history.")
+                self.failed += 1
+            else:
+                inserted.append((on_completion, command_ids[0]))
+                rows += command_rows
+        return inserted, rows
+
     def __worker_thread(self, update_ui):
         with self.database.get_connection() as conn:
-            changed = False
-            while True:
-                try:
-                    what = self.queue.get(timeout=2)
-                    if what is self.Quit:
-                        if changed:
-                            conn.commit()
-                        return
-                    command_info, on_completion = what
-                    command_id = self.database.insert_command(conn, command_info)
-                    changed = True
-                    update_ui(GUIEvent.update_command_info, self.database)
-                    if on_completion:
-                        on_completion(command_id)
-                except Empty:
-                    if changed:
-                        conn.commit()
-                        changed = False
+            # Transactions are managed explicitly, see __insert().
+            conn.isolation_level = None
+            pending_rows = 0
+            # (on_completion, command id) of uncommitted commands.
+            pending = []
+            first_pending = None
+            quit = False
+            while not quit:
+                if first_pending is None:
+                    timeout = None
+                else:
+                    timeout = max(0, first_pending + self.commit_interval -
+                        time())
+                batch = self.__get_batch(timeout)
+                if batch and batch[-1] is self.Quit:
+                    quit = True
+                    batch.pop()
+                if batch:
+                    if first_pending is None:
+                        conn.execute("BEGIN")
+                        first_pending = time()
+                    inserted, rows = self.__insert_batch(conn, batch)
+                    pending.extend(inserted)
+                    pending_rows += rows
+                if first_pending is not None and (quit or pending_rows >=
+                        self.commit_rows or time() - first_pending >=
+                        self.commit_interval):
+                    try:
+                        conn.execute("COMMIT")
+                    except Exception:
+                        logging.exception("Failed to commit command history.")
+                        if conn.in_transaction:
+                            conn.execute("ROLLBACK")
+                        self.database.discard_allocated_ids()
+                        self.failed += len(pending)
+                    else:
+                        for on_completion, command_id in pending:
+                            if on_completion:
+                                on_completion(command_id)
+                        update_ui(GUIEvent.update_command_info, self.database)
+                    pending_rows = 0
+                    pending = []
+                    first_pending = None
 
     def __enter__(self):
         return self
@@ -213,7 +591,13 @@ class DatabaseInserter:
         self.close()
 
     def async_insert(self, command_info, on_completion=None):
-        self.queue.put((command_info, on_completion))
+        try:
+            self.queue.put_nowait((command_info, on_completion))
+        except Full:
+            self.dropped += 1
+            if self.dropped == 1:
+                logging.warning("Command history cannot keep up, dropping "
+                    "commands.")
 
     def close(self):
         self.queue.put(self.Quit)
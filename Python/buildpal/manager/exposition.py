@@ -0,0 +1,96 @@
+from buildpal.common import MessageProtocol
+from buildpal.common.loop_monitor import add_loop_metrics
+from buildpal.common.openmetrics import Exposition, add_message_metrics
+
+def node_results(node):
+    return (('completed', node.tasks_completed()),
+        ('failed', node.tasks_failed()),
+        ('cancelled', node.tasks_cancelled()),
+        ('too_late', node.tasks_too_late()),
+        ('timed_out', node.tasks_timed_out()),
+        ('terminated', node.tasks_terminated()),
+        ('busy', node.tasks_busy()))
+
+def collect_manager_metrics(node_manager, source_scanner, database_inserter,
+        loop_monitor=None):
+    """
+    Collect manager statistics for the metrics endpoint.
+    """
+    exposition = Exposition()
+    nodes = list(node_manager.node_info)
+
+    exposition.add('node_sessions_sent_total', 'counter',
+        'Sessions started on the node.', (({'node' : node.node_id()},
+        node.tasks_sent()) for node in nodes))
+    exposition.add('node_sessions_total', 'counter',
+        'Finished sessions per result.', (({'node' : node.node_id(),
+        'result' : result}, count) for node in nodes for result, count in
+        node_results(node)))
+    exposition.add('node_sessions_running', 'gauge',
+        'Sessions currently running on the node.', (({'node' :
+        node.node_id()}, node.tasks_pending()) for node in nodes))
+    exposition.add('node_server_queued', 'gauge',
+        'Sessions waiting for a job slot, as reported by the server.',
+        (({'node' : node.node_id()}, node.server_queued()) for node in nodes))
+    exposition.add('node_clock_offset_seconds', 'gauge',
+        'Estimated offset of the node clock from the manager clock.',
+        (({'node' : node.node_id()}, estimate[0]) for node, estimate in
+        ((node, node.clock_offset().estimate()) for node in nodes)
+        if estimate is not None))
+    exposition.histogram('node_session_duration_seconds',
+        'Duration of successful sessions.', (({'node' : node.node_id()},
+        node.session_durations()) for node in nodes))
+
+    exposition.gauge('unassigned_tasks',
+        'Scanned tasks waiting for a free node.',
+        len(node_manager.unassigned_tasks))
+    exposition.gauge('scan_queue_length', 'Tasks waiting to be scanned.',
+        source_scanner.queue_length())
+    exposition.gauge('history_queue_length',
+        'Commands waiting to be written to command history.',
+        database_inserter.queue.qsize())
+    exposition.counter('history_dropped_total',
+        'Commands dropped as command history could not keep up.',
+        database_inserter.dropped)
+    exposition.counter('history_failed_total',
+        'Commands which failed to be written to command history.',
+        database_inserter.failed)
+
+    exposition.counter('files_preprocessed_total', 'Sources scanned.',
+        source_scanner.files_preprocessed()[0])
+    hits, misses, ratio = source_scanner.get_cache_stats()
+    exposition.counter('header_cache_hits_total', 'Header cache hits.', hits)
+    exposition.counter('header_cache_misses_total', 'Header cache misses.',
+        misses)
+    exposition.gauge('header_cache_hit_ratio', 'Header cache hit ratio.',
+        ratio)
+    cache_size, cache_evictions, content_size, content_evictions = \
+        source_scanner.get_memory_stats()
+    exposition.gauge('header_cache_bytes', 'Header cache memory usage.',
+        cache_size)
+    exposition.counter('header_cache_evictions_total',
+        'Entries evicted from header cache.', cache_evictions)
+    exposition.gauge('content_cache_bytes', 'Size of cached file contents.',
+        content_size)
+    exposition.counter('content_cache_evictions_total',
+        'Files evicted from content cache.', content_evictions)
+    if hasattr(source_scanner, 'get_scan_cache_stats'):
+        hits, misses, ratio = source_scanner.get_scan_cache_stats()
+        exposition.counter('unchanged_sources_total',
+            'Sources not scanned again, as they did not change.', hits)
+        exposition.gauge('unchanged_sources_ratio',
+            'Ratio of sources which were not scanned again.', ratio)
+
+    hits, files, bytes_in, bytes_out = node_manager.compressor.stats()
+    exposition.counter('compressor_hits_total',
+        'Requests for already compressed files.', hits)
+    exposition.counter('compressor_files_total', 'Files compressed.', files)
+    exposition.counter('compressor_input_bytes_total',
+        'Size of compressed files.', bytes_in)
+    exposition.counter('compressor_output_bytes_total',
+        'Size of compressed data.', bytes_out)
+
+    add_message_metrics(exposition, MessageProtocol.stats)
+    if loop_monitor is not None:
+        add_loop_metrics(exposition, loop_monitor)
+    return exposition
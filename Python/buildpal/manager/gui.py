@@ -1,4 +1,5 @@
 from tkinter import *
+import tkinter.filedialog as filedialog
 import tkinter.font as font
 import tkinter.messagebox as msgbox
 from tkinter.ttk import *
@@ -6,11 +7,14 @@ from datetime import datetime
 
 from collections import defaultdict
 from operator import itemgetter
-from threading import Lock
+from threading import Lock, Thread
 from time import time
 from multiprocessing import cpu_count
 
 from .gui_event import GUIEvent
+from .build_report import analyze_history, attribute
+from .scan_profile import profile_rows
+from .trace import write_chrome_trace
 
 class MyTreeView(Treeview):
     def __init__(self, parent, columns, **kwargs):
@@ -34,7 +38,9 @@ class NodeList(MyTreeView):
         {'cid' : "Terminated", 'text' : "Terminated" , 'minwidth' : 20 , 'anchor' : CENTER},
         {'cid' : "Cancelled" , 'text' : "Cancelled"  , 'minwidth' : 20 , 'anchor' : CENTER},
         {'cid' : "Failed"    , 'text' : "Failed"     , 'minwidth' : 20 , 'anchor' : CENTER},
+        {'cid' : "Busy"      , 'text' : "Busy"       , 'minwidth' : 20 , 'anchor' : CENTER},
         {'cid' : "Pending"   , 'text' : "Pending"    , 'minwidth' : 20 , 'anchor' : CENTER},
+        {'cid' : "SrvQueue"  , 'text' : "Srv. Queue" , 'minwidth' : 20 , 'anchor' : CENTER},
         {'cid' : "AvgTasks"  , 'text' : "Avg. Tasks" , 'minwidth' : 40 , 'anchor' : CENTER},
         {'cid' : "AvgTime"   , 'text' : "Avg. Time"  , 'minwidth' : 40 , 'anchor' : CENTER})
 
@@ -60,7 +66,9 @@ class NodeList(MyTreeView):
                 node.tasks_terminated(),
                 node.tasks_cancelled (),
                 node.tasks_failed    (),
+                node.tasks_busy      (),
                 node.tasks_pending   (),
+                node.server_queued   (),
                 "{:.2f}".format(node.average_tasks()),
                 "{:.2f}".format(node.average_task_time()))
 
@@ -123,6 +131,35 @@ class TimerDisplay(LabelFrame):
 class GlobalTimerDisplay(TimerDisplay):
     gui_events = ((GUIEvent.update_global_timers, 'refresh'),)
 
+class ScanProfileDisplay(LabelFrame):
+    columns = (
+        { 'cid' : '#0'    , 'text' : 'Phase'       , 'minwidth' : 120, 'anchor' : W      },
+        { 'cid' : 'Total' , 'text' : 'Total'       , 'minwidth' : 30 , 'anchor' : CENTER },
+        { 'cid' : 'Count' , 'text' : 'Count'       , 'minwidth' : 20 , 'anchor' : CENTER },
+        { 'cid' : 'Share' , 'text' : 'Share'       , 'minwidth' : 20 , 'anchor' : CENTER },
+        { 'cid' : 'Median', 'text' : 'Median (us)' , 'minwidth' : 30 , 'anchor' : CENTER },
+        { 'cid' : 'P99'   , 'text' : 'P99 (us)'    , 'minwidth' : 30 , 'anchor' : CENTER })
+
+    gui_events = ((GUIEvent.update_scan_profile, 'refresh'),)
+
+    def __init__(self, parent, **kwargs):
+        LabelFrame.__init__(self, parent, text="Header Scanner Profile", **kwargs)
+        self.phases = MyTreeView(self, self.columns, height=5)
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+        self.phases.grid(sticky=N+S+W+E)
+
+    def refresh(self, profile):
+        self.phases.delete(*self.phases.get_children(''))
+        for phase, count, seconds, share, median, p99 in profile_rows(profile):
+            values = (
+                "{:.2f}".format(seconds),
+                count,
+                "{:.1%}".format(share),
+                median,
+                p99)
+            self.phases.insert('', 'end', text=phase, values=values)
+
 class NodeDisplay(Frame):
     gui_events = ((GUIEvent.update_node_info, 'refresh'),)
 
@@ -167,6 +204,8 @@ class NodeDisplay(Frame):
 class PreprocessingStats(LabelFrame):
     gui_events = (
         (GUIEvent.update_cache_stats, 'refresh_cache_stats'),
+        (GUIEvent.update_cache_memory, 'refresh_cache_memory'),
+        (GUIEvent.update_scan_cache_stats, 'refresh_scan_cache_stats'),
         (GUIEvent.update_preprocessed_count, 'refresh_pp_count'),
         (GUIEvent.update_unassigned_tasks, 'refresh_unassigned_tasks'),
     )
@@ -206,10 +245,34 @@ class PreprocessingStats(LabelFrame):
 
         Separator(self).grid(row=8, column=0, columnspan=2, pady=5, sticky=E+W)
 
+        self.unchanged_sources = StringVar()
+        Label(self, text="Unchanged Sources").grid(row=9, sticky=W)
+        Entry(self, state=DISABLED, textvariable=self.unchanged_sources).grid(row=9, column=1)
+
+        self.scan_cache_ratio = StringVar()
+        Label(self, text="Unchanged Ratio").grid(row=10, sticky=W)
+        Entry(self, state=DISABLED, textvariable=self.scan_cache_ratio).grid(row=10, column=1)
+
+        Separator(self).grid(row=11, column=0, columnspan=2, pady=5, sticky=E+W)
+
+        self.cache_memory = StringVar()
+        Label(self, text="Header Cache (MB)").grid(row=12, sticky=W)
+        Entry(self, state=DISABLED, textvariable=self.cache_memory).grid(row=12, column=1)
+
+        self.content_memory = StringVar()
+        Label(self, text="Content Cache (MB)").grid(row=13, sticky=W)
+        Entry(self, state=DISABLED, textvariable=self.content_memory).grid(row=13, column=1)
+
+        self.cache_evictions = StringVar()
+        Label(self, text="Evictions").grid(row=14, sticky=W)
+        Entry(self, state=DISABLED, textvariable=self.cache_evictions).grid(row=14, column=1)
+
+        Separator(self).grid(row=15, column=0, columnspan=2, pady=5, sticky=E+W)
+
         self.unassinged_tasks = StringVar()
-        Label(self, text="Unassigned Tasks").grid(row=9, sticky=W)
-        Entry(self, state=DISABLED, textvariable=self.unassinged_tasks).grid(row=9, column=1)
-        Separator(self).grid(row=10, column=0, columnspan=2, pady=5, sticky=E+W)
+        Label(self, text="Unassigned Tasks").grid(row=16, sticky=W)
+        Entry(self, state=DISABLED, textvariable=self.unassinged_tasks).grid(row=16, column=1)
+        Separator(self).grid(row=17, column=0, columnspan=2, pady=5, sticky=E+W)
 
     def refresh_unassigned_tasks(self, unassigned_tasks):
         self.unassinged_tasks.set(unassigned_tasks)
@@ -220,6 +283,17 @@ class PreprocessingStats(LabelFrame):
         self.cache_hits.set(hits)
         self.cache_ratio.set("{:.2f}".format(ratio))
 
+    def refresh_cache_memory(self, cache_memory):
+        cache_size, cache_evictions, content_size, content_evictions = cache_memory
+        self.cache_memory.set("{:.1f}".format(cache_size / (1024 * 1024)))
+        self.content_memory.set("{:.1f}".format(content_size / (1024 * 1024)))
+        self.cache_evictions.set(cache_evictions + content_evictions)
+
+    def refresh_scan_cache_stats(self, scan_cache_stats):
+        hits, misses, ratio = scan_cache_stats
+        self.unchanged_sources.set(hits)
+        self.scan_cache_ratio.set("{:.2f}".format(ratio))
+
     def refresh_pp_count(self, pp_count):
         total, naively, regular = pp_count
         self.preprocessed_total.set(total)
@@ -240,13 +314,18 @@ class GlobalDataFrame(Frame):
         frame = Frame(self)
         self.cache_stats = PreprocessingStats(frame)
         self.cache_stats.grid(sticky=N+S+W+E)
+        self.scan_profile = ScanProfileDisplay(frame)
+        self.scan_profile.grid(row=1, sticky=N+S+W+E)
 
         frame.grid(row=0, column=1, sticky=N+S+W+E)
 
 class SettingsFrame(LabelFrame):
-    def __init__(self, parent, port, **kw):
+    gui_events = ((GUIEvent.profile_completed, 'profile_completed'),)
+
+    def __init__(self, parent, port, start_profiler=None, **kw):
         LabelFrame.__init__(self, parent, text="Settings", **kw)
         self.port = port
+        self.start_profiler = start_profiler
         self.draw()
 
     def draw(self):
@@ -259,6 +338,15 @@ class SettingsFrame(LabelFrame):
         self.port_var.set(self.port)
         Entry(self, state=DISABLED, textvariable=self.port_var).grid(row=0, column=1)
 
+        if self.start_profiler is not None:
+            Label(self, text="Profile (seconds)").grid(row=1, column=0, sticky=E+W)
+            self.profile_seconds = StringVar()
+            self.profile_seconds.set('10')
+            Entry(self, textvariable=self.profile_seconds, validate='key',
+                validatecommand=(self.digits_filter, '%P')).grid(row=1, column=1)
+            self.profile_but = Button(self, text="Profile", command=self.profile)
+            self.profile_but.grid(row=1, column=2, sticky=E+W)
+
         if False:
             # Debugging stuff
             self.stop_but = Button(self, text="Run PDB", command=self.start_pdb)
@@ -266,6 +354,25 @@ class SettingsFrame(LabelFrame):
             self.stop_but = Button(self, text="Run Interpreter", command=self.start_interpreter)
             self.stop_but.grid(row=3, column=1, sticky=E+W)
 
+    def profile(self):
+        seconds = int(self.profile_seconds.get() or 0)
+        if not seconds:
+            return
+        if self.start_profiler(seconds):
+            self.profile_but.config(state=DISABLED)
+        else:
+            msgbox.showwarning("Profile", "Profiler is already running.")
+
+    def profile_completed(self, result):
+        filename, error = result
+        self.profile_but.config(state=NORMAL)
+        if error is not None:
+            msgbox.showerror("Profile", "Failed to write '{}': {}".format(
+                filename, error))
+        else:
+            msgbox.showinfo("Profile", "Collapsed stacks written to '{}'."
+                .format(filename))
+
     @staticmethod
     def start_pdb():
         import pdb
@@ -304,56 +411,96 @@ class CommandInfo(Frame):
             return "{}:{}".format(session['hostname'], session['port']), \
                 session['result'].name
         def session_subdata(session):
-            return [
+            result = [
                 ("Started:", format_time(session['started'])),
                 ("Completed:", format_time(session['completed'])),
                 ("Duration:", "{:.2f}".format(session['completed'] - session['started']))]
-
-        for task in command_info['tasks']:
-            task_id = self.task_list.insert('', 'end', text=task_string(task), open=True)
-            times = self.task_list.insert(task_id, 'end', text='Times', open=True)
-            last = None
-            for time_entry in task['times']:
+            if session.get('clock_offset') is not None:
+                result.append(("Clock offset:", "{:.3f}".format(
+                    session['clock_offset'])))
+            return result
+
+        def insert_times(parent, text, times, last=None):
+            times_id = self.task_list.insert(parent, 'end', text=text, open=True)
+            for time_point_name, time_point in zip(*times):
                 if last:
-                    value = '+{}s'.format(round(time_entry['time_point'] - last, 2))
+                    value = '+{}s'.format(round(time_point - last, 2))
                 else:
-                    value = format_time(time_entry['time_point'])
-                last = time_entry['time_point']
-                self.task_list.insert(times, 'end', text=time_entry['time_point_name'],
+                    value = format_time(time_point)
+                last = time_point
+                self.task_list.insert(times_id, 'end', text=time_point_name,
                     values=(value,))
+
+        for task in command_info['tasks']:
+            task_id = self.task_list.insert('', 'end', text=task_string(task), open=True)
+            insert_times(task_id, 'Times', task['times'])
             sessions = self.task_list.insert(task_id, 'end', text='Sessions', open=True)
             for session in task['sessions']:
                 text, value = session_string(session)
                 session_id = self.task_list.insert(sessions, 'end', text=text, values=(value,), open=True)
                 for text, value in session_subdata(session):
                     self.task_list.insert(session_id, 'end', text=text, values=(value,))
+                if session.get('server_times') is not None:
+                    # Shown relative to session start.
+                    insert_times(session_id, 'Server Times',
+                        session['server_times'], session['started'])
 
 class CommandBrowser(PanedWindow):
+    """
+    Command list showing a single page of commands, as many as fit the
+    window. Only the displayed page is read from the database, and its
+    scrollbar is driven by rowids, so that browsing stays cheap however
+    long the history is. Details of a command are read when selected.
+
+    Trace of commands from the selected one (or the first displayed one) to
+    the newest one can be exported for a trace viewer, or analyzed as a
+    single build. Both read the history on a worker thread.
+    """
     columns = ({'cid' : "#0"     , 'text' : "#"      , 'minwidth' :  40, 'anchor' : W },
                {'cid' : "Targets", 'text' : "Targets", 'minwidth' : 250, 'anchor' : W },)
 
-    gui_events = ((GUIEvent.update_command_info, 'refresh'),)
+    gui_events = ((GUIEvent.update_command_info, 'refresh'),
+        (GUIEvent.history_job_done, 'history_job_done'))
+
+    # Minimal time between two reloads of the page on new commands.
+    refresh_interval = 0.5
 
     def __init__(self, parent, *args, **kw):
         PanedWindow.__init__(self, parent, orient=HORIZONTAL)
         frame = Frame(self)
         frame.rowconfigure(0, weight=1)
         frame.columnconfigure(0, weight=1)
-        sb = Scrollbar(frame)
-        sb.grid(row=0, column=1, sticky=N+S)
+        self.sb = Scrollbar(frame)
+        self.sb.grid(row=0, column=1, sticky=N+S)
         self.tv = MyTreeView(frame, self.columns)
         self.tv.grid(row=0, column=0, sticky=N+S+W+E)
-        self.tv['yscrollcommand'] = sb.set
         self.tv.bind('<<TreeviewSelect>>', self.command_selected)
-        sb.config(command=self.tv.yview)
+        self.tv.bind('<MouseWheel>', self.mouse_wheel)
+        self.tv.bind('<Configure>', self.resized)
+        self.sb.config(command=self.scroll)
+        buttons = Frame(frame)
+        buttons.columnconfigure(0, weight=1)
+        buttons.columnconfigure(1, weight=1)
+        self.export_but = Button(buttons, text="Export Trace...",
+            command=self.export_trace)
+        self.export_but.grid(row=0, column=0, sticky=E+W)
+        self.analyze_but = Button(buttons, text="Analyze Build",
+            command=self.analyze_build)
+        self.analyze_but.grid(row=0, column=1, sticky=E+W)
+        buttons.grid(row=1, column=0, columnspan=2, sticky=E+W)
         self.add(frame)
-        self.displayed_rows = {}
 
         self.db = None
         self.db_conn = None
 
+        # Rowid of the first displayed command, None - follow the newest.
+        self.top = None
+        self.page_size = 10
+        self.selected = None
         self.row_to_db = {}
-        self.db_to_row = {}
+
+        self.last_refresh = 0
+        self.refresh_pending = False
 
         self.command_info = CommandInfo(self)
         self.add(self.command_info)
@@ -361,12 +508,67 @@ class CommandBrowser(PanedWindow):
     def command_selected(self, event):
         selection = self.tv.selection()
         if not selection:
-            data = None
-        else:
-            row_id = self.row_to_db[selection[0]]
-            assert self.db_conn is not None
-            data = self.db.get_command(self.db_conn, row_id)
-        self.command_info.refresh(data)
+            return
+        row_id = self.row_to_db[selection[0]]
+        if row_id == self.selected:
+            return
+        self.selected = row_id
+        assert self.db_conn is not None
+        self.command_info.refresh(self.db.get_command(self.db_conn, row_id))
+
+    def __run_history_job(self, title, job):
+        """
+        Call job(conn, first) on a worker thread with its own connection,
+        first is the selected command, or the first displayed one.
+        """
+        if self.db is None:
+            return
+        first = self.selected
+        if first is None:
+            first = min(self.row_to_db.values(), default=None)
+        if first is None:
+            return
+        self.export_but.config(state=DISABLED)
+        self.analyze_but.config(state=DISABLED)
+        post_event = self.winfo_toplevel().post_event
+        def run():
+            error = None
+            try:
+                conn = self.db.get_connection()
+                try:
+                    job(conn, first)
+                finally:
+                    conn.close()
+            except Exception as e:
+                error = "{}".format(e)
+            post_event(GUIEvent.history_job_done, (title, error))
+        Thread(target=run, name=title, daemon=True).start()
+
+    def history_job_done(self, data):
+        title, error = data
+        self.export_but.config(state=NORMAL)
+        self.analyze_but.config(state=NORMAL)
+        if error is not None:
+            msgbox.showerror(title, error)
+
+    def export_trace(self):
+        filename = filedialog.asksaveasfilename(parent=self,
+            title="Export Trace", defaultextension='.json',
+            filetypes=[("Chrome Trace", '*.json')])
+        if not filename:
+            return
+        def export(conn, first):
+            with open(filename, 'wt') as file:
+                write_chrome_trace(file, self.db, conn, first)
+        self.__run_history_job("Export Trace", export)
+
+    def analyze_build(self):
+        post_event = self.winfo_toplevel().post_event
+        def analyze(conn, first):
+            report = analyze_history(self.db, conn, first)
+            if report is not None:
+                post_event(GUIEvent.update_build_report, report)
+        self.__run_history_job("Analyze Build", analyze)
 
     def refresh(self, command_db):
         if self.db_conn is None:
@@ -374,18 +576,146 @@ class CommandBrowser(PanedWindow):
                 self.db = command_db
             self.db_conn = self.db.get_connection()
             self.db_conn.execute("PRAGMA read_uncommitted = 1")
+        if self.refresh_pending:
+            return
+        delay = self.last_refresh + self.refresh_interval - time()
+        if delay > 0:
+            self.refresh_pending = True
+            self.after(int(delay * 1000), self.__delayed_refresh)
+        else:
+            self.__load_page()
+
+    def __delayed_refresh(self):
+        self.refresh_pending = False
+        self.__load_page()
+
+    def resized(self, event):
+        style = Style()
+        row_height = int(style.lookup('Treeview', 'rowheight') or 20)
+        page_size = max(1, (event.height - row_height) // row_height)
+        if page_size != self.page_size:
+            self.page_size = page_size
+            self.__load_page()
 
-        if self.db_to_row:
-            last_row_id = max(self.db_to_row.keys())
+    def mouse_wheel(self, event):
+        self.scroll('scroll', -event.delta // 120, 'units')
+        return 'break'
+
+    def scroll(self, action, amount, unit=None):
+        if self.db_conn is None:
+            return
+        first, last = self.db.command_range(self.db_conn)
+        if first is None:
+            return
+        if action == 'moveto':
+            top = self.db.command_offset(self.db_conn, first + int(
+                float(amount) * (last - first + 1)), 0)
         else:
-            last_row_id = 0
-        cursor = self.db_conn.execute(
-            "SELECT rowid, command FROM command WHERE rowid > ?",
-            (last_row_id,))
-        for rowid, targets in cursor:
-            iid = self.tv.insert('', 'end', text=len(self.tv.get_children('')) + 1, values=(targets,))
+            offset = int(amount)
+            if unit == 'pages':
+                offset *= self.page_size
+            top = self.db.command_offset(self.db_conn, first if self.top is
+                None else self.top, offset)
+        last_page = self.db.command_offset(self.db_conn, last,
+            1 - self.page_size)
+        # Scrolled to the end, keep showing new commands.
+        self.top = None if top >= last_page else top
+        self.__load_page()
+
+    def __load_page(self):
+        self.last_refresh = time()
+        if self.db_conn is None:
+            return
+        first, last = self.db.command_range(self.db_conn)
+        if first is None:
+            return
+        top = self.top
+        if top is None:
+            top = self.db.command_offset(self.db_conn, last,
+                1 - self.page_size)
+        commands = self.db.get_commands(self.db_conn, top, self.page_size)
+        children = self.tv.get_children('')
+        if children:
+            self.tv.delete(*children)
+        self.row_to_db = {}
+        for rowid, targets in commands:
+            iid = self.tv.insert('', 'end', text=rowid, values=(targets,))
             self.row_to_db[iid] = rowid
-            self.db_to_row[rowid] = iid
+            if rowid == self.selected:
+                self.tv.selection_set(iid)
+        if not commands:
+            return
+        span = last - first + 1
+        self.sb.set((commands[0][0] - first) / span,
+            (commands[-1][0] - first + 1) / span)
+
+class BuildReportDisplay(Frame):
+    """
+    Reports of recent builds, newest first.
+    """
+    columns = ({'cid' : '#0'   , 'text': 'Build', 'minwidth': 300, 'anchor' : W},
+               {'cid' : 'Value', 'text': 'Value', 'minwidth': 80 , 'anchor' : W},
+               {'cid' : 'Share', 'text': 'Share', 'minwidth': 50 , 'anchor' : W},
+               {'cid' : 'Info' , 'text': 'Info' , 'minwidth': 300, 'anchor' : W},)
+
+    gui_events = ((GUIEvent.update_build_report, 'add_report'),)
+
+    max_reports = 20
+
+    def __init__(self, parent, *args, **kw):
+        Frame.__init__(self, parent, *args, **kw)
+        self.rowconfigure(0, weight=1)
+        self.columnconfigure(0, weight=1)
+        self.tv = MyTreeView(self, self.columns)
+        self.tv.grid(row=0, column=0, sticky=N+S+E+W)
+        sb = Scrollbar(self, command=self.tv.yview)
+        sb.grid(row=0, column=1, sticky=N+S)
+        self.tv.config(yscrollcommand=sb.set)
+
+    def add_report(self, report):
+        def seconds(value):
+            return "{:.2f}s".format(value)
+        def share(value):
+            return "{:.1%}".format(value / (report.duration or 1))
+        def categories(values):
+            return ', '.join('{} {:.2f}s'.format(category, value) for
+                category, value in values)
+
+        for item in self.tv.get_children('')[self.max_reports - 1:]:
+            self.tv.delete(item)
+        for item in self.tv.get_children(''):
+            self.tv.item(item, open=False)
+        build = self.tv.insert('', 0, text="{} - {}".format(
+            datetime.fromtimestamp(report.started).strftime("%a %H:%M:%S"),
+            datetime.fromtimestamp(report.completed).strftime("%H:%M:%S")),
+            values=(seconds(report.duration), '', "{} commands, {} tasks".format(
+            report.commands, report.tasks)), open=True)
+
+        parent = self.tv.insert(build, 'end', text="Critical Path Time", open=True)
+        for category, value in report.attribution:
+            self.tv.insert(parent, 'end', text=category, values=(seconds(value),
+                share(value)))
+
+        parent = self.tv.insert(build, 'end', text="Critical Path")
+        for name, start, end, segments in report.critical_path:
+            step = self.tv.insert(parent, 'end', text=name, values=(seconds(
+                end - start), share(end - start), categories(attribute([(name,
+                start, end, segments)]))))
+            for segment in segments:
+                self.tv.insert(step, 'end', text=segment.name, values=(
+                    seconds(segment.end - segment.start), '', segment.category))
+
+        parent = self.tv.insert(build, 'end', text="Jobs per Node", values=(
+            '', '', "every {:.1f}s".format(report.bucket_length)), open=True)
+        for node, (average, peak, buckets) in sorted(report.utilization.items()):
+            self.tv.insert(parent, 'end', text=node, values=("{:.2f}".format(
+                average), "peak {}".format(peak), ' '.join('{:.0f}'.format(
+                value) for value in buckets)))
+
+        parent = self.tv.insert(build, 'end', text="Slowest Sources", open=True)
+        for source, duration, values in report.slowest_tasks:
+            self.tv.insert(parent, 'end', text=source, values=(seconds(duration),
+                share(duration), categories(values)))
 
 def collect_window_events(window):
     result = defaultdict(list)
@@ -405,10 +735,11 @@ class BPManagerApp(Tk):
 
     gui_events = ((GUIEvent.exception_in_run, '_exception_in_run'),)
 
-    def __init__(self, node_info_getter, port):
+    def __init__(self, node_info_getter, port, start_profiler=None):
         Tk.__init__(self, None)
         self.node_info_getter = node_info_getter
         self.port = port
+        self.start_profiler = start_profiler
         self.initialize()
         self.events = collect_window_events(self)
         self.event_data_lock = Lock()
@@ -427,7 +758,8 @@ class BPManagerApp(Tk):
         self.columnconfigure(0, weight=1)
 
         # Row 0
-        self.settings_frame = SettingsFrame(self, self.port)
+        self.settings_frame = SettingsFrame(self, self.port,
+            self.start_profiler)
         self.settings_frame.grid(row=0, sticky=E+W, padx=5, pady=(0, 5))
 
         # Row 1
@@ -445,6 +777,9 @@ class BPManagerApp(Tk):
         self.command_browser = CommandBrowser(self.notebook)
         self.notebook.add(self.command_browser, text="Commands")
 
+        self.build_reports = BuildReportDisplay(self.notebook)
+        self.notebook.add(self.build_reports, text="Builds")
+
         self.pane.add(self.notebook)
 
         self.rowconfigure(1, weight=1)
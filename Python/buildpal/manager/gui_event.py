@@ -8,3 +8,9 @@ class GUIEvent(Enum):
     update_command_info = 5
     update_unassigned_tasks = 6
     exception_in_run = 7
+    update_scan_cache_stats = 8
+    update_scan_profile = 9
+    update_cache_memory = 10
+    update_build_report = 11
+    profile_completed = 12
+    history_job_done = 13
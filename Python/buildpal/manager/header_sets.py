@@ -0,0 +1,70 @@
+import hashlib
+
+from threading import Lock
+from weakref import WeakValueDictionary
+
+class HeaderSet:
+    """
+    Canonical set of shared (not source-relative) headers of a source file.
+
+    Most sources of a project include nearly the same headers, so a single
+    HeaderSet is shared by all tasks which include exactly the same header
+    files with the same content. It is identified by hash of its manifest
+    (see buildpal.common.manifest), so that servers can keep it too, and
+    tasks need to send only its id.
+    """
+    __slots__ = ('id', 'manifest', 'headers', '__weakref__')
+
+    def __init__(self, id, manifest, headers):
+        self.id = id
+        self.manifest = manifest
+        # Tuple of (dir, ((file, content_entry), ...)).
+        self.headers = headers
+
+class HeaderSetRegistry:
+    """
+    Interns header sets of scanned sources. Sets are kept as long as some
+    task refers to them.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.sets = WeakValueDictionary()
+        self.hits = 0
+        self.misses = 0
+
+    def intern(self, header_info, manifest):
+        """
+        Split scan result into a shared HeaderSet and headers local to the
+        source (found relative to the source file). Returns both.
+        """
+        set_id = hashlib.sha1(manifest).digest()
+        with self.lock:
+            header_set = self.sets.get(set_id)
+        local_headers = []
+        shared_headers = []
+        for dir, data in header_info:
+            local_files = tuple((file, content_entry) for file, relative,
+                content_entry in data if relative)
+            if local_files:
+                local_headers.append((dir, local_files))
+            if header_set is None:
+                shared_files = tuple((file, content_entry) for file,
+                    relative, content_entry in data if not relative)
+                if shared_files:
+                    shared_headers.append((dir, shared_files))
+        if header_set is None:
+            header_set = HeaderSet(set_id, manifest, tuple(shared_headers))
+            with self.lock:
+                header_set = self.sets.setdefault(set_id, header_set)
+                self.misses += 1
+        else:
+            with self.lock:
+                self.hits += 1
+        return header_set, tuple(local_headers)
+
+    def stats(self):
+        """
+        Returns number of live header sets, hits and misses.
+        """
+        with self.lock:
+            return len(self.sets), self.hits, self.misses
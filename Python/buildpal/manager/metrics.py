@@ -0,0 +1,57 @@
+from itertools import count
+from threading import Lock
+
+class Metrics:
+    """
+    Latest values of manager statistics, keyed by GUIEvent.
+
+    Instead of sending an update to the UI on every change, producers only
+    note that a value changed, which is cheap enough to do per task. The
+    value itself is computed by its registered sampler when a consumer
+    samples the metrics, at a fixed rate. Values which are already at
+    hand can be set directly by calling the object like an update_ui
+    callback.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.samplers = {}
+        self.values = {}
+        # Event type to version of its value. Versions come from a single
+        # counter, so a new version always differs from the one seen by a
+        # consumer.
+        self.versions = {}
+        self.counter = count(1)
+
+    def register(self, event_type, sampler):
+        self.samplers[event_type] = sampler
+
+    def touch(self, *event_types):
+        """
+        Note that values of sampled event types changed.
+        """
+        for event_type in event_types:
+            self.versions[event_type] = next(self.counter)
+
+    def __call__(self, event_type, event_data):
+        with self.lock:
+            self.values[event_type] = event_data
+            self.versions[event_type] = next(self.counter)
+
+    def sample(self, seen):
+        """
+        Returns dict of event type to value, for values which changed since
+        the previous sample. seen holds versions already seen by the
+        consumer, and is updated.
+        """
+        result = {}
+        for event_type, version in list(self.versions.items()):
+            if seen.get(event_type) == version:
+                continue
+            seen[event_type] = version
+            sampler = self.samplers.get(event_type)
+            if sampler is not None:
+                result[event_type] = sampler()
+            else:
+                with self.lock:
+                    result[event_type] = self.values[event_type]
+        return result
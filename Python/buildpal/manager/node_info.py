@@ -1,8 +1,16 @@
 from .timer import Timer
 from .compile_session import SessionResult
+from .trace import ClockOffset
 
+from buildpal.common.openmetrics import Histogram
+
+from collections import OrderedDict
 from time import time
 
+# Must not be larger than the number of header sets server keeps per
+# client.
+HEADER_SETS_PER_NODE = 1024
+
 class NodeInfo:
     def __init__(self, node_dict):
         self._node_dict = node_dict
@@ -14,9 +22,20 @@ class NodeInfo:
         self._tasks_timed_out  = 0
         self._total_time       = 0
         self._tasks_terminated = 0
+        self._tasks_busy       = 0
         self._tasks_change     = None
+        self._server_queued    = 0
+        self._server_free      = None
+        self._busy_until       = 0
         self._avg_tasks = {}
         self._timer = Timer()
+        self._session_durations = Histogram()
+        self._clock_offset = ClockOffset()
+        # Ids of header sets already sent to the server. The server keeps
+        # a limited number of them, so this is only a hint.
+        self._header_sets = OrderedDict()
+
+    def clock_offset(self): return self._clock_offset
 
     def node_id(self):
         return "{}:{}".format(self._node_dict['hostname'],
@@ -28,6 +47,8 @@ class NodeInfo:
 
     def tasks_terminated(self): return self._tasks_terminated
 
+    def tasks_busy(self): return self._tasks_busy
+
     def tasks_sent(self): return self._tasks_sent
 
     def tasks_cancelled(self): return self._tasks_cancelled
@@ -43,7 +64,7 @@ class NodeInfo:
     def tasks_pending(self): return (self.tasks_sent() -
         self.tasks_completed() - self.tasks_failed() - self.tasks_too_late() -
         self.tasks_cancelled() - self.tasks_timed_out() -
-        self.tasks_terminated())
+        self.tasks_terminated() - self.tasks_busy())
 
     def total_time(self): return self._total_time
 
@@ -78,12 +99,59 @@ class NodeInfo:
             self._tasks_too_late += 1
         elif result == SessionResult.terminated:
             self._tasks_terminated += 1
+        elif result == SessionResult.busy:
+            self._tasks_busy += 1
 
     def add_tasks_sent(self):
         self.__tasks_pending_about_to_change()
         self._tasks_sent += 1
 
-    def add_total_time(self, value): self._total_time += value
+    def add_total_time(self, value):
+        """
+        Add duration of a successful session.
+        """
+        self._total_time += value
+        self._session_durations.observe(value)
+
+    def session_durations(self): return self._session_durations
+
+    def set_server_load(self, queued, free_slots):
+        """
+        Load as reported by the server itself - number of sessions waiting
+        for a job slot and number of free job slots.
+        """
+        self._server_queued = queued
+        self._server_free = free_slots
+
+    def server_queued(self): return self._server_queued
+
+    def server_free_slots(self): return self._server_free
+
+    def set_busy(self, retry_after):
+        self._busy_until = time() + retry_after
+
+    def busy_for(self):
+        """
+        Number of seconds until the node accepts new sessions again.
+        """
+        return max(self._busy_until - time(), 0)
+
+    def is_busy(self):
+        return self.busy_for() > 0
+
+    def has_header_set(self, set_id):
+        if set_id not in self._header_sets:
+            return False
+        self._header_sets.move_to_end(set_id)
+        return True
+
+    def add_header_set(self, set_id):
+        self._header_sets[set_id] = None
+        if len(self._header_sets) > HEADER_SETS_PER_NODE:
+            self._header_sets.popitem(last=False)
+
+    def remove_header_set(self, set_id):
+        self._header_sets.pop(set_id, None)
 
     def timer(self):
         return self._timer
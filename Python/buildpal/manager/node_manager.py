@@ -2,27 +2,30 @@ from .compile_session import ServerSession
 from .compressor import Compressor
 
 from buildpal.common import MessageProtocol
+from buildpal.common.loop_monitor import AdaptiveExecutor
 
 import asyncio
 import logging
 import struct
 
-from concurrent.futures import ThreadPoolExecutor
 from math import floor
 from collections import defaultdict
 from .gui_event import GUIEvent
 
 class NodeManager:
-    def __init__(self, loop, node_info_getter, update_ui):
+    def __init__(self, loop, node_info_getter, metrics):
         self.loop = loop
         self.node_info_getter = node_info_getter
         self.node_info = []
-        self.update_ui = update_ui
+        self.metrics = metrics
+        metrics.register(GUIEvent.update_node_info, lambda : self.node_info)
+        metrics.register(GUIEvent.update_unassigned_tasks,
+            lambda : len(self.unassigned_tasks))
         self.all_sockets = defaultdict(list)
         self.tasks_running = defaultdict(list)
         self.sessions = {}
         self.unassigned_tasks = []
-        self.executor = ThreadPoolExecutor(2)
+        self.executor = AdaptiveExecutor('Node manager executor', 2, 8)
         self.compressor = Compressor(self.loop, self.executor)
         self.counter = 0
         self.update_node_info()
@@ -47,7 +50,7 @@ class NodeManager:
             session.terminate()
         for node in new_nodes:
             self.__find_work(node)
-        self.update_ui(GUIEvent.update_node_info, self.node_info)
+        self.metrics.touch(GUIEvent.update_node_info)
         if self.node_info_getter.update_interval:
             yield from asyncio.sleep(self.node_info_getter.update_interval,
                 loop=self.loop)
@@ -108,8 +111,7 @@ class NodeManager:
                 self.unassigned_tasks.insert(0, task)
             else:
                 self.unassigned_tasks.append(task)
-            self.update_ui(GUIEvent.update_unassigned_tasks,
-                len(self.unassigned_tasks))
+            self.metrics.touch(GUIEvent.update_unassigned_tasks)
         else:
             self.__schedule_task_to_specific_node(task, node)
 
@@ -121,11 +123,15 @@ class NodeManager:
         def session_completed(session):
             del self.sessions[session.local_id]
             self.tasks_running[session.node].remove(session.task)
-            self.__find_work(session.node)
+            if session.node.is_busy():
+                self.loop.call_later(session.node.busy_for(),
+                    self.__retry_busy_node, session.node)
+            else:
+                self.__find_work(session.node)
             if not session.task.session_completed(session):
                 # Give the task high priority.
                 self.schedule_task(session.task, high_priority=True)
-            self.update_ui(GUIEvent.update_node_info, self.node_info)
+            self.metrics.touch(GUIEvent.update_node_info)
 
         session = ServerSession(self.__generate_unique_id(), task,
             protocol.send_msg, node, self.loop, self.executor, self.compressor,
@@ -133,7 +139,11 @@ class NodeManager:
         self.tasks_running[node].append(task)
         self.sessions[session.local_id] = session
         session.start()
-        self.update_ui(GUIEvent.update_node_info, self.node_info)
+        self.metrics.touch(GUIEvent.update_node_info)
+
+    def __retry_busy_node(self, node):
+        if node in self.node_info and not node.is_busy():
+            self.__find_work(node)
 
     def __generate_unique_id(self):
         self.counter += 1
@@ -164,6 +174,9 @@ class NodeManager:
         return len(self.tasks_running[node]) < node.node_dict()['job_slots']
 
     def __free_slots(self, node):
+        # Server told us to back off.
+        if node.is_busy():
+            return 0
         return self.__target_tasks_per_node(node) - len(self.tasks_running[node])
 
     def __tasks_viable_for_stealing(self, src_node, tgt_node):
@@ -190,8 +203,7 @@ class NodeManager:
         while available_slots > 0:
             while self.unassigned_tasks:
                 task = self.unassigned_tasks.pop(0)
-                self.update_ui(GUIEvent.update_unassigned_tasks,
-                    len(self.unassigned_tasks))
+                self.metrics.touch(GUIEvent.update_unassigned_tasks)
                 task.note_time('taken from unassigned task queue', 'unassigned time')
                 self.__schedule_task_to_specific_node(task, node)
                 available_slots -= 1
@@ -220,7 +232,8 @@ class NodeManager:
         return node_sockets[0][1], node
 
     def process_msg(self, msg):
-        session_id, *msg = msg
+        session_id, load, *msg = msg
         session = self.sessions.get(session_id)
         if session:
+            session.node.set_server_load(*struct.unpack('!2I', load.memory()))
             session.got_data_from_server(msg)
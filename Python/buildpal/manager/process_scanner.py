@@ -0,0 +1,469 @@
+from .gui_event import GUIEvent
+from .header_sets import HeaderSetRegistry
+from .scan_profile import merge_profiles
+from .source_scanner import create_preprocessing_context, setup_preprocessor
+
+from buildpal.common.manifest import iter_manifest
+
+import preprocessing
+
+import logging
+import marshal
+import os
+
+from collections import OrderedDict
+from ctypes import c_ulonglong
+from itertools import count
+from multiprocessing import Pipe, Process, RawArray, RawValue, cpu_count
+from multiprocessing.connection import wait
+from queue import Queue
+from threading import Lock, Thread
+from time import sleep, time
+from weakref import WeakKeyDictionary
+
+class ContentProxy:
+    """
+    Stands in for preprocessing.ContentEntry of a header scanned in a worker
+    process. Content is loaded by manager's own content cache, and only when
+    the header actually needs to be sent. Checksums of shared headers are
+    taken from the manifest, others are computed when needed.
+    """
+    __slots__ = ('filename', 'content_checksum')
+
+    def __init__(self, filename, checksum=None):
+        self.filename = filename
+        self.content_checksum = checksum
+
+    def __content_entry(self):
+        content_entry = preprocessing.get_content_entry(self.filename)
+        if content_entry is None:
+            raise Exception("Failed to read '{}'.".format(self.filename))
+        return content_entry
+
+    def buffer(self):
+        return self.__content_entry().buffer()
+
+    def checksum(self):
+        if self.content_checksum is None:
+            self.content_checksum = self.__content_entry().checksum()
+        return self.content_checksum
+
+class ResultRing:
+    """
+    Ring buffer in shared memory. Written by a single worker process, and
+    read by the manager in the same order.
+
+    Positions are offsets in the (unbounded) stream of written bytes. The
+    reader publishes how far it got, so that the writer knows which part
+    of the buffer can be reused.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.data = RawArray('B', size)
+        self.consumed = RawValue(c_ulonglong, 0)
+        self.written = 0
+        self.view = None
+
+    def __getstate__(self):
+        return self.size, self.data, self.consumed, self.written
+
+    def __setstate__(self, state):
+        self.size, self.data, self.consumed, self.written = state
+        self.view = None
+
+    def __memory(self):
+        if self.view is None:
+            self.view = memoryview(self.data).cast('B')
+        return self.view
+
+    def write(self, data):
+        """
+        Store data, and return its (start, end) position. Returns None if
+        data is larger than the buffer.
+        """
+        size = len(data)
+        if size > self.size:
+            return None
+        start = self.written
+        offset = start % self.size
+        if offset + size > self.size:
+            # Records are not split, continue from the beginning.
+            start += self.size - offset
+            offset = 0
+        end = start + size
+        while end - self.consumed.value > self.size:
+            # Wait for the reader to catch up.
+            sleep(0.001)
+        self.__memory()[offset:offset + size] = data
+        self.written = end
+        return start, end
+
+    def read(self, start, end):
+        offset = start % self.size
+        data = bytes(self.__memory()[offset:offset + end - start])
+        self.consumed.value = end
+        return data
+
+class ContextLRU:
+    """
+    Preprocessing contexts known to a worker. Manager keeps a copy for each
+    worker, and as both see the same sequence of tasks, they agree on which
+    contexts the worker has without any further communication.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.contexts = OrderedDict()
+
+    def get(self, context_id):
+        pp_ctx = self.contexts.get(context_id)
+        if pp_ctx is not None:
+            self.contexts.move_to_end(context_id)
+        return pp_ctx
+
+    def add(self, context_id, pp_ctx):
+        self.contexts[context_id] = pp_ctx
+        if len(self.contexts) > self.capacity:
+            self.contexts.popitem(last=False)
+
+def encode_result(header_info, missing_headers, manifest):
+    # Checksums are not sent, shared headers have them in the manifest.
+    return marshal.dumps((tuple((dir, tuple((file, relative) for file,
+        relative, content_entry in data)) for dir, data in header_info),
+        tuple(missing_headers), manifest))
+
+def decode_result(data):
+    header_info, missing_headers, manifest = marshal.loads(data)
+    checksums = {(dir, file) : checksum for dir, files in iter_manifest(
+        manifest) for file, checksum in files}
+    return tuple((dir, tuple((file, relative, ContentProxy(os.path.join(dir,
+        file), None if relative else checksums.get((dir, file)))) for file,
+        relative in headers)) for dir, headers in header_info), \
+        missing_headers, manifest
+
+def scan_worker(task_conn, result_conn, ring, cache_snapshot,
+        revalidate_interval, max_contexts, memory_budget, content_budget,
+        map_threshold):
+    """
+    Worker process main. Scans sources with its own header cache, and sends
+    results back through the ring buffer.
+    """
+    cache = preprocessing.Cache(memory_budget)
+    if content_budget is not None:
+        preprocessing.set_content_cache_budget(content_budget)
+    preprocessing.set_map_threshold(map_threshold)
+    if cache_snapshot and os.path.exists(cache_snapshot):
+        cache.load_snapshot(cache_snapshot)
+    preprocessor = preprocessing.Preprocessor(cache)
+    setup_preprocessor(preprocessor)
+    contexts = ContextLRU(max_contexts)
+    last_revalidation = time()
+    last_profile = 0
+    while True:
+        message = task_conn.recv()
+        if message is None:
+            break
+        task_id, context_id, settings, source = message
+        if settings is None:
+            pp_ctx = contexts.get(context_id)
+        else:
+            pp_ctx = create_preprocessing_context(*settings)
+            contexts.add(context_id, pp_ctx)
+        now = time()
+        if now - last_revalidation >= revalidate_interval:
+            last_revalidation = now
+            preprocessing.revalidate_content_cache()
+        try:
+            result = encode_result(*preprocessor.scan_headers(pp_ctx, source,
+                manifest=True))
+        except Exception as e:
+            kind, payload = 'error', str(e)
+        else:
+            position = ring.write(result)
+            if position is None:
+                kind, payload = 'inline', result
+            else:
+                kind, payload = 'shared', position
+        stats = cache.get_stats(), preprocessor.files_preprocessed()
+        # Profile is comparatively large, send it at most once a second.
+        if now - last_profile >= 1:
+            last_profile = now
+            profile = preprocessing.get_profile()
+        else:
+            profile = None
+        result_conn.send((task_id, kind, payload, stats, profile))
+    if cache_snapshot:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_snapshot)),
+            exist_ok=True)
+        temp_file = cache_snapshot + '.tmp'
+        cache.save_snapshot(temp_file)
+        os.replace(temp_file, cache_snapshot)
+    result_conn.close()
+
+class Worker:
+    def __init__(self, index, cache_snapshot, revalidate_interval,
+            max_contexts, ring_size, memory_budget, content_budget,
+            map_threshold):
+        task_reader, self.task_conn = Pipe(False)
+        self.result_conn, result_writer = Pipe(False)
+        self.ring = ResultRing(ring_size)
+        self.contexts = ContextLRU(max_contexts)
+        self.outstanding = 0
+        # Cache stats and preprocessed file counts.
+        self.stats = (0,) * 6, (0,) * 3
+        self.profile = {}
+        self.process = Process(target=scan_worker, args=(task_reader,
+            result_writer, self.ring, cache_snapshot and '{}.{}'.format(
+            cache_snapshot, index), revalidate_interval, max_contexts,
+            memory_budget, content_budget, map_threshold))
+        self.process.daemon = True
+        self.process.start()
+        task_reader.close()
+        result_writer.close()
+
+class ProcessSourceScanner:
+    """
+    Scans sources in worker processes instead of threads, so that neither
+    the GIL nor a single shared header cache limits scaling.
+
+    Each worker has its own header cache shard. Sources are routed by
+    their directory, so that sources which include similar headers end up
+    on the same (warm) shard. A source is given to another worker only
+    if the preferred one has spill_threshold more outstanding tasks than
+    the least loaded one.
+
+    Header cache memory budget and content cache budget are split evenly
+    between workers.
+
+    add_task() is called from the event loop, so tasks are written to the
+    worker pipes by a dedicated thread, and a full pipe blocks only it. A
+    worker which exits fails its outstanding tasks and gets no new ones.
+    Once no worker is left, tasks fail right away.
+    """
+    def __init__(self, notify, metrics, process_count=cpu_count(),
+            cache_snapshot=None, revalidate_interval=1, max_contexts=64,
+            ring_size=4 * 1024 * 1024, spill_threshold=8, memory_budget=0,
+            content_budget=None, map_threshold=0):
+        self.notify = notify
+        self.metrics = metrics
+        metrics.register(GUIEvent.update_cache_stats, self.get_cache_stats)
+        metrics.register(GUIEvent.update_cache_memory, self.get_memory_stats)
+        metrics.register(GUIEvent.update_preprocessed_count,
+            self.files_preprocessed)
+        metrics.register(GUIEvent.update_scan_profile, self.get_profile)
+        self.spill_threshold = spill_threshold
+        # Protects state shared by the task sender and result reader threads.
+        self.lock = Lock()
+        # Tasks waiting to be sent to a worker, None stops the sender.
+        self.tasks = Queue()
+        self.task_ids = count()
+        self.context_ids = count()
+        self.context_id = WeakKeyDictionary()
+        self.pending = {}
+        self.affinity = {}
+        self.header_sets = HeaderSetRegistry()
+        if content_budget is not None:
+            content_budget //= process_count
+        self.workers = [Worker(index, cache_snapshot, revalidate_interval,
+            max_contexts, ring_size, memory_budget // process_count,
+            content_budget, map_threshold) for index in range(process_count)]
+        # Workers which get new tasks.
+        self.live_workers = list(self.workers)
+        self.sender = Thread(target=self.__send_tasks, name='Scan tasks')
+        self.sender.start()
+        self.reader = Thread(target=self.__read_results, name='Scan results')
+        self.reader.start()
+
+    def get_cache_stats(self):
+        with self.lock:
+            hits = sum(worker.stats[0][0] for worker in self.workers)
+            misses = sum(worker.stats[0][1] for worker in self.workers)
+        total = hits + misses
+        if total == 0:
+            total = 1
+        return hits, misses, hits / total
+
+    def queue_length(self):
+        """
+        Number of tasks not yet scanned.
+        """
+        with self.lock:
+            return len(self.pending) + self.tasks.qsize()
+
+    def files_preprocessed(self):
+        with self.lock:
+            return tuple(sum(worker.stats[1][index] for worker in
+                self.workers) for index in range(3))
+
+    def get_memory_stats(self):
+        """
+        Header cache memory usage and evictions, and content cache size and
+        evictions, summed over workers.
+        """
+        with self.lock:
+            return tuple(sum(worker.stats[0][index] for worker in
+                self.workers) for index in range(2, 6))
+
+    def get_profile(self):
+        with self.lock:
+            return merge_profiles(worker.profile for worker in self.workers)
+
+    def worker_stats(self):
+        """
+        Number of outstanding tasks and cache (hits, misses) per worker.
+        """
+        with self.lock:
+            return [(worker.outstanding, worker.stats[0][:2]) for worker in
+                self.workers]
+
+    def __select_worker(self, source):
+        # Called with self.lock held. Returns None if no worker is left.
+        if not self.live_workers:
+            return None
+        dir = os.path.normcase(os.path.dirname(source))
+        least_loaded = min(self.live_workers, key=lambda worker :
+            worker.outstanding)
+        worker = self.affinity.get(dir)
+        if worker is None:
+            worker = self.affinity[dir] = least_loaded
+        elif worker.outstanding > least_loaded.outstanding + \
+                self.spill_threshold:
+            worker = least_loaded
+        return worker
+
+    def __remove_worker(self, worker):
+        # Called with self.lock held.
+        if worker in self.live_workers:
+            self.live_workers.remove(worker)
+            for dir in [dir for dir, affine in self.affinity.items() if
+                    affine is worker]:
+                del self.affinity[dir]
+
+    def add_task(self, task):
+        task.note_time('queued for preprocessing')
+        self.tasks.put(task)
+
+    def __send_tasks(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            try:
+                self.__send_task(task)
+            except Exception:
+                logging.exception("Failed to send task to a header scanning "
+                    "process.")
+        with self.lock:
+            workers = list(self.live_workers)
+        for worker in workers:
+            try:
+                worker.task_conn.send(None)
+            except OSError:
+                pass
+
+    def __send_task(self, task):
+        preprocess_task = task.preprocess_task
+        context = preprocess_task.context
+        while True:
+            with self.lock:
+                worker = self.__select_worker(preprocess_task.source)
+                if worker is None:
+                    break
+                context_id = self.context_id.get(context)
+                if context_id is None:
+                    context_id = self.context_id[context] = \
+                        next(self.context_ids)
+                task_id = next(self.task_ids)
+                worker.outstanding += 1
+                self.pending[task_id] = task, worker
+            if worker.contexts.get(context_id) is None:
+                worker.contexts.add(context_id, True)
+                settings = (context.include_dirs, context.sysinclude_dirs,
+                    context.forced_includes, context.macros)
+            else:
+                settings = None
+            try:
+                worker.task_conn.send((task_id, context_id, settings,
+                    preprocess_task.source))
+                return
+            except OSError:
+                # Worker is gone, try another one. If the reader noticed
+                # first, it already failed the task.
+                with self.lock:
+                    lost = self.pending.pop(task_id, None)
+                    if lost is not None:
+                        worker.outstanding -= 1
+                    self.__remove_worker(worker)
+                if lost is None:
+                    return
+        self.notify(task, Exception("No header scanning process left."))
+
+    def __task_done(self, worker, message):
+        task_id, kind, payload, stats, profile = message
+        with self.lock:
+            task, worker = self.pending.pop(task_id)
+            worker.outstanding -= 1
+            worker.stats = stats
+            if profile is not None:
+                worker.profile = profile
+        try:
+            if kind == 'error':
+                raise Exception(payload)
+            if kind == 'shared':
+                payload = worker.ring.read(*payload)
+            header_info, task.missing_headers, manifest = decode_result(
+                payload)
+            task.header_set, task.local_headers = self.header_sets.intern(
+                header_info, manifest)
+            task.note_time('preprocessed', 'preprocessing time')
+            self.metrics.touch(GUIEvent.update_cache_stats,
+                GUIEvent.update_cache_memory,
+                GUIEvent.update_preprocessed_count)
+            if profile is not None:
+                self.metrics.touch(GUIEvent.update_scan_profile)
+            self.notify(task)
+        except Exception as e:
+            self.notify(task, e)
+
+    def __worker_exited(self, worker):
+        with self.lock:
+            self.__remove_worker(worker)
+            lost = [(task_id, task) for task_id, (task, task_worker) in
+                self.pending.items() if task_worker is worker]
+            for task_id, task in lost:
+                del self.pending[task_id]
+            worker.outstanding = 0
+        for task_id, task in lost:
+            self.notify(task, Exception("Header scanning process exited."))
+
+    def __read_results(self):
+        workers = {worker.result_conn : worker for worker in self.workers}
+        while workers:
+            for conn in wait(list(workers)):
+                worker = workers[conn]
+                try:
+                    try:
+                        message = conn.recv()
+                    except (EOFError, OSError):
+                        del workers[conn]
+                        self.__worker_exited(worker)
+                    else:
+                        self.__task_done(worker, message)
+                except Exception:
+                    # Keep reading, other tasks still wait for results.
+                    logging.exception("Failed to process header scanning "
+                        "result.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.tasks.put(None)
+        self.sender.join()
+        self.reader.join()
+        for worker in self.workers:
+            worker.process.join()
+            worker.task_conn.close()
+            worker.result_conn.close()
@@ -1,26 +1,39 @@
 from buildpal.common import MessageProtocol
 
 from .source_scanner import SourceScanner
+from .process_scanner import ProcessSourceScanner
 from .command_processor import CommandProcessor
 from .database import Database, DatabaseInserter
 from .timer import Timer
+from .metrics import Metrics
+from .gui_event import GUIEvent
 from .node_manager import NodeManager
 from .console import ConsolePrinter
+from .exposition import collect_manager_metrics
+from .trace import write_chrome_trace
+from .build_report import BuildTracker, analyze_build
+
+from buildpal.common.loop_monitor import LoopMonitor
+from buildpal.common.openmetrics import start_metrics_server
+from buildpal.common.sampling_profiler import SamplingProfiler
 
 from struct import pack as struct_pack
 
 import asyncio
+import logging
 import os
 
 from multiprocessing import cpu_count
 from subprocess import list2cmdline
-from tempfile import mkstemp
+from tempfile import gettempdir, mkstemp
+from time import strftime
 
 class ClientProcessor(MessageProtocol):
     def __init__(self, compiler_info_cache, task_created_func, database_inserter,
-            global_timer, update_ui):
+            global_timer, update_ui, separate_pdb=False, build_tracker=None):
         MessageProtocol.__init__(self)
         self.compiler_info_cache = compiler_info_cache
+        self.separate_pdb = separate_pdb
         self.task_created_func = task_created_func
         self.global_timer = global_timer
         self.update_ui = update_ui
@@ -28,6 +41,17 @@ class ClientProcessor(MessageProtocol):
         self.transport = None
         self.command_processor = None
         self.database_inserter = database_inserter
+        self.build_tracker = build_tracker
+
+    def connection_made(self, transport):
+        MessageProtocol.connection_made(self, transport)
+        if self.build_tracker is not None:
+            self.build_tracker.client_connected()
+
+    def connection_lost(self, exc):
+        MessageProtocol.connection_lost(self, exc)
+        if self.build_tracker is not None:
+            self.build_tracker.client_disconnected()
 
     def do_exit(self, retcode, stdout, stderr):
         self.send_msg([b'EXIT', struct_pack('!I', retcode & 0xFFFFFFFF), stdout,
@@ -61,11 +85,14 @@ class ClientProcessor(MessageProtocol):
         sysinclude_dirs = msg[2].decode()
         cwd = msg[3].decode()
         command = [x.decode() for x in msg[4:]]
-        from .compilers import MSVCCompiler
-        compiler = MSVCCompiler()
+        from .compilers import MSVCCompiler, MSVCSeparatePDBCompiler
+        if self.separate_pdb:
+            compiler = MSVCSeparatePDBCompiler()
+        else:
+            compiler = MSVCCompiler()
         self.command_processor = CommandProcessor(self, executable, cwd,
             sysinclude_dirs, compiler, command, self.database_inserter,
-            self.global_timer, self.update_ui)
+            self.global_timer, self.update_ui, self.build_tracker)
 
         if self.command_processor.build_local():
             self.do_run_locally()
@@ -94,8 +121,40 @@ class ClientProcessor(MessageProtocol):
             self.task_created_func(task)
 
 class ManagerRunner:
-    def __init__(self, port, n_pp_threads):
+    # Seconds between two updates of the GUI.
+    ui_refresh_interval = 0.2
+    # A build is considered complete once no client has been connected for
+    # this many seconds.
+    build_idle_time = 5
+
+    def __init__(self, port, n_pp_threads, separate_pdb=False,
+            cache_snapshot=None, scan_processes=0, cache_budget=0,
+            content_cache_budget=None, map_threshold=0, history_db=None,
+            history_days=0, history_commands=0, metrics_address=None,
+            trace_file=None):
         self.port = port
+        self.separate_pdb = separate_pdb
+        self.cache_snapshot = cache_snapshot
+        # Scan headers in this many worker processes instead of threads.
+        self.scan_processes = scan_processes
+        # Header cache and content cache memory budgets, in bytes.
+        self.cache_budget = cache_budget
+        self.content_cache_budget = content_cache_budget
+        # Headers of at least this size are memory mapped, 0 - never.
+        self.map_threshold = map_threshold
+        # Command history is kept in this file between runs. History older
+        # than history_days, and all but the last history_commands commands
+        # are removed on start, 0 - no limit.
+        self.history_db = history_db
+        self.history_days = history_days
+        self.history_commands = history_commands
+        # (host, port) on which metrics are served over HTTP, or None.
+        self.metrics_address = metrics_address
+        self.metrics_server = None
+        # Trace of commands from this run is written to this file on exit.
+        self.trace_file = trace_file
+        self.profiler = SamplingProfiler()
+        self.profile_dir = os.path.join(gettempdir(), 'BuildPal', 'Profiles')
         self.compiler_info_cache = {}
         self.timer = Timer()
         self.server = None
@@ -105,27 +164,49 @@ class ManagerRunner:
             self.n_pp_threads = cpu_count()
 
     def run(self, node_info_getter, update_ui=None, silent=False):
-        if update_ui is None:
-            self.update_ui = lambda event_type, event_data : None
-        else:
-            self.update_ui = update_ui
+        # Components update metrics, which are sent to the UI at most once
+        # per ui_refresh_interval.
+        self.metrics = Metrics()
+        self.update_ui = self.metrics
+        # Sampled on the event loop thread, which updates the timer.
+        self.metrics.register(GUIEvent.update_global_timers,
+            lambda : dict(self.timer.as_dict()))
 
-        handle, db_file = mkstemp(prefix='buildpal_cmd', suffix='.db')
-        os.close(handle)
-        self.database = Database(db_file)
+        if self.history_db is None:
+            handle, db_file = mkstemp(prefix='buildpal_cmd', suffix='.db')
+            os.close(handle)
+            self.database = Database(db_file)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(self.history_db)),
+                exist_ok=True)
+            self.database = Database(self.history_db, persistent=True)
         with self.database.get_connection() as conn:
             self.database.create_structure(conn)
+            self.database.apply_retention(conn, self.history_days * 24 * 3600,
+                self.history_commands)
+            first_command = (self.database.command_range(conn)[1] or 0) + 1
 
         self.loop = asyncio.ProactorEventLoop()
 
-        node_manager = NodeManager(self.loop, node_info_getter, self.update_ui)
+        node_manager = NodeManager(self.loop, node_info_getter, self.metrics)
+        self.profiler.add_executor(node_manager.executor.name,
+            node_manager.executor)
+        loop_monitor = LoopMonitor(self.loop, executors=[node_manager.executor])
+        self.loop.call_soon(loop_monitor.start)
 
+        # Called with a BuildReport after each build.
+        report_build = None
         if update_ui is None and not silent:
             class UIData: pass
             ui_data = UIData()
             ui_data.timer = self.timer
             ui_data.command_db = self.database
             ui_data.cache_stats = lambda : source_scanner.get_cache_stats()
+            ui_data.scan_profile = lambda : source_scanner.get_profile()
+            ui_data.cache_memory = lambda : source_scanner.get_memory_stats()
+            if self.scan_processes <= 0:
+                ui_data.scan_cache_stats = \
+                    lambda : source_scanner.get_scan_cache_stats()
             observer = ConsolePrinter(node_manager.get_node_info, ui_data)
             @asyncio.coroutine
             def observe():
@@ -133,29 +214,112 @@ class ManagerRunner:
                 yield from asyncio.sleep(0.5, loop=self.loop)
                 asyncio.async(observe(), loop=self.loop)
             asyncio.async(observe(), loop=self.loop)
+            report_build = observer.print_build_report
+        elif update_ui is not None:
+            seen = {}
+            @asyncio.coroutine
+            def publish():
+                for event_type, event_data in self.metrics.sample(
+                        seen).items():
+                    update_ui(event_type, event_data)
+                yield from asyncio.sleep(self.ui_refresh_interval,
+                    loop=self.loop)
+                asyncio.async(publish(), loop=self.loop)
+            asyncio.async(publish(), loop=self.loop)
+            report_build = lambda report : self.metrics(
+                GUIEvent.update_build_report, report)
+
+        build_tracker = None
+        if report_build is not None:
+            build_tracker = BuildTracker(self.build_idle_time)
+            @asyncio.coroutine
+            def check_build():
+                commands = build_tracker.build_completed()
+                if commands is not None:
+                    try:
+                        report = yield from self.loop.run_in_executor(None,
+                            analyze_build, commands)
+                    except Exception:
+                        logging.exception("Failed to analyze build.")
+                    else:
+                        report_build(report)
+                yield from asyncio.sleep(1, loop=self.loop)
+                asyncio.async(check_build(), loop=self.loop)
+            asyncio.async(check_build(), loop=self.loop)
+
+        if self.scan_processes > 0:
+            source_scanner = ProcessSourceScanner(node_manager.task_preprocessed,
+                self.metrics, self.scan_processes, self.cache_snapshot,
+                memory_budget=self.cache_budget,
+                content_budget=self.content_cache_budget,
+                map_threshold=self.map_threshold)
+        else:
+            source_scanner = SourceScanner(node_manager.task_preprocessed,
+                self.metrics, self.n_pp_threads, self.cache_snapshot,
+                memory_budget=self.cache_budget,
+                content_budget=self.content_cache_budget,
+                map_threshold=self.map_threshold)
 
         with DatabaseInserter(self.database, self.update_ui) as database_inserter, \
-            SourceScanner(node_manager.task_preprocessed, self.update_ui,
-                self.n_pp_threads) as source_scanner:
+            source_scanner:
 
             def client_processor_factory():
                 return ClientProcessor(self.compiler_info_cache, source_scanner.add_task,
-                    database_inserter, self.timer, self.update_ui)
+                    database_inserter, self.timer, self.update_ui,
+                    self.separate_pdb, build_tracker)
 
             [self.client_server] = self.loop.run_until_complete(
                 self.loop.start_serving_pipe(
                 client_processor_factory,
                 "\\\\.\\pipe\\BuildPal_{}".format(self.port)))
 
+            if self.metrics_address is not None:
+                self.metrics_server = start_metrics_server(self.loop,
+                    self.metrics_address, lambda : collect_manager_metrics(
+                    node_manager, source_scanner, database_inserter,
+                    loop_monitor), self.profiler)
+
             try:
                 self.loop.run_forever()
             finally:
+                loop_monitor.stop()
                 self.loop.close()
                 del self.loop
 
+        if self.trace_file is not None:
+            with self.database.get_connection() as conn, \
+                    open(self.trace_file, 'wt') as file:
+                write_chrome_trace(file, self.database, conn, first_command)
+
+    def profile(self, seconds):
+        """
+        Profile the manager for the given number of seconds. Collapsed
+        stacks are written to a file in profile_dir. The UI always gets
+        (filename, error) once done, error is None on success. Returns False
+        if the profiler is already running.
+        """
+        def completed(stacks):
+            filename = os.path.join(self.profile_dir, 'manager_{}_{}.txt'
+                .format(self.port, strftime('%Y%m%d_%H%M%S')))
+            error = None
+            try:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                with open(filename, 'wt') as file:
+                    file.write(stacks)
+            except Exception as e:
+                logging.exception("Failed to write profile.")
+                error = "{}".format(e)
+            else:
+                logging.info("Profile written to '{}'.".format(filename))
+            self.update_ui(GUIEvent.profile_completed, (filename, error))
+        return self.profiler.start(seconds, completed)
+
     def stop(self):
+        self.profiler.stop()
         def close_stuff():
             self.client_server.close()
+            if self.metrics_server is not None:
+                self.metrics_server.close()
             # If we do self.loop.stop() directly we (later on) get an exception
             # that task/future was never retrieved. Adding stop() to task queue
             # somehow avoids the issue. Reported to python.tulip mailing list.
@@ -0,0 +1,50 @@
+"""
+Helpers for the header scanner profile, as returned by
+preprocessing.get_profile() - a dict of phase name to (count, seconds,
+histogram). Histogram bucket 0 counts durations below 1us, bucket n
+durations in [2^(n-1), 2^n) us.
+"""
+
+def merge_profiles(profiles):
+    """
+    Sum profiles of several processes.
+    """
+    result = {}
+    for profile in profiles:
+        for phase, (count, seconds, histogram) in profile.items():
+            if phase not in result:
+                result[phase] = count, seconds, tuple(histogram)
+                continue
+            total_count, total_seconds, total_histogram = result[phase]
+            result[phase] = (total_count + count, total_seconds + seconds,
+                tuple(a + b for a, b in zip(total_histogram, histogram)))
+    return result
+
+def percentile(histogram, fraction):
+    """
+    Upper bound (in microseconds) of the histogram bucket containing the
+    given fraction of samples.
+    """
+    total = sum(histogram)
+    if not total:
+        return 0
+    threshold = fraction * total
+    seen = 0
+    for bucket, count in enumerate(histogram):
+        seen += count
+        if seen >= threshold:
+            return 1 << bucket
+    return 1 << (len(histogram) - 1)
+
+def profile_rows(profile):
+    """
+    Returns (phase, count, seconds, share of total time, median us,
+    99th percentile us) tuples, most expensive phase first.
+    """
+    total_seconds = sum(seconds for count, seconds, histogram in
+        profile.values()) or 1
+    rows = [(phase, count, seconds, seconds / total_seconds,
+        percentile(histogram, 0.5), percentile(histogram, 0.99)) for phase,
+        (count, seconds, histogram) in profile.items()]
+    rows.sort(key=lambda row : row[2], reverse=True)
+    return rows
@@ -0,0 +1,99 @@
+import preprocessing
+
+import os
+
+from collections import OrderedDict
+from threading import Lock
+from weakref import WeakKeyDictionary
+
+class ScanResultCache:
+    """
+    Remembers scan results of source files, so that sources which did not
+    change do not have to be scanned again.
+
+    Results are keyed by source file name and content checksum, and by
+    preprocessing settings. A result is valid as long as all headers it
+    recorded keep their checksums. Content cache revalidates files by
+    comparing file stat, so for an unchanged source this boils down to a
+    stat per header.
+
+    Note that a new header which would shadow a recorded one (e.g. a file
+    created in an earlier include directory) is not detected. Results with
+    missing headers are not remembered.
+    """
+    def __init__(self, capacity=16 * 1024):
+        self.capacity = capacity
+        self.lock = Lock()
+        self.entries = OrderedDict()
+        # Header sets are shared by many sources, so each is validated
+        # only once per content cache generation. Maps header set to
+        # (generation, valid).
+        self.validated_sets = WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, preprocess_task):
+        """
+        Returns key for storing the result, and the remembered result, a
+        (header set, local headers, missing headers) tuple, or None.
+        """
+        source_entry = preprocessing.get_content_entry(preprocess_task.source)
+        if source_entry is None:
+            with self.lock:
+                self.misses += 1
+            return None, None
+        key = (os.path.normcase(preprocess_task.source),
+            source_entry.checksum(), preprocess_task.context.key)
+        with self.lock:
+            result = self.entries.get(key)
+            if result is not None:
+                self.entries.move_to_end(key)
+        if result is not None and not self.__valid(*result):
+            with self.lock:
+                self.entries.pop(key, None)
+            result = None
+        with self.lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return key, result
+
+    def store(self, key, header_set, local_headers, missing_headers):
+        if key is None or missing_headers:
+            return
+        with self.lock:
+            self.entries[key] = header_set, local_headers, missing_headers
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        if total == 0:
+            total = 1
+        return hits, misses, hits / total
+
+    def __valid(self, header_set, local_headers, missing_headers):
+        generation, invalidated = preprocessing.content_cache_stats()
+        with self.lock:
+            validated = self.validated_sets.get(header_set)
+        if validated is not None and validated[0] == generation:
+            set_valid = validated[1]
+        else:
+            set_valid = self.__unchanged(header_set.headers)
+            with self.lock:
+                self.validated_sets[header_set] = generation, set_valid
+        return set_valid and self.__unchanged(local_headers)
+
+    @staticmethod
+    def __unchanged(headers):
+        for dir, data in headers:
+            for file, content_entry in data:
+                current = preprocessing.get_content_entry(
+                    os.path.join(dir, file))
+                if current is None or current.checksum() != \
+                        content_entry.checksum():
+                    return False
+        return True
@@ -1,15 +1,22 @@
 from .gui_event import GUIEvent
+from .header_sets import HeaderSetRegistry
+from .scan_result_cache import ScanResultCache
 
 import preprocessing
 
+import os
+
+from collections import deque
 from multiprocessing import cpu_count
-from queue import Queue
-from threading import Thread
+from threading import Condition, Thread
+from time import time
 
-def collect_headers(preprocessor, filename, include_dirs, sysinclude_dirs,
+def create_preprocessing_context(include_dirs, sysinclude_dirs,
         forced_includes, defines):
-    preprocessor.set_ms_mode(True) # If MSVC.
-    preprocessor.set_ms_ext(True) # Should depend on Ze & Za compiler options.
+    """
+    Create a frozen preprocessing context, which can be shared by any number
+    of scan_headers_batch() calls.
+    """
     ppc = preprocessing.PreprocessingContext()
     for path in include_dirs:
         ppc.add_include_path(path, False)
@@ -24,69 +31,220 @@ def collect_headers(preprocessor, filename, include_dirs, sysinclude_dirs,
         ppc.add_macro(macro, value)
     for forced_include in forced_includes:
         ppc.add_forced_include(forced_include)
-    return preprocessor.scan_headers(ppc, filename)
-
-def header_info(preprocessor, preprocess_task):
-    header_info, missing_headers = collect_headers(preprocessor,
-        preprocess_task.source, preprocess_task.include_dirs,
-        preprocess_task.sysinclude_dirs, preprocess_task.forced_includes,
-        preprocess_task.macros)
-    shared_file_list = []
-    for dir, data in header_info:
-        shared_files_in_dir = []
-        # Headers which are relative to source file are not
-        # considered as candidates for server cache, and are
-        # always sent together with the source file.
-        for file, relative, content_entry in data:
-            if not relative:
-                shared_files_in_dir.append((file, content_entry.checksum()))
-        shared_file_list.append((dir, shared_files_in_dir))
-    return header_info, tuple(shared_file_list), missing_headers
+    ppc.freeze()
+    return ppc
+
+def preprocessing_context(context):
+    """
+    Return preprocessing context for the given PreprocessContext, creating it
+    on first use.
+    """
+    with context.lock:
+        if context.pp_ctx is None:
+            context.pp_ctx = create_preprocessing_context(context.include_dirs,
+                context.sysinclude_dirs, context.forced_includes,
+                context.macros)
+        return context.pp_ctx
+
+def setup_preprocessor(preprocessor):
+    preprocessor.set_ms_mode(True) # If MSVC.
+    preprocessor.set_ms_ext(True) # Should depend on Ze & Za compiler options.
+
+def collect_headers(preprocessor, filename, include_dirs, sysinclude_dirs,
+        forced_includes, defines, manifest=False):
+    setup_preprocessor(preprocessor)
+    ppc = create_preprocessing_context(include_dirs, sysinclude_dirs,
+        forced_includes, defines)
+    return preprocessor.scan_headers(ppc, filename, manifest)
 
 
 class SourceScanner:
     class ShutdownThread: pass
 
-    def __init__(self, notify, update_ui, thread_count=cpu_count() + 1):
+    def __init__(self, notify, metrics, thread_count=cpu_count() + 1,
+            cache_snapshot=None, revalidate_interval=1, max_batch_size=16,
+            memory_budget=0, content_budget=None, map_threshold=0):
         preprocessing.clear_content_cache()
-        self.cache = preprocessing.Cache()
+        if content_budget is not None:
+            preprocessing.set_content_cache_budget(content_budget)
+        preprocessing.set_map_threshold(map_threshold)
+        preprocessing.reset_profile()
+        self.last_profile_update = 0
+        self.metrics = metrics
+        metrics.register(GUIEvent.update_cache_stats, self.get_cache_stats)
+        metrics.register(GUIEvent.update_cache_memory, self.get_memory_stats)
+        metrics.register(GUIEvent.update_scan_cache_stats,
+            self.get_scan_cache_stats)
+        metrics.register(GUIEvent.update_preprocessed_count,
+            self.files_preprocessed)
+        metrics.register(GUIEvent.update_scan_profile, self.get_profile)
+        # Cached files are checked for changes at most once per interval
+        # (in seconds).
+        self.revalidate_interval = revalidate_interval
+        self.last_revalidation = time()
+        # Least recently hit header cache entries are evicted once they use
+        # more than memory_budget bytes (0 - no limit).
+        self.cache = preprocessing.Cache(memory_budget)
+        # Header cache from the previous run. Entries are validated lazily,
+        # when their header is first included.
+        self.cache_snapshot = cache_snapshot
+        if cache_snapshot and os.path.exists(cache_snapshot):
+            self.cache.load_snapshot(cache_snapshot)
         self.preprocessor = preprocessing.Preprocessor(self.cache)
-        self.in_queue = Queue()
+        setup_preprocessor(self.preprocessor)
+        self.header_sets = HeaderSetRegistry()
+        self.scan_results = ScanResultCache()
+        # Tasks of a single command share preprocessing context, and are
+        # scanned in batches of at most max_batch_size sources.
+        self.max_batch_size = max_batch_size
+        self.in_queue = deque()
+        self.queue_condition = Condition()
         self.closing = False
         self.threads = set()
         for _ in range(thread_count):
-            thread = Thread(target=self.__process_task_worker, args=(notify, update_ui))
+            thread = Thread(target=self.__process_task_worker, args=(notify,),
+                name='Scanner')
             self.threads.add(thread)
         for thread in self.threads:
             thread.start()
 
     def get_cache_stats(self):
-        hits, misses = self.cache.get_stats()
+        hits, misses = self.cache.get_stats()[:2]
         total = hits + misses
         if total == 0:
             total = 1
         return hits, misses, hits / total
 
+    def get_memory_stats(self):
+        """
+        Header cache memory usage and evictions, and content cache size and
+        evictions.
+        """
+        return self.cache.get_stats()[2:]
+
+    def get_scan_cache_stats(self):
+        return self.scan_results.stats()
+
+    def get_profile(self):
+        return preprocessing.get_profile()
+
+    def files_preprocessed(self):
+        return self.preprocessor.files_preprocessed()
+
+    def queue_length(self):
+        return len(self.in_queue)
+
+    def get_snapshot_stats(self):
+        return self.cache.get_snapshot_stats()
+
+    def save_cache_snapshot(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_snapshot)),
+            exist_ok=True)
+        # Do not leave a truncated snapshot behind if we fail midway.
+        temp_file = self.cache_snapshot + '.tmp'
+        self.cache.save_snapshot(temp_file)
+        os.replace(temp_file, self.cache_snapshot)
+
     def add_task(self, task):
+        now = time()
+        if now - self.last_revalidation >= self.revalidate_interval:
+            self.last_revalidation = now
+            preprocessing.revalidate_content_cache()
         task.note_time('queued for preprocessing')
-        self.in_queue.put(task)
+        self.__put(task)
 
-    def __process_task_worker(self, notify, update_ui):
-        while True:
-            task = self.in_queue.get()
+    def __put(self, item):
+        with self.queue_condition:
+            self.in_queue.append(item)
+            self.queue_condition.notify()
+
+    def __get_batch(self):
+        """
+        Take the first queued task, together with the tasks queued right
+        after it which share its context. Enough tasks are left in the queue
+        to keep other threads busy.
+        """
+        with self.queue_condition:
+            while not self.in_queue:
+                self.queue_condition.wait()
+            task = self.in_queue.popleft()
             if task is self.ShutdownThread:
+                return task
+            batch = [task]
+            context = task.preprocess_task.context
+            limit = min(self.max_batch_size,
+                1 + len(self.in_queue) // len(self.threads))
+            while len(batch) < limit and self.in_queue and \
+                    self.in_queue[0] is not self.ShutdownThread and \
+                    self.in_queue[0].preprocess_task.context is context:
+                batch.append(self.in_queue.popleft())
+            return batch
+
+    def __task_done(self, task, notify):
+        task.note_time('preprocessed', 'preprocessing time')
+        self.metrics.touch(GUIEvent.update_cache_stats,
+            GUIEvent.update_cache_memory, GUIEvent.update_scan_cache_stats,
+            GUIEvent.update_preprocessed_count)
+        now = time()
+        if now - self.last_profile_update >= 1:
+            self.last_profile_update = now
+            self.metrics.touch(GUIEvent.update_scan_profile)
+        notify(task)
+
+    def __process_task_worker(self, notify):
+        while True:
+            batch = self.__get_batch()
+            if batch is self.ShutdownThread:
                 return
-            task.note_time('dequeued by preprocessor', 'waiting for preprocessor thread')
+            to_scan = []
+            keys = []
+            for task in batch:
+                task.note_time('dequeued by preprocessor', 'waiting for preprocessor thread')
+                try:
+                    key, result = self.scan_results.lookup(task.preprocess_task)
+                except Exception as e:
+                    notify(task, e)
+                    continue
+                if result is None:
+                    to_scan.append(task)
+                    keys.append(key)
+                else:
+                    task.header_set, task.local_headers, \
+                        task.missing_headers = result
+                    self.__task_done(task, notify)
+            batch = to_scan
+            if not batch:
+                continue
+
+            delivered = set()
+
+            def task_scanned(index, result):
+                task = batch[index]
+                if not isinstance(result, Exception):
+                    try:
+                        header_info, task.missing_headers, manifest = result
+                        task.header_set, task.local_headers = \
+                            self.header_sets.intern(header_info, manifest)
+                        self.scan_results.store(keys[index], task.header_set,
+                            task.local_headers, task.missing_headers)
+                        self.__task_done(task, notify)
+                    except Exception as e:
+                        result = e
+                    else:
+                        delivered.add(index)
+                        return
+                notify(task, result)
+                delivered.add(index)
+
             try:
-                task.header_info, task.server_task.filelist, task.missing_headers = \
-                    header_info(self.preprocessor, task.preprocess_task)
-                task.note_time('preprocessed', 'preprocessing time')
+                pp_ctx = preprocessing_context(batch[0].preprocess_task.context)
+                self.preprocessor.scan_headers_batch(pp_ctx, [task.preprocess_task.source
+                    for task in batch], task_scanned, manifest=True)
             except Exception as e:
-                notify(task, e)
-            else:
-                update_ui(GUIEvent.update_cache_stats, self.get_cache_stats())
-                update_ui(GUIEvent.update_preprocessed_count, self.preprocessor.files_preprocessed())
-                notify(task)
+                # Notify tasks which did not get their result.
+                for index, task in enumerate(batch):
+                    if index not in delivered:
+                        notify(task, e)
 
     def __enter__(self):
         return self
@@ -96,7 +254,10 @@ class SourceScanner:
 
     def close(self):
         for thread in self.threads:
-            self.in_queue.put(self.ShutdownThread)
+            self.__put(self.ShutdownThread)
 
         for thread in self.threads:
             thread.join()
+
+        if self.cache_snapshot:
+            self.save_cache_snapshot()
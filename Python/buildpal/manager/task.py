@@ -1,14 +1,29 @@
 from .compile_session import SessionResult
 from buildpal.common import Timer
 
-class PreprocessTask:
-    def __init__(self, source, macros, include_dirs, sysinclude_dirs, forced_includes,
-            pch_header):
-        self.source = source
+from threading import Lock
+
+class PreprocessContext:
+    """
+    Preprocessor settings shared by all sources of a single compiler
+    invocation. Source scanner creates the corresponding (frozen)
+    preprocessing.PreprocessingContext once, and keeps it in pp_ctx.
+    """
+    def __init__(self, macros, include_dirs, sysinclude_dirs, forced_includes):
         self.macros = macros
         self.include_dirs = include_dirs
         self.sysinclude_dirs = sysinclude_dirs
         self.forced_includes = forced_includes
+        # Identifies the settings, e.g. for scan result cache.
+        self.key = (tuple(macros), tuple(include_dirs), tuple(sysinclude_dirs),
+            tuple(forced_includes))
+        self.pp_ctx = None
+        self.lock = Lock()
+
+class PreprocessTask:
+    def __init__(self, source, context, pch_header):
+        self.source = source
+        self.context = context
         self.pch_header = pch_header
 
 class Task(Timer):
@@ -27,6 +42,24 @@ class Task(Timer):
         self.sessions_finished = set()
         self.completed_by_session = None
 
+        # Set by source scanner, see header_sets.HeaderSetRegistry.
+        self.header_set = None
+        self.local_headers = ()
+        self.missing_headers = ()
+
+    @property
+    def header_info(self):
+        """
+        Headers included by the source file, as
+        (dir, ((file, relative, content_entry), ...)) pairs.
+        """
+        for dir, data in self.header_set.headers:
+            yield dir, ((file, False, content_entry) for file, content_entry
+                in data)
+        for dir, data in self.local_headers:
+            yield dir, ((file, True, content_entry) for file, content_entry
+                in data)
+
     @property
     def compiler_info(self):
         return self.command_processor.compiler_info
@@ -77,7 +110,8 @@ class Task(Timer):
         # In case we got a server failure, reschedule the task.
         if session.result in (SessionResult.failure,
                               SessionResult.timed_out,
-                              SessionResult.terminated):
+                              SessionResult.terminated,
+                              SessionResult.busy):
             # We owe the result, but we failed.
             if self.completed_by_session == session:
                 self.completed_by_session = None
@@ -111,6 +145,5 @@ class Task(Timer):
             'pch_file' : self.pch_file[0] if self.pch_file else None,
             'sessions' : list(session.get_info() for session in
                 self.sessions_finished),
-            'times' : list(dict(time_point_ord=o, time_point_name=n,
-                time_point=t) for o, (n, t) in self.time_points())
+            'times' : (self.time_point_names(), self.times[:])
         }
@@ -0,0 +1,194 @@
+"""
+Per-task trace spans, exported in Chrome trace event format.
+
+Spans are built from time points kept in command history: task time points
+noted by the manager, and session time points noted by the server. Server
+times are converted to manager clock when the session result arrives, see
+ClockOffset.
+"""
+import heapq
+import json
+
+from collections import deque, namedtuple
+
+Span = namedtuple('Span', 'name category start end args')
+
+class ClockOffset:
+    """
+    Estimates offset of a server clock (server time - manager time).
+
+    Every session gives a sample: the manager notes when it sent the new
+    session request and when the reply arrived, and the server reports when
+    it got the request and when it replied. As with NTP, the error of a
+    sample is at most half of its round trip time, so the estimate is taken
+    from the sample with the shortest round trip among the recent ones.
+    """
+    def __init__(self, window=16):
+        self.samples = deque(maxlen=window)
+
+    def add_sample(self, sent, server_received, server_sent, received):
+        round_trip = (received - sent) - (server_sent - server_received)
+        offset = ((server_received - sent) + (server_sent - received)) / 2
+        self.samples.append((max(round_trip, 0), offset))
+
+    def estimate(self):
+        """
+        Returns (offset, round trip time), or None if there are no samples.
+        """
+        if not self.samples:
+            return None
+        round_trip, offset = min(self.samples)
+        return offset, round_trip
+
+# Task time point to (name, category) of the span ending at it. Spans of
+# other time points are named after the time point.
+TASK_SPANS = {
+    'dequeued by preprocessor'        : ('wait for preprocessor', 'queue'),
+    'preprocessed'                    : ('preprocess', 'preprocess'),
+    'collected from preprocessor'     : ('preprocessed notification', 'queue'),
+    'taken from unassigned task queue': ('wait for node', 'queue'),
+    'assigned to a server session'    : ('wait for session', 'queue'),
+    'completed notification'          : ('remote', 'remote'),
+    'session successful'              : ('download', 'network'),
+}
+
+# Session time points in order, with (name, category) of the span ending at
+# them. Server time points are optional, a span starts at the previous time
+# point the session has. Manager time points are 'started', 'responded',
+# 'result received' and 'completed'.
+SESSION_SPANS = (
+    ('started'                 , None),
+    ('received task'           , ('request', 'network')),
+    ('determined missing files', ('missing files', 'server')),
+    ('responded'               , ('reply', 'network')),
+    ('received missing headers', ('upload', 'network')),
+    ('received compiler'       , ('upload compiler', 'network')),
+    ('received pch'            , ('upload pch', 'network')),
+    ('ready for compile'       , ('prepare', 'server')),
+    ('compile slot acquired'   , ('server queue', 'queue')),
+    ('compilation done'        , ('compile', 'compile')),
+    ('result received'         , ('reply', 'network')),
+    ('completed'               , ('download', 'network')),
+)
+
+def task_spans(task):
+    """
+    Spans of a task, the first one covers the whole task.
+    """
+    names, times = task['times']
+    if not times:
+        return []
+    spans = [Span(task['source'], 'task', times[0], times[-1], None)]
+    for name, start, end in zip(names[1:], times, times[1:]):
+        span_name, category = TASK_SPANS.get(name, (name, 'manager'))
+        spans.append(Span(span_name, category, start, end, None))
+    return spans
+
+def session_spans(session, source):
+    """
+    Spans of a session, the first one covers the whole session. Server
+    spans are shown only if the session has server times.
+    """
+    points = {'responded' : session.get('responded'),
+        'result received' : session.get('result_received'),
+        'completed' : session['completed']}
+    if 'server_times' in session:
+        points.update(zip(*session['server_times']))
+    args = {'source' : source, 'result' : session['result'].name}
+    if session.get('clock_offset') is not None:
+        args['clock offset'] = session['clock_offset']
+    spans = [Span(source, 'session', session['started'],
+        session['completed'], args)]
+    start = session['started']
+    for name, span in SESSION_SPANS[1:]:
+        end = points.get(name)
+        if end is None:
+            continue
+        # Server times are only as good as the clock offset estimate, keep
+        # spans ordered regardless.
+        end = min(max(end, start), session['completed'])
+        spans.append(Span(span[0], span[1], start, end, None))
+        start = end
+    return spans
+
+def command_end(command):
+    """
+    Time the client got the command's result. Sessions racing for a task
+    may still run after that, until the command is 'completed'.
+    """
+    if command.get('replied') is not None:
+        return command['replied']
+    return command['completed']
+
+def command_tracks(command):
+    """
+    Returns (process, spans) pairs for a command. Spans of a single pair are
+    nested within the first one, and are shown on a single thread.
+    """
+    tracks = []
+    if command.get('started') is not None:
+        tracks.append(('commands', [Span(command['command'], 'command',
+            command['started'], command_end(command), None)]))
+    for task in command['tasks']:
+        spans = task_spans(task)
+        if spans:
+            tracks.append(('manager', spans))
+        for session in task['sessions']:
+            tracks.append(('{}:{}'.format(session['hostname'],
+                session['port']), session_spans(session, task['source'])))
+    return tracks
+
+def chrome_trace(commands):
+    """
+    Returns trace of commands in Chrome trace event format (as JSON
+    serializable dict), viewable in chrome://tracing or Perfetto UI.
+    """
+    tracks = [track for command in commands for track in
+        command_tracks(command)]
+    tracks.sort(key=lambda track : track[1][0].start)
+    if not tracks:
+        return {'traceEvents' : [], 'displayTimeUnit' : 'ms'}
+    origin = tracks[0][1][0].start
+
+    def microseconds(time):
+        return round((time - origin) * 1000000)
+
+    events = []
+    processes = {}
+    # Process to heap of (end, thread id) of busy threads, and to heap of
+    # free thread ids. Each track is shown on the lowest free thread.
+    busy = {}
+    free = {}
+    for process, spans in tracks:
+        pid = processes.get(process)
+        if pid is None:
+            pid = processes[process] = len(processes) + 1
+            busy[pid] = []
+            free[pid] = []
+            events.append({'name' : 'process_name', 'ph' : 'M', 'pid' : pid,
+                'args' : {'name' : process}})
+        start, end = spans[0].start, spans[0].end
+        while busy[pid] and busy[pid][0][0] <= start:
+            heapq.heappush(free[pid], heapq.heappop(busy[pid])[1])
+        if free[pid]:
+            tid = heapq.heappop(free[pid])
+        else:
+            tid = len(busy[pid]) + 1
+        heapq.heappush(busy[pid], (end, tid))
+        for span in spans:
+            event = {'name' : span.name, 'cat' : span.category, 'ph' : 'X',
+                'pid' : pid, 'tid' : tid, 'ts' : microseconds(span.start),
+                'dur' : microseconds(span.end) - microseconds(span.start)}
+            if span.args:
+                event['args'] = span.args
+            events.append(event)
+    return {'traceEvents' : events, 'displayTimeUnit' : 'ms'}
+
+def write_chrome_trace(fileobj, database, conn, first=None):
+    """
+    Write trace of commands from command history, starting with the command
+    with rowid first.
+    """
+    commands = (database.get_command(conn, rowid) for rowid in
+        database.command_ids(conn, first))
+    json.dump(chrome_trace(commands), fileobj)
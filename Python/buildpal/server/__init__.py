@@ -1,5 +1,7 @@
 from .runner import ServerRunner
 
+from buildpal.common.openmetrics import parse_address
+
 from time import sleep
 from multiprocessing import cpu_count
 
@@ -16,7 +18,33 @@ def main(opts, terminator=None):
         raise RuntimeError("Max jobs  mark should be in "
             "{{1, 2, ..., {}}}.".format(4 * cpu_count()))
 
-    server_runner = ServerRunner(opts.port, opts.compile_slots)
+    if opts.sandbox_size < 0:
+        raise RuntimeError("Sandbox size must not be negative.")
+
+    if opts.queue_limit is not None and opts.queue_limit < 0:
+        raise RuntimeError("Queue limit must not be negative.")
+
+    def parse_client_values(values, value_type):
+        result = {}
+        for value in values or ():
+            client, sep, client_value = value.rpartition('=')
+            if not sep or not client:
+                raise RuntimeError("Invalid client option '{}', expected "
+                    "<hostname>=<value>.".format(value))
+            result[client] = value_type(client_value)
+            if result[client] <= 0:
+                raise RuntimeError("Client option value must be positive.")
+        return result
+
+    client_weights = parse_client_values(opts.client_weights, float)
+    client_caps = parse_client_values(opts.client_caps, int)
+    if opts.default_client_cap is not None and opts.default_client_cap <= 0:
+        raise RuntimeError("Client cap must be positive.")
+
+    server_runner = ServerRunner(opts.port, opts.compile_slots,
+        opts.sandbox_dir, opts.sandbox_size * 1024 * 1024, opts.queue_limit,
+        client_weights, client_caps, opts.default_client_cap,
+        parse_address(opts.metrics) if opts.metrics else None)
     try:
         server_runner.run(terminator, opts.silent)
     except KeyboardInterrupt:
@@ -0,0 +1,119 @@
+import asyncio
+
+from collections import defaultdict, deque
+from time import time
+
+class ClientStats:
+    def __init__(self):
+        self.running = 0
+        self.queued = 0
+        self.jobs = 0
+        self.total_wait = 0
+        self.max_wait = 0
+
+    def add_wait(self, wait):
+        self.jobs += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def average_wait(self):
+        return self.total_wait / self.jobs if self.jobs else 0
+
+class FairQueue:
+    """
+    Hands out job slots to clients (manager machines) using deficit round
+    robin, so that a client with a lot of queued work cannot starve the
+    others.
+
+    Every job costs one unit. On each visit a client's deficit is increased
+    by its weight, and it gets a slot for each unit it has accumulated.
+    A client may additionally be capped to a maximum number of concurrently
+    running jobs.
+    """
+    def __init__(self, slots, loop, weights=None, caps=None, default_weight=1,
+            default_cap=None):
+        self.slots = slots
+        self.loop = loop
+        self.weights = weights or {}
+        self.caps = caps or {}
+        self.default_weight = default_weight
+        self.default_cap = default_cap
+        self.running = 0
+        self.waiting = defaultdict(deque)
+        self.active = deque()
+        self.deficit = defaultdict(float)
+        self.stats = defaultdict(ClientStats)
+
+    def weight(self, client):
+        return self.weights.get(client, self.default_weight)
+
+    def cap(self, client):
+        return self.caps.get(client, self.default_cap)
+
+    def queued(self):
+        return sum(len(waiters) for waiters in self.waiting.values())
+
+    @asyncio.coroutine
+    def acquire(self, client):
+        """
+        Wait until a job slot is granted to the client.
+        """
+        future = asyncio.Future(loop=self.loop)
+        if not self.waiting[client]:
+            self.active.append(client)
+        self.waiting[client].append(future)
+        self.stats[client].queued += 1
+        start = time()
+        self.__dispatch()
+        try:
+            yield from future
+        except asyncio.CancelledError:
+            if future in self.waiting.get(client, ()):
+                self.__remove_waiter(client, future)
+            elif not future.cancelled():
+                # Slot was granted, but nobody will use it.
+                self.release(client)
+            raise
+        self.stats[client].add_wait(time() - start)
+
+    def release(self, client):
+        self.running -= 1
+        self.stats[client].running -= 1
+        self.__dispatch()
+
+    def __can_run(self, client):
+        cap = self.cap(client)
+        return cap is None or self.stats[client].running < cap
+
+    def __remove_waiter(self, client, future):
+        self.waiting[client].remove(future)
+        self.stats[client].queued -= 1
+        if not self.waiting[client]:
+            del self.waiting[client]
+            self.active.remove(client)
+            self.deficit[client] = 0
+
+    def __select(self):
+        if not any(self.__can_run(client) for client in self.active):
+            return None
+        while True:
+            client = self.active[0]
+            if self.__can_run(client) and self.deficit[client] >= 1:
+                self.deficit[client] -= 1
+                return client
+            # Move on to the next client and give it a new quantum.
+            self.active.rotate(-1)
+            client = self.active[0]
+            if self.__can_run(client):
+                self.deficit[client] += self.weight(client)
+
+    def __dispatch(self):
+        while self.running < self.slots:
+            client = self.__select()
+            if client is None:
+                return
+            future = self.waiting[client][0]
+            self.__remove_waiter(client, future)
+            self.running += 1
+            self.stats[client].running += 1
+            future.set_result(None)
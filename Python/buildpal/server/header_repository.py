@@ -1,11 +1,16 @@
 import os
-import shutil
 import tempfile
 import map_files
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from threading import Lock
 
+from buildpal.common.manifest import iter_manifest
+
+from .sandbox import DiskSandbox
+
+HEADER_SETS_PER_MACHINE = 1024
+
 class HeaderRepository:
     """
     Abstract base class for implementing header file repository.
@@ -13,16 +18,28 @@ class HeaderRepository:
     The purpose of the repository is to store headers, so that each session
     does not have to send its entire world. This class will eventually,
     given enough tasks, create a mirror of the Clients include paths.
+
+    Files which are needed by a single session only are stored in the
+    sandbox (see buildpal.server.sandbox).
     """
-    def __init__(self, scratch_dir):
+    def __init__(self, scratch_dir, sandbox=None):
         self.scratch_dir = scratch_dir
+        self.sandbox = sandbox or DiskSandbox(scratch_dir)
         self.checksums = defaultdict(dict)
         self.locks = defaultdict(Lock)
         self.dir = os.path.join(scratch_dir, 'Headers')
         os.makedirs(self.dir, exist_ok=True)
         self.session_lock = Lock()
         self.session_data = {}
-        self.tempdirs = {}
+        # Manifests of header sets, per machine, in LRU order.
+        self.header_sets = defaultdict(OrderedDict)
+        self.header_sets_lock = Lock()
+        # Header sets sent by id only, which were known and unknown, and
+        # files needed by sessions, which were already there and missing.
+        self.header_set_hits = 0
+        self.header_set_misses = 0
+        self.files_cached = 0
+        self.files_missing = 0
 
         self.global_map = defaultdict(map_files.FileMap)
         self.temp_map = defaultdict(map_files.FileMap)
@@ -31,9 +48,8 @@ class HeaderRepository:
         """
         Create a temporary header, which will be needed for one session only.
         """
-        tmpdir = self.tempdirs[session_id]
-        self._create_virtual_file(tmpdir, self.temp_map[session_id],
-            os.path.join(remote_dir, name), content)
+        self._create_session_file(session_id, os.path.join(remote_dir, name),
+            content)
 
     def create_shared_file(self, machine_id, remote_dir, name, content):
         """
@@ -43,23 +59,53 @@ class HeaderRepository:
         self._create_virtual_file(self.dir, self.global_map[machine_id],
             os.path.join(remote_dir, name), content)
 
-    def missing_files(self, machine_id, session_id, in_list):
+    def header_set_manifest(self, machine_id, header_set):
+        """
+        Given a (header set id, manifest) pair, return the manifest. If
+        manifest is None, the one received earlier for the same header
+        set is returned, or None if the header set is not known.
+        """
+        set_id, manifest = header_set
+        with self.header_sets_lock:
+            header_sets = self.header_sets[machine_id]
+            if manifest is None:
+                manifest = header_sets.get(set_id)
+                if manifest is not None:
+                    header_sets.move_to_end(set_id)
+                    self.header_set_hits += 1
+                else:
+                    self.header_set_misses += 1
+            else:
+                header_sets[set_id] = manifest
+                if len(header_sets) > HEADER_SETS_PER_MACHINE:
+                    header_sets.popitem(last=False)
+        return manifest
+
+    def missing_files(self, machine_id, session_id, header_set):
         """
-        Given a machine identification and a list of header files,
-        return a 2-tuple, list of files which are missing, and a
-        session unique identifier which will be passed to
-        prepare_dir() together with the missing files.
+        Given a machine identification and a header set, return a list of
+        files which are missing. Session unique identifier will be passed
+        to prepare_dir() together with the missing files.
+
+        Returns None if the header set is not known.
         """
+        manifest = self.header_set_manifest(machine_id, header_set)
+        if manifest is None:
+            return None
         needed_files = {}
         out_list = set()
-        for remote_dir, data in in_list:
+        files = 0
+        for remote_dir, data in iter_manifest(manifest):
             for name, checksum in data:
+                files += 1
                 key = (remote_dir, name)
                 if self.checksums[machine_id].get(key) != checksum:
                     needed_files[key] = checksum
                     out_list.add(key)
         with self.session_lock:
             self.session_data[session_id] = needed_files
+            self.files_cached += files - len(out_list)
+            self.files_missing += len(out_list)
         return out_list
 
     def prepare_dir(self, machine_id, session_id, new_files, include_dirs):
@@ -69,9 +115,6 @@ class HeaderRepository:
         with self.session_lock:
             needed_files = self.session_data.pop(session_id)
 
-        checksums = self.checksums[machine_id]
-        sandbox_dir = self.tempdir(session_id)
-
         temp_files = []
         # Update headers.
         for (remote_dir, name), content in new_files.items():
@@ -82,7 +125,7 @@ class HeaderRepository:
             else:
                 temp_files.append((remote_dir, name, content))
                 # If not a part of needed_files, extract it directly to
-                # sandbox_dir and do not store it.
+                # the sandbox and do not store it.
         src_file = self._process_temp_files(session_id, temp_files)
         return include_dirs, src_file
 
@@ -106,22 +149,23 @@ class HeaderRepository:
             with lock:
                 checksums[key] = checksum
 
+    def stats(self):
+        """
+        Returns header set hits and misses, and number of cached and
+        missing files.
+        """
+        return self.header_set_hits, self.header_set_misses, \
+            self.files_cached, self.files_missing
+
     def session_complete(self, session_id):
         self.temp_map.pop(session_id, None)
-        if session_id in self.tempdirs:
-            try:
-                shutil.rmtree(self.tempdirs[session_id])
-            except Exception:
-                pass
-            finally:
-                del self.tempdirs[session_id]
+        self.sandbox.release(session_id)
 
     def get_mappings(self, machine_id, session_id):
         return [self.global_map[machine_id], self.temp_map[session_id]]
 
-    def tempdir(self, session_id):
-        return self.tempdirs.get(session_id) or self.tempdirs.setdefault(
-            session_id, tempfile.mkdtemp(dir=self.scratch_dir))
+    def artifact_dir(self, session_id):
+        return self.sandbox.artifact_dir(session_id)
 
     def _create_virtual_file(self, dir, file_map, virtual_file, content):
         handle, real_file = tempfile.mkstemp(dir=dir)
@@ -129,13 +173,15 @@ class HeaderRepository:
             file.write(content)
         file_map.map_file(virtual_file, real_file)
 
+    def _create_session_file(self, session_id, virtual_file, content):
+        real_file = self.sandbox.create_file(session_id, content)
+        self.temp_map[session_id].map_file(virtual_file, real_file)
+
     def _process_temp_files(self, session_id, temp_files):
         src_file = None
         for remote_dir, name, content in temp_files:
             if not remote_dir:
-                tmpdir = self.tempdirs[session_id]
-                self._create_virtual_file(tmpdir, self.temp_map[session_id],
-                    name, content)
+                self._create_session_file(session_id, name, content)
                 src_file = name
             else:
                 self.create_temp_file(session_id, remote_dir, name, content)
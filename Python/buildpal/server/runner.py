@@ -6,13 +6,19 @@ from io import BytesIO, StringIO
 from multiprocessing import cpu_count
 from struct import pack
 from time import time
-from concurrent.futures import ThreadPoolExecutor
 
 from .header_repository import HeaderRepository
 from .pch_repository import PCHRepository
 from .compiler_repository import CompilerRepository
+from .sandbox import create_sandbox
+from .fair_queue import FairQueue
 
 from buildpal.common.beacon import Beacon
+from buildpal.common.loop_monitor import AdaptiveExecutor, LoopMonitor, \
+    add_loop_metrics
+from buildpal.common.openmetrics import Exposition, Histogram, \
+    MetricsProtocol, add_message_metrics, start_metrics_server
+from buildpal.common.sampling_profiler import SamplingProfiler
 
 import map_files
 
@@ -21,6 +27,7 @@ import os
 import pickle
 import sched
 import shutil
+import threading
 import socket
 import struct
 import subprocess
@@ -57,6 +64,117 @@ class OverrideCreateProcess:
             subprocess._winapi.CreateProcess = self.save
             self.save = None
 
+class ResultUploader:
+    """
+    Streams result files (artifacts) to the manager.
+
+    Every artifact is preceded by an ARTIFACT message holding its name and
+    encoding, followed by data chunks. Artifacts smaller than
+    `compress_threshold` are sent raw, others are zlib compressed.
+
+    Compression starts speculatively as soon as the compiler is done, before
+    the manager confirms that it needs the result. Until confirmation at
+    most `max_pending` messages are produced ahead. Once confirmed,
+    chunks are sent as soon as they are compressed. If the manager does not
+    need the result, compression stops and everything is discarded.
+    """
+    max_pending = 4
+    compress_threshold = 4 * 1024
+
+    def __init__(self, runner, artifacts, send_msg, on_completion):
+        self.runner = runner
+        self.loop = runner.loop
+        self.artifacts = artifacts
+        self.send_msg = send_msg
+        self.on_completion = on_completion
+        self.cond = threading.Condition()
+        self.confirmed = None
+        self.pending = []
+        # Messages handed to the loop which were not sent or dropped yet.
+        self.in_flight = 0
+        self.size = 0
+
+    def start(self):
+        self.runner.async_run(self.__compress).add_done_callback(
+            self.__compress_done)
+
+    def confirm(self, confirmed):
+        with self.cond:
+            self.confirmed = confirmed
+            pending, self.pending = self.pending, []
+            if not confirmed:
+                self.in_flight -= len(pending)
+            self.cond.notify_all()
+        if confirmed:
+            for msg in pending:
+                self.__msg_ready(msg)
+
+    def __artifact_msgs(self, name, filename):
+        if not os.path.exists(filename):
+            yield (b'ARTIFACT', name.encode(), b'missing')
+            return
+        with open(filename, 'rb') as file:
+            if os.path.getsize(filename) < self.compress_threshold:
+                yield (b'ARTIFACT', name.encode(), b'raw')
+                chunks = iter(lambda : file.read(256 * 1024), b'')
+            else:
+                yield (b'ARTIFACT', name.encode(), b'zlib')
+                chunks = compress_file(file)
+            for chunk in chunks:
+                yield (b'\x01', chunk)
+            yield (b'\x00', b'')
+            logging.debug("Prepared '{}', raw {}.".format(filename,
+                file.tell()))
+
+    def __post(self, msg):
+        # Runs in a worker thread. Returns False if the result is not needed.
+        with self.cond:
+            while self.confirmed is None and \
+                    self.in_flight >= self.max_pending:
+                self.cond.wait()
+            if self.confirmed is False:
+                return False
+            self.in_flight += 1
+        self.loop.call_soon_threadsafe(self.__msg_ready, msg)
+        return True
+
+    def __compress(self):
+        # Runs in a worker thread.
+        try:
+            for name, filename in self.artifacts:
+                for msg in self.__artifact_msgs(name, filename):
+                    if not self.__post(msg):
+                        return
+            self.__post(None)
+        finally:
+            for name, filename in self.artifacts:
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+
+    def __compress_done(self, future):
+        if future.exception() is not None:
+            logging.error("Failed to compress {}.".format(self.artifacts),
+                exc_info=future.exception())
+
+    def __msg_ready(self, msg):
+        with self.cond:
+            if self.confirmed is None:
+                self.pending.append(msg)
+                return
+            self.in_flight -= 1
+            self.cond.notify_all()
+        if not self.confirmed:
+            return
+        if msg is None:
+            logging.debug("Sent {}, size {}.".format(self.artifacts,
+                self.size))
+            self.on_completion()
+        else:
+            self.size += len(msg[1])
+            self.send_msg(msg)
+
 class CompileSession(Timer):
     class SessionState:
         can_be_cancelled = False
@@ -81,7 +199,12 @@ class CompileSession(Timer):
             missing_files_timer = SimpleTimer()
             missing_files = \
                 session.runner.header_repository().missing_files(
-                session.task.fqdn, id(session), session.task.filelist)
+                session.task.fqdn, id(session), session.task.header_set)
+            if missing_files is None:
+                # Wait for the task with header set manifest.
+                session.sender.send_msg([session.local_id,
+                    b'UNKNOWN_HEADER_SET'])
+                return
             # Determine if we have this compiler
             session.compiler_required = session.runner.compiler_repository(
                 ).compiler_required(session.compiler_id())
@@ -198,7 +321,7 @@ class CompileSession(Timer):
             assert tag == b'SEND_CONFIRMATION'
             if verdict == b'\x01':
                 session.change_state(CompileSession.StateUploadingFile)
-                session.send_result()
+                session.result_uploader.confirm(True)
             else:
                 session.session_done()
 
@@ -219,7 +342,7 @@ class CompileSession(Timer):
     def __init__(self, runner, send_msg, remote_id):
         super().__init__()
         self.local_id = runner.generate_session_id()
-        self.sender = self.Sender(send_msg, remote_id)
+        self.sender = self.Sender(send_msg, remote_id, runner.load_status)
         self.runner = runner
         self.completed = False
         self.cancel_pending = False
@@ -236,12 +359,15 @@ class CompileSession(Timer):
             pass
 
     class Sender:
-        def __init__(self, send_msg, remote_id):
+        def __init__(self, send_msg, remote_id, load_status):
             self._send_msg = send_msg
             self._remote_id = remote_id
+            self._load_status = load_status
 
         def send_msg(self, data):
-            self._send_msg([self._remote_id] + list(data))
+            # Every reply carries current server load, so that the manager
+            # can adjust its scheduling.
+            self._send_msg([self._remote_id, self._load_status()] + list(data))
 
     @property
     def state(self):
@@ -284,15 +410,29 @@ class CompileSession(Timer):
         from buildpal.manager.compilers.msvc import MSVCCompiler
         compiler_options = MSVCCompiler
 
-        tempdir = self.runner.header_repository().tempdir(id(self))
-        obj_handle, self.object_file = tempfile.mkstemp(
-            dir=tempdir, suffix='.obj')
-        os.close(obj_handle)
-        output = compiler_options.set_object_name_option(self.object_file)
-
-        command = [self.compiler_exe(), output] + self.task.call
+        tempdir = self.runner.header_repository().artifact_dir(id(self))
+        command = [self.compiler_exe()]
         file_overrides = {}
 
+        self.artifacts = []
+        for name, client_file in self.task.artifacts:
+            handle, artifact_file = tempfile.mkstemp(dir=tempdir,
+                suffix=compiler_options.artifact_suffix(name))
+            os.close(handle)
+            if client_file is None:
+                command.append(compiler_options.set_artifact_option(name,
+                    artifact_file))
+            else:
+                # Compiler will refer to this artifact by its client side
+                # name (e.g. PDB name stored in object file). Reserve only
+                # the name, compiler must create the file itself.
+                os.remove(artifact_file)
+                file_overrides[client_file] = artifact_file
+                command.append(compiler_options.set_artifact_option(name,
+                    client_file))
+            self.artifacts.append((name, artifact_file))
+        command.extend(self.task.call)
+
         if self.task.pch_file:
             assert self.pch_file is not None
             assert self.task.pch_header is not None
@@ -341,9 +481,15 @@ class CompileSession(Timer):
             if self.state == self.StateRunningCompiler:
                 if retcode == 0:
                     self.change_state(self.StateWaitForConfirmation)
+                    self.result_uploader = ResultUploader(self.runner,
+                        self.artifacts, self.sender.send_msg,
+                        self.__result_sent)
+                    self.result_uploader.start()
                 durations_dict = dict((n, d) for e, (n, d) in self.time_durations())
+                # Time points let the manager trace the session.
+                time_points = (self.time_point_names(), self.times[:])
                 self.sender.send_msg([b'SERVER_DONE', pickle.dumps(
-                    (retcode, stdout, stderr, durations_dict))])
+                    (retcode, stdout, stderr, durations_dict, time_points))])
                 if retcode == 0:
                     self.reschedule_selfdestruct()
                 else:
@@ -359,6 +505,9 @@ class CompileSession(Timer):
             self.sender.send_msg([b'TIMED_OUT'])
         else:
             self.cancel_selfdestruct()
+        if hasattr(self, 'result_uploader') and \
+                self.state != self.StateUploadingFile:
+            self.result_uploader.confirm(False)
         self.note_time('session completed', 'finishing session')
         self.runner.header_repository().session_complete(id(self))
         self.runner.terminate(self.local_id)
@@ -375,33 +524,9 @@ class CompileSession(Timer):
             self.runner.scheduler().cancel(self.selfdestruct)
             del self.selfdestruct
 
-    def send_result(self):
-        def compress_one(filename):
-            result = []
-            size = 0
-            with open(filename, 'rb') as file:
-                compressed_gen = compress_file(file)
-                for x in compressed_gen:
-                    result.append((b'\x01', x))
-                    size += len(x)
-                result.append((b'\x00', b''))
-                logging.debug("Sending '{}', size {}, raw {}.".format(filename, size, file.tell()))
-            return result
-
-        def compress_result():
-            try:
-                return compress_one(self.object_file)
-            finally:
-                os.remove(self.object_file)
-
-        def send_compressed(future):
-            for buffer in future.result():
-                self.sender.send_msg(buffer)
-            self.note_time('result sent', 'sending result')
-            self.session_done()
-
-        self.runner.async_run(compress_result).add_done_callback(
-            send_compressed)
+    def __result_sent(self):
+        self.note_time('result sent', 'sending result')
+        self.session_done()
 
     def cancel_session(self):
         assert self.state != self.StateCancelled
@@ -443,6 +568,9 @@ class CompileSession(Timer):
         return result
 
 class ServerProtocol(MessageProtocol):
+    # Limit on remotely requested profiles, same as over HTTP.
+    max_profile_seconds = MetricsProtocol.max_profile_seconds
+
     def __init__(self, runner):
         MessageProtocol.__init__(self)
         self.runner = runner
@@ -456,33 +584,62 @@ class ServerProtocol(MessageProtocol):
         session_id, *msg = msg
         if session_id == b'NEW_SESSION':
             remote_id, *msg = msg
+            if self.runner.is_busy():
+                # Do not accept any more sessions, let the manager
+                # reschedule the task elsewhere.
+                self.send_msg([remote_id.tobytes(), self.runner.load_status(),
+                    b'SERVER_BUSY', struct.pack('!I', self.runner.retry_after())])
+                return
             session = CompileSession(self.runner, self.send_msg, remote_id.tobytes())
             self.runner.sessions[session.local_id] = session
         elif session_id == b'RESET':
             self.runner.finish(restart=True)
         elif session_id == b'SHUTDOWN':
             self.runner.finish()
+        elif session_id == b'PROFILE':
+            # Reply with collapsed stacks once done.
+            if len(msg) != 1 or len(msg[0]) != 4:
+                self.send_msg([b'PROFILE_ERROR'])
+                return
+            (seconds,) = struct.unpack('!I', msg[0].memory())
+            seconds = min(seconds, self.max_profile_seconds)
+            def completed(stacks):
+                self.runner.loop.call_soon_threadsafe(self.send_msg,
+                    [b'PROFILE', stacks.encode()])
+            if not self.runner.profiler.start(seconds, completed):
+                self.send_msg([b'PROFILE_BUSY'])
         else:
             session = self.runner.sessions.get(session_id)
         if session:
             session.process_msg(msg)
 
 class ProcessRunner:
-    def __init__(self, limit, loop):
+    def __init__(self, limit, loop, client_weights=None, client_caps=None,
+            default_client_cap=None):
         self.limit = limit
-        self.current = 0
-        self.ready = asyncio.Event(loop=loop)
+        self.queue = FairQueue(limit, loop, client_weights, client_caps,
+            default_cap=default_client_cap)
         self.loop = loop
+        self.compile_time = 0
+        self.compiled = 0
+        self.compile_durations = Histogram()
+
+    @property
+    def current(self):
+        return self.queue.running
+
+    def free_slots(self):
+        return self.limit - self.current
+
+    def average_compile_time(self):
+        return self.compile_time / self.compiled if self.compiled else 0
 
     @asyncio.coroutine
     def subprocess_exec(self, session, args, cwd, file_maps):
-        start = time()
-        while self.current == self.limit:
-            yield from self.ready.wait()
-        self.ready.clear()
-        assert self.current < self.limit
+        client = session.task.fqdn
+        yield from self.queue.acquire(client)
+        session.note_time('compile slot acquired', 'waiting for job slot')
         compile_start = time()
-        self.current += 1
         try:
             with OverrideCreateProcess(file_maps):
                 session.process = yield from asyncio.create_subprocess_exec(*args,
@@ -492,16 +649,33 @@ class ProcessRunner:
             retcode = yield from session.process.wait()
         finally:
             session.process = None
-            self.current -= 1
-            self.ready.set()
+            compile_duration = time() - compile_start
+            self.compile_time += compile_duration
+            self.compile_durations.observe(compile_duration)
+            self.compiled += 1
+            self.queue.release(client)
         return stdout, stderr, retcode
 
 class ServerRunner:
-    def __init__(self, port, compile_slots):
+    min_retry_after = 100 # ms
+
+    def __init__(self, port, compile_slots, sandbox_dir=None, sandbox_size=0,
+            queue_limit=None, client_weights=None, client_caps=None,
+            default_client_cap=None, metrics_address=None):
         self.compile_slots = compile_slots
+        self.client_weights = client_weights
+        self.client_caps = client_caps
+        self.default_client_cap = default_client_cap
         self.port = port
+        self.sandbox_dir = sandbox_dir
+        self.sandbox_size = sandbox_size
+        self.queue_limit = 2 * compile_slots if queue_limit is None else \
+            queue_limit
         self.sessions = {}
         self.reset = False
+        # (host, port) on which metrics are served over HTTP, or None.
+        self.metrics_address = metrics_address
+        self.profiler = SamplingProfiler()
 
         dir = os.path.join(tempfile.gettempdir(), "BuildPal", "Temp")
         os.makedirs(dir, exist_ok=True)
@@ -521,6 +695,31 @@ class ServerRunner:
     def terminate(self, session_id):
         del self.sessions[session_id]
 
+    def queued(self):
+        """
+        Number of sessions waiting for a job slot. Sessions still receiving
+        files, or waiting for the manager, are not counted.
+        """
+        return self.process_runner.queue.queued()
+
+    def load(self):
+        return self.queued(), self.process_runner.free_slots()
+
+    def load_status(self):
+        return struct.pack('!2I', *self.load())
+
+    def is_busy(self):
+        return self.queue_limit > 0 and self.queued() >= self.queue_limit
+
+    def retry_after(self):
+        """
+        Estimate (in ms) when a job slot will be available for a new session.
+        """
+        excess = self.queued() - self.queue_limit + 1
+        estimate = 1000 * excess * self.process_runner.average_compile_time() / \
+            self.compile_slots
+        return max(int(estimate), self.min_retry_after)
+
     def async_run(self, callable, *args):
         return asyncio.async(self.loop.run_in_executor(self.misc_thread_pool(),
             callable, *args), loop=self.loop)
@@ -538,11 +737,84 @@ class ServerRunner:
         asyncio.async(self.process_runner.subprocess_exec(session, args, cwd, file_maps),
             loop=self.loop).add_done_callback(done_callback)
 
+    def print_client_stats(self):
+        print()
+        print("Client statistics:")
+        for client, stats in sorted(self.process_runner.queue.stats.items()):
+            print("{:30} - Running {:<3} Queued {:<3} Compiled {:<5} "
+                "Avg. Wait {:<6.2f} Max. Wait {:<6.2f}".format(client,
+                stats.running, stats.queued, stats.jobs,
+                stats.average_wait(), stats.max_wait))
+
+    def collect_metrics(self):
+        exposition = Exposition()
+        exposition.gauge('job_slots', 'Number of job slots.',
+            self.compile_slots)
+        exposition.gauge('sessions', 'Current sessions.', len(self.sessions))
+        exposition.gauge('sessions_queued',
+            'Sessions waiting for a job slot.', self.queued())
+        exposition.counter('compiled_total', 'Compiler runs.',
+            self.process_runner.compiled)
+        exposition.histogram('compile_duration_seconds',
+            'Duration of compiler runs.', [(None,
+            self.process_runner.compile_durations)])
+
+        clients = sorted(self.process_runner.queue.stats.items())
+        exposition.add('client_jobs_total', 'counter',
+            'Compiler runs per client.', (({'client' : client}, stats.jobs)
+            for client, stats in clients))
+        exposition.add('client_running', 'gauge',
+            'Compiler runs in progress per client.', (({'client' : client},
+            stats.running) for client, stats in clients))
+        exposition.add('client_queued', 'gauge',
+            'Compiler runs waiting for a job slot per client.', (({'client' :
+            client}, stats.queued) for client, stats in clients))
+        exposition.add('client_wait_seconds_total', 'counter',
+            'Time compiler runs waited for a job slot per client.',
+            (({'client' : client}, stats.total_wait) for client, stats in
+            clients))
+
+        header_set_hits, header_set_misses, files_cached, files_missing = \
+            self.header_repository().stats()
+        exposition.counter('header_set_hits_total',
+            'Header sets sent by id which were known.', header_set_hits)
+        exposition.counter('header_set_misses_total',
+            'Header sets sent by id which were not known.', header_set_misses)
+        exposition.counter('header_files_cached_total',
+            'Headers needed by sessions which were already present.',
+            files_cached)
+        exposition.counter('header_files_missing_total',
+            'Headers needed by sessions which had to be downloaded.',
+            files_missing)
+        total = files_cached + files_missing
+        exposition.gauge('header_files_hit_ratio',
+            'Ratio of needed headers which were already present.',
+            files_cached / total if total else 0)
+        exposition.add('sandbox', 'gauge', 'Sandbox statistics.',
+            (({'stat' : name}, value) for name, value in sorted(
+            self._sandbox.stats().items())))
+
+        add_message_metrics(exposition, MessageProtocol.stats)
+        add_loop_metrics(exposition, self.loop_monitor)
+        return exposition
+
     def run_event_loop(self, silent):
+        client_stats_interval = 10
+        last_client_stats = [time(), 0]
+
         @asyncio.coroutine
         def print_stats():
             if not silent:
-                sys.stdout.write("Currently running {} tasks.\r".format(len(self.sessions)))
+                sys.stdout.write("Currently running {} tasks, {} queued.\r".format(
+                    len(self.sessions), self.queued()))
+                # Per-client statistics are printed only occasionally, and
+                # only if something changed in the meantime.
+                current_time = time()
+                compiled = self.process_runner.compiled
+                if current_time - last_client_stats[0] > client_stats_interval \
+                        and compiled != last_client_stats[1]:
+                    self.print_client_stats()
+                    last_client_stats[:] = current_time, compiled
             self._scheduler.run(False)
             yield from asyncio.sleep(1, loop=self.loop)
             asyncio.async(print_stats(), loop=self.loop)
@@ -561,11 +833,21 @@ class ServerRunner:
         while True:
             self.keep_running = False
             self.loop = asyncio.ProactorEventLoop()
-            self.process_runner = ProcessRunner(self.compile_slots, self.loop)
+            self.process_runner = ProcessRunner(self.compile_slots, self.loop,
+                self.client_weights, self.client_caps, self.default_client_cap)
 
             # Data shared between sessions.
-            self._misc_thread_pool = ThreadPoolExecutor(max_workers=2 * cpu_count())
-            self._header_repository = HeaderRepository(self.scratch_dir)
+            self._misc_thread_pool = AdaptiveExecutor('Misc thread pool',
+                cpu_count(), 4 * cpu_count())
+            self.profiler.add_executor(self._misc_thread_pool.name,
+                self._misc_thread_pool)
+            self.loop_monitor = LoopMonitor(self.loop,
+                executors=[self._misc_thread_pool])
+            self.loop.call_soon(self.loop_monitor.start)
+            self._sandbox = create_sandbox(self.scratch_dir, self.sandbox_dir,
+                self.sandbox_size)
+            self._header_repository = HeaderRepository(self.scratch_dir,
+                self._sandbox)
             self._pch_repository = PCHRepository(self.scratch_dir)
             self._compiler_repository = CompilerRepository()
             self._scheduler = sched.scheduler()
@@ -574,12 +856,23 @@ class ServerRunner:
             if self.port == 0:
                 self.port = self.server.sockets[0].getsockname()[1]
 
-            beacon = Beacon(self.compile_slots, self.port)
+            beacon = Beacon(self.compile_slots, self.port, self.load)
             beacon.start()
 
+            metrics_server = None
+            if self.metrics_address is not None:
+                metrics_server = start_metrics_server(self.loop,
+                    self.metrics_address, self.collect_metrics, self.profiler)
+
             if not silent:
                 print("Running server on 'localhost:{}'.".format(self.port))
                 print("Using {} job slots.".format(self.compile_slots))
+                if self.queue_limit > 0:
+                    print("Accepting at most {} queued sessions.".format(
+                        self.queue_limit))
+                if self.sandbox_dir and self.sandbox_size:
+                    print("Using {} bytes of memory sandbox in '{}'.".format(
+                        self.sandbox_size, self.sandbox_dir))
 
             try:
                 def stop():
@@ -589,9 +882,13 @@ class ServerRunner:
                 self.run_event_loop(silent)
             finally:
                 beacon.stop()
+                self.loop_monitor.stop()
                 self.server.close()
+                if metrics_server is not None:
+                    metrics_server.close()
                 self.loop.stop()
                 self.loop.close()
                 self.misc_thread_pool().shutdown()
+                self._sandbox.close()
                 if not self.keep_running:
                     break
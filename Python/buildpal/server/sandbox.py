@@ -0,0 +1,140 @@
+import os
+import shutil
+import tempfile
+
+from threading import Lock
+
+class DiskSandbox:
+    """
+    Default sandbox backend.
+
+    Each session gets its own temporary directory inside the scratch
+    directory. Session-local files (source file, non-shared headers and
+    the resulting artifacts) are created there and removed once the
+    session completes.
+    """
+    def __init__(self, scratch_dir):
+        self.scratch_dir = scratch_dir
+        self.lock = Lock()
+        self.dirs = {}
+
+    def session_dir(self, session_id):
+        with self.lock:
+            dir = self.dirs.get(session_id)
+            if dir is None:
+                dir = self.dirs[session_id] = tempfile.mkdtemp(
+                    dir=self.scratch_dir)
+            return dir
+
+    def artifact_dir(self, session_id):
+        """
+        Directory in which the compiler creates the session's artifacts.
+        """
+        return self.session_dir(session_id)
+
+    def create_file(self, session_id, content):
+        """
+        Store content in a new file owned by the session. Returns the name
+        of the created file.
+        """
+        handle, real_file = tempfile.mkstemp(dir=self.session_dir(session_id))
+        with os.fdopen(handle, 'wb') as file:
+            file.write(content)
+        return real_file
+
+    def release(self, session_id):
+        with self.lock:
+            dir = self.dirs.pop(session_id, None)
+        if dir is not None:
+            shutil.rmtree(dir, ignore_errors=True)
+
+    def stats(self):
+        return {'sessions' : len(self.dirs)}
+
+    def close(self):
+        pass
+
+class MemorySandbox:
+    """
+    Sandbox backend which keeps session files on a memory backed directory,
+    i.e. a RAM disk on Windows or tmpfs (e.g. /dev/shm) on Linux.
+
+    At most `budget` bytes of file content is stored in memory at once.
+    Files which do not fit, as well as sessions created while the budget is
+    exhausted, go to the fallback (disk) sandbox. Artifacts are written by
+    the compiler, their size is not known up front, so they always go to
+    the fallback sandbox.
+    """
+    def __init__(self, memory_dir, budget, fallback):
+        os.makedirs(memory_dir, exist_ok=True)
+        self.memory_dir = tempfile.mkdtemp(dir=memory_dir)
+        self.budget = budget
+        self.fallback = fallback
+        self.lock = Lock()
+        self.dirs = {}
+        self.session_bytes = {}
+        self.used = 0
+        self.files_in_memory = 0
+        self.files_on_disk = 0
+
+    def session_dir(self, session_id):
+        with self.lock:
+            dir = self.dirs.get(session_id)
+            if dir is not None:
+                return dir
+            if self.used < self.budget:
+                dir = self.dirs[session_id] = tempfile.mkdtemp(
+                    dir=self.memory_dir)
+                self.session_bytes[session_id] = 0
+                return dir
+        return self.fallback.session_dir(session_id)
+
+    def artifact_dir(self, session_id):
+        return self.fallback.artifact_dir(session_id)
+
+    def create_file(self, session_id, content):
+        dir = self.session_dir(session_id)
+        with self.lock:
+            in_memory = session_id in self.dirs and \
+                self.used + len(content) <= self.budget
+            if in_memory:
+                self.used += len(content)
+                self.session_bytes[session_id] += len(content)
+                self.files_in_memory += 1
+            else:
+                self.files_on_disk += 1
+        if not in_memory:
+            return self.fallback.create_file(session_id, content)
+        handle, real_file = tempfile.mkstemp(dir=dir)
+        with os.fdopen(handle, 'wb') as file:
+            file.write(content)
+        return real_file
+
+    def release(self, session_id):
+        with self.lock:
+            dir = self.dirs.pop(session_id, None)
+            self.used -= self.session_bytes.pop(session_id, 0)
+        if dir is not None:
+            shutil.rmtree(dir, ignore_errors=True)
+        self.fallback.release(session_id)
+
+    def stats(self):
+        return {
+            'sessions' : len(self.dirs),
+            'used' : self.used,
+            'budget' : self.budget,
+            'files_in_memory' : self.files_in_memory,
+            'files_on_disk' : self.files_on_disk}
+
+    def close(self):
+        shutil.rmtree(self.memory_dir, ignore_errors=True)
+
+def create_sandbox(scratch_dir, memory_dir=None, memory_budget=0):
+    """
+    Create sandbox backend. If memory_dir is given, session files are kept
+    there as long as they fit within memory_budget bytes.
+    """
+    disk_sandbox = DiskSandbox(scratch_dir)
+    if memory_dir is None or memory_budget <= 0:
+        return disk_sandbox
+    return MemorySandbox(memory_dir, memory_budget, disk_sandbox)
@@ -1,6 +1,6 @@
 import pytest
 
-from buildpal.manager.compilers.msvc import MSVCCompiler
+from buildpal.manager.compilers.msvc import MSVCCompiler, MSVCSeparatePDBCompiler
 
 @pytest.mark.parametrize(("option"), (
     'AI', 'bigobj',
@@ -104,3 +104,21 @@ def test_link_opts(input, expected):
     options = MSVCCompiler.parse_options(input)
     assert list(options.link_options()) == expected
 
+def test_debug_info_artifacts():
+    options = MSVCCompiler.parse_options(['/c', '/Zi', 'a.cpp'])
+    call = options.create_server_call()
+    assert '/Z7' in call and '/Zi' not in call
+    [(source, _, targets)] = options.files()
+    assert source == 'a.cpp'
+    assert targets['artifacts'] == [('object', 'a.obj')]
+
+    options = MSVCSeparatePDBCompiler.parse_options(['/c', '/Zi', 'a.cpp'])
+    call = options.create_server_call()
+    assert '/Zi' in call and '/Z7' not in call
+    [(source, _, targets)] = options.files()
+    assert targets['artifacts'] == [('object', 'a.obj'), ('pdb', 'a.pdb')]
+
+    # Without /Zi there is no PDB to return.
+    options = MSVCSeparatePDBCompiler.parse_options(['/c', '/Z7', 'a.cpp'])
+    [(source, _, targets)] = options.files()
+    assert targets['artifacts'] == [('object', 'a.obj')]
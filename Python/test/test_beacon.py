@@ -1,7 +1,7 @@
 import pytest
 import socket
 
-from buildpal.common.beacon import Beacon, get_nodes_from_beacons
+from buildpal.common.beacon import Beacon, get_nodes_from_beacons, _parse_response
 
 MULTICAST_PORT = 53334
 
@@ -29,4 +29,17 @@ def test_beacon(run_beacon):
     assert nodes[0]['address'] in (x[4][0] for x in socket.getaddrinfo(
         family=socket.AF_INET, host='', port=0))
 
-
+def test_beacon_load():
+    load = [3, 1]
+    beacon = Beacon(4, 31313, lambda : load)
+    node = _parse_response(beacon.get_response(), '127.0.0.1')
+    assert node['job_slots'] == 4
+    assert node['port'] == 31313
+    assert node['queued'] == 3
+    assert node['free_slots'] == 1
+    load[:] = [0, 4]
+    node = _parse_response(beacon.get_response(), '127.0.0.1')
+    assert node['queued'] == 0
+    assert node['free_slots'] == 4
+    assert 'queued' not in _parse_response(Beacon(4, 31313).get_response(),
+        '127.0.0.1')
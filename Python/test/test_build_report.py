@@ -0,0 +1,90 @@
+from array import array
+
+from buildpal.manager.build_report import BuildTracker, analyze_build, \
+    format_report, utilization
+from buildpal.manager.compile_session import SessionResult
+
+def make_command(name, started, compile_time=4, hostname='server'):
+    # Task: 1s preprocessing, session: 1s upload, compile, 1s download.
+    session = {
+        'hostname': hostname,
+        'port': '1234',
+        'started': started + 1,
+        'responded': started + 1,
+        'result_received': started + 3 + compile_time,
+        'completed': started + 3 + compile_time,
+        'result': SessionResult.success,
+        'server_times': (('received task', 'received missing headers',
+            'compile slot acquired', 'compilation done'), array('d', [
+            started + 1, started + 2, started + 2, started + 2 +
+            compile_time]))}
+    return {
+        'command': name,
+        'started': started,
+        'completed': started + 3 + compile_time,
+        'tasks': [{
+            'source': name + '.cpp',
+            'sessions': [session],
+            'times': (('queued for preprocessing', 'preprocessed',
+                'assigned to a server session', 'completed notification',
+                'session successful'), array('d', [started, started + 1,
+                started + 1, started + 3 + compile_time, started + 3 +
+                compile_time]))}]}
+
+def test_analyze_build():
+    # b and c run in parallel after a, d runs after a gap on the client
+    # (e.g. linking).
+    commands = [make_command('a', 0), make_command('b', 7, 2),
+        make_command('c', 7, 6, hostname='other'), make_command('d', 20)]
+    report = analyze_build(commands, buckets=3)
+    assert (report.started, report.completed, report.duration) == (0, 27, 27)
+    assert (report.commands, report.tasks) == (4, 4)
+    assert [(name, start, end) for name, start, end, segments in
+        report.critical_path] == [('a', 0, 7), ('c', 7, 16),
+        ('client', 16, 20), ('d', 20, 27)]
+    assert dict(report.attribution) == {'compile': 14, 'preprocess': 3,
+        'network': 6, 'client': 4}
+    assert sum(seconds for category, seconds in report.attribution) == \
+        report.duration
+    assert report.bucket_length == 9
+    assert report.utilization['server:1234'] == (10 / 27, 1,
+        [4 / 9, 2 / 9, 4 / 9])
+    assert report.utilization['other:1234'] == (6 / 27, 1, [0, 6 / 9, 0])
+    assert [(source, duration) for source, duration, categories in
+        report.slowest_tasks[:2]] == [('c.cpp', 9), ('a.cpp', 7)]
+    assert report.slowest_tasks[0][2] == (('compile', 6), ('network', 2),
+        ('preprocess', 1))
+    assert format_report(report)[0] == \
+        "Build took 27.00s, 4 commands, 4 tasks"
+    assert analyze_build([]) is None
+
+def test_late_sessions():
+    # Client got the result of a at 7, its command completed only when a
+    # session racing for its task did.
+    late = make_command('a', 0)
+    late['replied'] = late['completed']
+    late['completed'] = 30
+    report = analyze_build([late, make_command('b', 8)])
+    assert (report.started, report.completed) == (0, 15)
+    assert [(name, start, end) for name, start, end, segments in
+        report.critical_path] == [('a', 0, 7), ('client', 7, 8),
+        ('b', 8, 15)]
+
+def test_utilization_peak():
+    result, bucket_length = utilization({'node': [(0, 2), (1, 3), (2, 4)]},
+        0, 4, 2)
+    assert bucket_length == 2
+    assert result['node'] == (1.5, 2, [1.5, 1.5])
+
+def test_build_tracker():
+    tracker = BuildTracker(idle_time=5)
+    tracker.client_connected()
+    tracker.command_completed({'command': 'a'})
+    now = tracker.last_activity + 10
+    # Client still connected.
+    assert tracker.build_completed(now) is None
+    tracker.client_disconnected()
+    assert tracker.build_completed(tracker.last_activity + 1) is None
+    assert tracker.build_completed(tracker.last_activity + 5) == [
+        {'command': 'a'}]
+    assert tracker.build_completed(tracker.last_activity + 10) is None
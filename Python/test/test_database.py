@@ -1,6 +1,10 @@
+import sqlite3
+
+from array import array
+from threading import Event
 from time import time
 
-from buildpal.manager.database import Database
+from buildpal.manager.database import Database, DatabaseInserter
 from buildpal.manager.compile_session import SessionResult
 
 def test_create_structure():
@@ -23,11 +27,8 @@ def test_insert_and_select():
         'completed': time() + 10,
         'result': SessionResult.success}
 
-    times = [
-            {'time_point_name' : 'time_point1', 'time_point_ord': 1, 'time_point': time()},
-            {'time_point_name' : 'time_point2', 'time_point_ord': 2, 'time_point': time()},
-            {'time_point_name' : 'time_point3', 'time_point_ord': 3, 'time_point': time()},
-            {'time_point_name' : 'time_point4', 'time_point_ord': 4, 'time_point': time()}]
+    times = (('time_point1', 'time_point2', 'time_point3', 'time_point4'),
+        array('d', [time(), time(), time(), time()]))
 
     task = {
         'source': 'asdf.cpp',
@@ -52,3 +53,187 @@ def test_insert_and_select():
         assert db.get_command(conn, id) == command
 
 
+
+def make_command(index, tasks=3):
+    return {
+        'command': 'compile {}'.format(index),
+        'tasks': [{
+            'source': 'source{}.cpp'.format(task),
+            'sessions': [{
+                'hostname': 'localhost',
+                'port': '12345',
+                'started': 1.0,
+                'completed': 2.0,
+                'result': SessionResult.success}],
+            'times': (('time_point0', 'time_point1', 'time_point2',
+                'time_point3'), array('d', range(4)))} for task in range(
+                tasks)]}
+
+def test_insert_commands():
+    db = Database()
+    conn = db.get_connection()
+    db.create_structure(conn)
+    with conn:
+        first = db.insert_command(conn, make_command(0))
+        commands = [make_command(index) for index in range(1, 4)]
+        ids, rows = db.insert_commands(conn, commands)
+        assert first not in ids
+        assert len(set(ids)) == 3
+        # Command, and per task: task and session. Timeline was already
+        # inserted with the first command.
+        assert rows == 3 * (1 + 3 * 2)
+        for id, command in zip(ids, commands):
+            assert db.get_command(conn, id) == command
+        assert db.get_command(conn, first) == make_command(0)
+
+def test_database_inserter(tmpdir):
+    db = Database(str(tmpdir.join('test.db')))
+    with db.get_connection() as conn:
+        db.create_structure(conn)
+    commands = [make_command(index) for index in range(100)]
+    completed = []
+    ui_updates = []
+    with DatabaseInserter(db, lambda *args : ui_updates.append(args),
+            batch_size=8, commit_rows=50) as inserter:
+        for command in commands:
+            inserter.async_insert(command, completed.append)
+    assert len(completed) == len(commands)
+    assert ui_updates
+    with db.get_connection() as conn:
+        for id, command in zip(completed, commands):
+            assert db.get_command(conn, id) == command
+
+def test_database_inserter_failure(tmpdir):
+    db = Database(str(tmpdir.join('test.db')))
+    with db.get_connection() as conn:
+        db.create_structure(conn)
+    # Missing non-nullable session hostname, with the same time points
+    # as the other commands.
+    bad = make_command(0)
+    bad['tasks'][0]['sessions'][0]['hostname'] = None
+    commands = [make_command(index) for index in range(20)]
+    completed = []
+    # Hold the first insert until everything is queued, so that the bad
+    # command is in the middle of a batch, after an uncommitted one.
+    queued = Event()
+    insert_commands = db.insert_commands
+    def wait_for_queue(conn, commands):
+        queued.wait()
+        return insert_commands(conn, commands)
+    db.insert_commands = wait_for_queue
+    with DatabaseInserter(db, lambda *args : None, batch_size=8,
+            commit_interval=60) as inserter:
+        for command in commands[:10] + [bad] + commands[10:]:
+            inserter.async_insert(command, completed.append)
+        queued.set()
+    assert inserter.failed == 1
+    assert len(completed) == len(commands)
+    with db.get_connection() as conn:
+        for id, command in zip(completed, commands):
+            assert db.get_command(conn, id) == command
+
+def test_database_inserter_full(tmpdir):
+    db = Database(str(tmpdir.join('test.db')))
+    with db.get_connection() as conn:
+        db.create_structure(conn)
+    started = Event()
+    release = Event()
+    def block(command_id):
+        started.set()
+        release.wait()
+    with DatabaseInserter(db, lambda *args : None, commit_rows=1,
+            max_queued=1) as inserter:
+        inserter.async_insert(make_command(0), block)
+        assert started.wait(5)
+        inserter.async_insert(make_command(1))
+        # Does not block while the writer is busy.
+        inserter.async_insert(make_command(2))
+        assert inserter.dropped == 1
+        release.set()
+
+def test_persistent_database(tmpdir):
+    db_file = str(tmpdir.join('history.db'))
+    db = Database(db_file, persistent=True)
+    conn = db.get_connection()
+    db.create_structure(conn)
+    with conn:
+        id = db.insert_command(conn, make_command(0))
+    assert conn.execute("PRAGMA journal_mode").fetchone() == ('wal',)
+    indexes = set(name for name, in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index'"))
+    assert {'task_command_id', 'session_task_id'} <= indexes
+    conn.close()
+
+    # Kept while schema version matches.
+    db = Database(db_file, persistent=True)
+    with db.get_connection() as conn:
+        db.create_structure(conn)
+        assert db.get_command(conn, id) == make_command(0)
+        conn.execute("PRAGMA user_version=0")
+
+    db = Database(db_file, persistent=True)
+    with db.get_connection() as conn:
+        db.create_structure(conn)
+        assert db.get_command(conn, id) is None
+
+def test_retention():
+    db = Database()
+    conn = db.get_connection()
+    db.create_structure(conn)
+    commands = [make_command(index) for index in range(10)]
+    for index, command in enumerate(commands):
+        command['completed'] = 1000.0 + index
+    with conn:
+        ids, rows = db.insert_commands(conn, commands)
+        assert db.apply_retention(conn) == 0
+        assert db.apply_retention(conn, max_age=5, now=1007) == 2
+        assert db.apply_retention(conn, max_commands=5) == 3
+        assert [db.get_command(conn, id) for id in ids[5:]] == commands[5:]
+        assert all(db.get_command(conn, id) is None for id in ids[:5])
+        for table in ('task', 'session'):
+            count, = conn.execute("SELECT count(*) FROM {}".format(
+                table)).fetchone()
+            assert count == 5 * len(commands[0]['tasks'])
+
+def test_aggregates():
+    db = Database()
+    conn = db.get_connection()
+    db.create_structure(conn)
+    commands = [make_command(index) for index in range(4)]
+    for index, command in enumerate(commands):
+        command['completed'] = 10.0 * index
+        for task in command['tasks']:
+            task['times'][1][-1] = 3.0 + index
+    commands[1]['tasks'][0]['sessions'][0]['result'] = SessionResult.failure
+    commands[1]['tasks'][0]['sessions'][0]['hostname'] = 'other'
+    with conn:
+        db.insert_commands(conn, commands)
+        durations = db.source_durations(conn)
+        assert durations['source0.cpp'] == (4, 4.0, 6.0, 6.0)
+        assert db.source_durations(conn, since=15)['source1.cpp'] == \
+            (2, 5.0, 6.0, 6.0)
+        throughput = db.node_throughput(conn)
+        assert throughput['other', '12345'] == (1, 0, 1.0, 0)
+        assert throughput['localhost', '12345'] == (11, 11, 11.0, 11.0)
+
+def test_command_paging():
+    db = Database()
+    conn = db.get_connection()
+    db.create_structure(conn)
+    assert db.command_range(conn) == (None, None)
+    with conn:
+        ids, rows = db.insert_commands(conn, [make_command(index, tasks=0)
+            for index in range(10)])
+        # Leave a gap, as retention would.
+        conn.execute("DELETE FROM command WHERE rowid IN (?, ?)", ids[4:6])
+    ids = ids[:4] + ids[6:]
+    assert db.command_range(conn) == (ids[0], ids[-1])
+    assert db.get_commands(conn, ids[2], 3) == [(id, 'compile {}'.format(
+        index)) for id, index in zip(ids[2:5], (2, 3, 6))]
+    assert db.command_offset(conn, ids[0], 0) == ids[0]
+    assert db.command_offset(conn, ids[3], 1) == ids[4]
+    assert db.command_offset(conn, ids[3] + 1, 0) == ids[4]
+    assert db.command_offset(conn, ids[3] + 1, -1) == ids[3]
+    assert db.command_offset(conn, ids[-1], -3) == ids[-4]
+    assert db.command_offset(conn, ids[2], 100) == ids[-1]
+    assert db.command_offset(conn, ids[2], -100) == ids[0]
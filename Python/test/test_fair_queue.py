@@ -0,0 +1,81 @@
+import asyncio
+
+from buildpal.server.fair_queue import FairQueue
+
+JOB_DURATION = 0.01
+
+def run_clients(queue, loop, jobs):
+    """
+    Run synthetic clients. jobs is a list of (client, job count, delay)
+    tuples. Returns list of (client, job index) in order of execution.
+    """
+    order = []
+    running = []
+
+    @asyncio.coroutine
+    def job(client, index):
+        yield from queue.acquire(client)
+        try:
+            order.append((client, index))
+            running.append(client)
+            assert len(running) <= queue.slots
+            cap = queue.cap(client)
+            assert cap is None or running.count(client) <= cap
+            yield from asyncio.sleep(JOB_DURATION, loop=loop)
+        finally:
+            running.remove(client)
+            queue.release(client)
+
+    @asyncio.coroutine
+    def client_jobs(client, count, delay):
+        yield from asyncio.sleep(delay, loop=loop)
+        yield from asyncio.gather(*[job(client, index) for index in
+            range(count)], loop=loop)
+
+    loop.run_until_complete(asyncio.gather(*[client_jobs(*x) for x in jobs],
+        loop=loop))
+    return order
+
+def test_latency_isolation():
+    loop = asyncio.new_event_loop()
+    try:
+        queue = FairQueue(2, loop)
+        # 'big' does a full rebuild, 'small' arrives a bit later with an
+        # incremental build.
+        run_clients(queue, loop, [('big', 40, 0), ('small', 4, JOB_DURATION)])
+    finally:
+        loop.close()
+    big = queue.stats['big']
+    small = queue.stats['small']
+    assert big.jobs == 40
+    assert small.jobs == 4
+    assert queue.running == 0
+    assert queue.queued() == 0
+    # With first-come first-served 'small' would wait for the entire
+    # rebuild (~20 job durations). Here it has to wait only for the slots
+    # it shares with 'big'.
+    assert small.max_wait < 6 * JOB_DURATION
+    assert small.max_wait < big.max_wait / 2
+
+def test_weights():
+    loop = asyncio.new_event_loop()
+    try:
+        queue = FairQueue(1, loop, weights={'a' : 3})
+        order = run_clients(queue, loop, [('a', 12, 0), ('b', 12, 0)])
+    finally:
+        loop.close()
+    # While both clients have work, 'a' gets three times as many slots.
+    first = [client for client, index in order[:16]]
+    assert first.count('a') == 12
+    assert first.count('b') == 4
+
+def test_cap():
+    loop = asyncio.new_event_loop()
+    try:
+        queue = FairQueue(4, loop, caps={'a' : 1})
+        order = run_clients(queue, loop, [('a', 3, 0), ('b', 6, 0)])
+    finally:
+        loop.close()
+    assert len(order) == 9
+    assert queue.stats['a'].jobs == 3
+    assert queue.stats['b'].jobs == 6
@@ -0,0 +1,43 @@
+import gc
+
+from buildpal.common.manifest import create_manifest
+from buildpal.manager.header_sets import HeaderSetRegistry
+
+class ContentEntry:
+    def __init__(self, checksum):
+        self.value = checksum
+
+    def checksum(self):
+        return self.value
+
+def scan_result(source_dir, shared):
+    header_info = [('include', tuple((name, False, ContentEntry(checksum))
+        for name, checksum in shared)),
+        (source_dir, (('local.h', True, ContentEntry(0)),))]
+    manifest = create_manifest([('include', shared)])
+    return header_info, manifest
+
+def test_interning():
+    registry = HeaderSetRegistry()
+    first, first_local = registry.intern(*scan_result('a',
+        [('x.h', 1), ('y.h', 2)]))
+    second, second_local = registry.intern(*scan_result('b',
+        [('x.h', 1), ('y.h', 2)]))
+    assert first is second
+    assert [name for name, content_entry in first.headers[0][1]] == \
+        ['x.h', 'y.h']
+    assert first_local[0][0] == 'a'
+    assert second_local[0][0] == 'b'
+    assert [name for name, content_entry in first_local[0][1]] == ['local.h']
+
+    # Different content means a different header set.
+    third, third_local = registry.intern(*scan_result('a',
+        [('x.h', 1), ('y.h', 3)]))
+    assert third is not first
+    assert third.id != first.id
+    assert registry.stats() == (2, 1, 2)
+
+    # Sets are released together with the last task using them.
+    del first, second, third
+    gc.collect()
+    assert registry.stats()[0] == 0
@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+from threading import Event
+
+from buildpal.common.loop_monitor import AdaptiveExecutor, LoopMonitor, \
+    add_loop_metrics
+from buildpal.common.openmetrics import Exposition
+
+def fail():
+    raise ValueError('failed')
+
+def test_adaptive_executor():
+    executor = AdaptiveExecutor('Pool', 1, 3, target_wait=0.01)
+    stop = Event()
+    try:
+        assert executor.submit(pow, 2, 10).result(5) == 1024
+        try:
+            executor.submit(fail).result(5)
+        except ValueError:
+            pass
+        else:
+            assert False
+
+        # Single worker is busy, others queue up.
+        blocked = [executor.submit(stop.wait) for x in range(3)]
+        time.sleep(0.05)
+        assert executor.running == 1
+        assert executor.queued() == 2
+        # Queued calls waited longer than target_wait.
+        assert executor.adjust() == 2
+        assert executor.running == 2
+        assert executor.queued() == 1
+        assert executor.adjust() == 3
+        assert executor.adjust() == 3
+        assert executor.queued() == 0
+        stop.set()
+        assert all(future.result(5) for future in blocked)
+        assert executor.completed == 5
+        assert executor.wait_durations.count == 5
+        # Pool was fully busy until the calls completed.
+        assert executor.adjust() == 3
+        assert executor.adjust() == 2
+        assert executor.adjust() == 1
+        assert executor.adjust() == 1
+    finally:
+        stop.set()
+        executor.shutdown()
+    try:
+        executor.submit(pow, 2, 10)
+    except RuntimeError:
+        pass
+    else:
+        assert False
+
+def test_shutdown_waits_for_queue():
+    executor = AdaptiveExecutor('Pool', 1, 1)
+    futures = [executor.submit(time.sleep, 0.01) for x in range(5)]
+    executor.shutdown()
+    assert all(future.done() for future in futures)
+
+def block_loop(seconds):
+    time.sleep(seconds)
+
+def test_loop_monitor():
+    loop = asyncio.new_event_loop()
+    executor = AdaptiveExecutor('Pool', 1, 2)
+    monitor = LoopMonitor(loop, interval=0.01, slow_threshold=0.1,
+        executors=[executor], adjust_interval=0.01)
+    try:
+        loop.call_soon(monitor.start)
+        loop.call_later(0.05, block_loop, 0.4)
+        loop.run_until_complete(asyncio.sleep(0.6, loop=loop))
+    finally:
+        monitor.stop()
+        loop.close()
+        executor.shutdown()
+    assert monitor.lag.count > 5
+    assert monitor.max_lag >= 0.3
+    assert monitor.slow_callbacks == 1
+    stall_time, stack = monitor.stalls[0]
+    assert 'block_loop' in stack
+
+    exposition = Exposition()
+    add_loop_metrics(exposition, monitor)
+    text = exposition.text()
+    assert 'loop_stalls_total 1' in text
+    assert 'executor_workers{executor="Pool"} 1' in text
@@ -0,0 +1,10 @@
+from buildpal.common.manifest import create_manifest, iter_manifest
+
+def test_manifest():
+    files = [('C:\\include', [('a.h', 1), ('sub\\b.h', 2 ** 64 - 1)]),
+        ('C:\\Program Files\\include', [('\u010d.h', 0)]),
+        ('D:\\empty', [])]
+    manifest = create_manifest(files)
+    assert isinstance(manifest, bytes)
+    assert list(iter_manifest(manifest)) == files
+    assert list(iter_manifest(create_manifest([]))) == []
@@ -0,0 +1,28 @@
+from buildpal.manager.gui_event import GUIEvent
+from buildpal.manager.metrics import Metrics
+
+def test_metrics():
+    metrics = Metrics()
+    samples = []
+    def sampler():
+        samples.append(None)
+        return len(samples)
+    metrics.register(GUIEvent.update_cache_stats, sampler)
+    seen = {}
+    assert metrics.sample(seen) == {}
+
+    # Any number of changes is sampled once.
+    for x in range(1000):
+        metrics.touch(GUIEvent.update_cache_stats)
+    metrics(GUIEvent.update_command_info, 'first')
+    metrics(GUIEvent.update_command_info, 'second')
+    assert metrics.sample(seen) == {GUIEvent.update_cache_stats: 1,
+        GUIEvent.update_command_info: 'second'}
+    assert metrics.sample(seen) == {}
+
+    metrics.touch(GUIEvent.update_cache_stats)
+    assert metrics.sample(seen) == {GUIEvent.update_cache_stats: 2}
+    # Consumers sample independently.
+    other = {}
+    assert metrics.sample(other) == {GUIEvent.update_cache_stats: 3,
+        GUIEvent.update_command_info: 'second'}
@@ -0,0 +1,105 @@
+import asyncio
+
+from buildpal.common.message import MessageStats, MemoryViewWrapper, \
+    message_type
+from buildpal.common.openmetrics import Exposition, Histogram, \
+    add_message_metrics, parse_address, start_metrics_server
+
+def test_exposition():
+    histogram = Histogram((1, 10))
+    for value in (0.5, 1, 5, 100):
+        histogram.observe(value)
+    exposition = Exposition()
+    exposition.counter('jobs_total', 'Jobs.', 3)
+    exposition.add('queued', 'gauge', 'Queued.', [({'client' : 'a"b'}, 1),
+        ({'client' : 'c'}, 0.5)])
+    exposition.histogram('duration_seconds', 'Duration.',
+        [({'node' : 'x'}, histogram)])
+    assert exposition.text().splitlines() == [
+        '# HELP buildpal_jobs_total Jobs.',
+        '# TYPE buildpal_jobs_total counter',
+        'buildpal_jobs_total 3',
+        '# HELP buildpal_queued Queued.',
+        '# TYPE buildpal_queued gauge',
+        'buildpal_queued{client="a\\"b"} 1',
+        'buildpal_queued{client="c"} 0.5',
+        '# HELP buildpal_duration_seconds Duration.',
+        '# TYPE buildpal_duration_seconds histogram',
+        'buildpal_duration_seconds_bucket{le="1.0",node="x"} 2',
+        'buildpal_duration_seconds_bucket{le="10.0",node="x"} 3',
+        'buildpal_duration_seconds_bucket{le="+Inf",node="x"} 4',
+        'buildpal_duration_seconds_sum{node="x"} 106.5',
+        'buildpal_duration_seconds_count{node="x"} 4']
+
+def test_message_stats():
+    assert message_type([b'\x00\x00\x00\x01', b'TASK_FILES', b'data']) == \
+        'TASK_FILES'
+    assert message_type([b'\x00\x00\x00\x01', b'\x01', b'data']) == 'DATA'
+    assert message_type([MemoryViewWrapper(memoryview(b'NEW_SESSION'))]) == \
+        'NEW_SESSION'
+    stats = MessageStats()
+    stats.add_sent([b'NEW_SESSION'], 21)
+    stats.add_sent([b'NEW_SESSION'], 21)
+    stats.add_received([b'\x01', b'data'], 19)
+    exposition = Exposition()
+    add_message_metrics(exposition, stats)
+    lines = exposition.text().splitlines()
+    assert 'buildpal_messages_sent_total{type="NEW_SESSION"} 2' in lines
+    assert 'buildpal_message_bytes_sent_total{type="NEW_SESSION"} 42' in lines
+    assert 'buildpal_message_bytes_received_total{type="DATA"} 19' in lines
+
+def test_metrics_server():
+    assert parse_address('9100') == ('localhost', 9100)
+    assert parse_address('0.0.0.0:9100') == ('0.0.0.0', 9100)
+    loop = asyncio.new_event_loop()
+    def collect():
+        exposition = Exposition()
+        exposition.gauge('up', 'Up.', 1)
+        return exposition
+    server = start_metrics_server(loop, ('127.0.0.1', 0), collect)
+    port = server.sockets[0].getsockname()[1]
+
+    @asyncio.coroutine
+    def get(path):
+        reader, writer = yield from asyncio.open_connection('127.0.0.1',
+            port, loop=loop)
+        writer.write('GET {} HTTP/1.1\r\nHost: localhost\r\n\r\n'.format(
+            path).encode())
+        return (yield from reader.read())
+
+    try:
+        response = loop.run_until_complete(get('/metrics'))
+        assert response.startswith(b'HTTP/1.0 200 OK\r\n')
+        assert response.endswith(b'\r\n\r\n# HELP buildpal_up Up.\n'
+            b'# TYPE buildpal_up gauge\nbuildpal_up 1\n')
+        response = loop.run_until_complete(get('/other'))
+        assert response.startswith(b'HTTP/1.0 404')
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
+
+def test_profile_endpoint():
+    from buildpal.common.sampling_profiler import SamplingProfiler
+    loop = asyncio.new_event_loop()
+    server = start_metrics_server(loop, ('127.0.0.1', 0), Exposition,
+        SamplingProfiler(interval=0.001))
+    port = server.sockets[0].getsockname()[1]
+
+    @asyncio.coroutine
+    def get(path):
+        reader, writer = yield from asyncio.open_connection('127.0.0.1',
+            port, loop=loop)
+        writer.write('GET {} HTTP/1.0\r\n\r\n'.format(path).encode())
+        return (yield from reader.read())
+
+    try:
+        response = loop.run_until_complete(get('/profile?seconds=0.01'))
+        assert response.startswith(b'HTTP/1.0 200 OK\r\n')
+        assert b'MainThread;' in response
+        response = loop.run_until_complete(get('/profile?seconds=x'))
+        assert response.startswith(b'HTTP/1.0 400')
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
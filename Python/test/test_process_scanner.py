@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+
+from buildpal.common.manifest import iter_manifest
+from buildpal.manager.gui_event import GUIEvent
+from buildpal.manager.metrics import Metrics
+from buildpal.manager.process_scanner import ResultRing, ProcessSourceScanner
+from buildpal.manager.task import PreprocessContext, PreprocessTask
+
+def test_result_ring():
+    ring = ResultRing(16)
+    first = ring.write(b'a' * 10)
+    assert first == (0, 10)
+    assert ring.read(*first) == b'a' * 10
+    # Does not fit at the end, continues from the beginning.
+    second = ring.write(b'b' * 8)
+    assert second == (16, 24)
+    assert ring.read(*second) == b'b' * 8
+    assert ring.write(b'c' * 17) is None
+
+class FakeTask:
+    def __init__(self, source, context):
+        self.preprocess_task = PreprocessTask(source, context, None)
+
+    def note_time(self, *args):
+        pass
+
+def test_process_scanner(tmpdir):
+    include_dir = tmpdir.mkdir('include')
+    include_dir.join('a.h').write('')
+    include_dir.join('b.h').write('')
+    sources = []
+    for dir in ('x', 'y'):
+        source_dir = tmpdir.mkdir(dir)
+        for index in range(4):
+            source = source_dir.join('test{}.cpp'.format(index))
+            source.write('#include <a.h>\n#ifdef USE_B\n#include <b.h>\n#endif\n')
+            sources.append(str(source))
+    context = PreprocessContext(['USE_B'], [str(include_dir)], [], [])
+
+    done = []
+    all_done = threading.Event()
+    def notify(task, exception=None):
+        done.append((task, exception))
+        if len(done) == len(sources):
+            all_done.set()
+
+    metrics = Metrics()
+    with ProcessSourceScanner(notify, metrics, 2) as scanner:
+        tasks = [FakeTask(source, context) for source in sources]
+        for task in tasks:
+            scanner.add_task(task)
+        assert all_done.wait(60)
+        hits, misses, ratio = scanner.get_cache_stats()
+        assert hits + misses > 0
+        seen = {}
+        assert metrics.sample(seen)[GUIEvent.update_cache_stats] == \
+            (hits, misses, ratio)
+        assert not metrics.sample(seen)
+
+    assert all(exception is None for task, exception in done)
+    # All sources include the same headers, so they share the header set.
+    header_set = tasks[0].header_set
+    assert all(task.header_set is header_set for task in tasks)
+    assert scanner.header_sets.stats()[1:] == (len(tasks) - 1, 1)
+    headers = set(file for dir, data in header_set.headers for file,
+        content_entry in data)
+    assert headers == {'a.h', 'b.h'}
+    [(manifest_dir, manifest_files)] = iter_manifest(header_set.manifest)
+    checksums = dict(manifest_files)
+    for dir, data in header_set.headers:
+        for file, content_entry in data:
+            assert content_entry.buffer() is not None
+            assert content_entry.checksum() == checksums[file]
+    for task in tasks:
+        assert not task.local_headers
+        assert not task.missing_headers
+
+def make_sources(tmpdir, count):
+    sources = []
+    for index in range(count):
+        source = tmpdir.join('test{}.cpp'.format(index))
+        source.write('')
+        sources.append(str(source))
+    return sources
+
+class Notifications:
+    def __init__(self):
+        self.done = []
+        self.cond = threading.Condition()
+
+    def __call__(self, task, exception=None):
+        with self.cond:
+            self.done.append((task, exception))
+            self.cond.notify_all()
+
+    def wait(self, count):
+        with self.cond:
+            assert self.cond.wait_for(lambda : len(self.done) >= count, 60)
+            return list(self.done)
+
+def wait_for(predicate):
+    end = time.time() + 60
+    while not predicate():
+        assert time.time() < end
+        time.sleep(0.01)
+
+def test_result_failure(tmpdir):
+    context = PreprocessContext([], [], [], [])
+    notify = Notifications()
+    with ProcessSourceScanner(notify, Metrics(), 1) as scanner:
+        intern = scanner.header_sets.intern
+        failed = []
+        def intern_once(*args):
+            if not failed:
+                failed.append(True)
+                raise Exception('intern failed')
+            return intern(*args)
+        scanner.header_sets.intern = intern_once
+        for source in make_sources(tmpdir, 3):
+            scanner.add_task(FakeTask(source, context))
+        done = notify.wait(3)
+    assert [str(exception) for task, exception in done if exception] == \
+        ['intern failed']
+
+def test_worker_exited(tmpdir):
+    context = PreprocessContext([], [], [], [])
+    sources = make_sources(tmpdir, 4)
+    notify = Notifications()
+    with ProcessSourceScanner(notify, Metrics(), 2) as scanner:
+        scanner.workers[0].process.terminate()
+        wait_for(lambda : len(scanner.live_workers) == 1)
+        for source in sources:
+            scanner.add_task(FakeTask(source, context))
+        assert all(exception is None for task, exception in notify.wait(4))
+        assert scanner.live_workers == scanner.workers[1:]
+
+        # No worker left, tasks fail instead of waiting forever.
+        scanner.workers[1].process.terminate()
+        wait_for(lambda : not scanner.live_workers)
+        scanner.add_task(FakeTask(sources[0], context))
+        [(task, exception)] = notify.wait(5)[4:]
+        assert exception is not None
@@ -0,0 +1,48 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Thread
+
+from buildpal.common.sampling_profiler import SamplingProfiler
+
+def wait_for(event):
+    event.wait()
+
+def test_sampling_profiler():
+    stop = Event()
+    worker = Thread(target=wait_for, args=(stop,), name='Worker')
+    worker.start()
+    executor = ThreadPoolExecutor(1)
+    executor.submit(wait_for, stop)
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.add_executor('Pool', executor)
+    results = []
+    done = Event()
+    def completed(stacks):
+        results.append(stacks)
+        done.set()
+    try:
+        assert profiler.start(0.05, completed)
+        assert profiler.is_running()
+        assert not profiler.start(0.05)
+        assert done.wait(5)
+    finally:
+        stop.set()
+        worker.join()
+        executor.shutdown()
+    assert not profiler.is_running()
+    stacks = [line.rsplit(' ', 1) for line in results[0].splitlines()]
+    assert all(int(count) > 0 for stack, count in stacks)
+    worker_stacks = [stack.split(';') for stack, count in stacks if
+        stack.startswith('Worker;')]
+    assert worker_stacks
+    assert any(frame.startswith('wait_for (test_sampling_profiler.py:')
+        for stack in worker_stacks for frame in stack)
+    assert any(stack.startswith('Pool;') for stack, count in stacks)
+    assert not any(stack.startswith('Profiler;') for stack, count in stacks)
+
+def test_stop():
+    profiler = SamplingProfiler()
+    done = Event()
+    assert profiler.start(60, lambda stacks : done.set())
+    profiler.stop()
+    assert done.wait(5)
+    assert not profiler.is_running()
@@ -0,0 +1,38 @@
+import os
+
+from buildpal.server.sandbox import DiskSandbox, MemorySandbox, create_sandbox
+
+def test_disk_sandbox(tmpdir):
+    sandbox = create_sandbox(str(tmpdir))
+    assert isinstance(sandbox, DiskSandbox)
+    filename = sandbox.create_file(1, b'asdf')
+    assert os.path.dirname(filename) == sandbox.session_dir(1)
+    with open(filename, 'rb') as file:
+        assert file.read() == b'asdf'
+    sandbox.release(1)
+    assert not os.path.exists(filename)
+
+def test_memory_sandbox_fallback(tmpdir):
+    scratch_dir = str(tmpdir.mkdir('scratch'))
+    memory_dir = str(tmpdir.mkdir('memory'))
+    sandbox = create_sandbox(scratch_dir, memory_dir, 8)
+    assert isinstance(sandbox, MemorySandbox)
+    in_memory = sandbox.create_file(1, b'a' * 8)
+    on_disk = sandbox.create_file(1, b'b' * 8)
+    assert in_memory.startswith(sandbox.memory_dir)
+    assert on_disk.startswith(scratch_dir)
+    assert sandbox.stats()['used'] == 8
+    # Artifacts are not accounted for, keep them out of memory.
+    assert sandbox.artifact_dir(1).startswith(scratch_dir)
+
+    # Session created while budget is exhausted.
+    sandbox.create_file(2, b'c' * 3)
+    assert sandbox.session_dir(2).startswith(scratch_dir)
+
+    sandbox.release(1)
+    sandbox.release(2)
+    assert sandbox.stats()['used'] == 0
+    assert not os.path.exists(in_memory)
+    assert not os.path.exists(on_disk)
+    sandbox.close()
+    assert not os.path.exists(sandbox.memory_dir)
@@ -0,0 +1,24 @@
+from buildpal.manager.scan_profile import merge_profiles, percentile, profile_rows
+
+def test_percentile():
+    assert percentile((0, 0, 0), 0.5) == 0
+    # 1 sample below 1us, 2 in [1, 2) us, 1 in [2, 4) us.
+    histogram = (1, 2, 1, 0)
+    assert percentile(histogram, 0.25) == 1
+    assert percentile(histogram, 0.5) == 2
+    assert percentile(histogram, 0.99) == 4
+
+def test_merge_profiles():
+    first = {'lexing' : (2, 1.0, (1, 1, 0)), 'file_read' : (1, 0.5, (0, 0, 1))}
+    second = {'lexing' : (1, 2.0, (0, 0, 1))}
+    merged = merge_profiles([first, second])
+    assert merged == {'lexing' : (3, 3.0, (1, 1, 1)),
+        'file_read' : (1, 0.5, (0, 0, 1))}
+    assert merge_profiles([]) == {}
+
+def test_profile_rows():
+    profile = {'lexing' : (2, 3.0, (0, 2, 0)), 'file_read' : (1, 1.0, (0, 0, 1))}
+    rows = profile_rows(profile)
+    assert [row[0] for row in rows] == ['lexing', 'file_read']
+    phase, count, seconds, share, median, p99 = rows[0]
+    assert (count, seconds, share, median, p99) == (2, 3.0, 0.75, 2, 2)
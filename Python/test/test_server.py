@@ -30,6 +30,35 @@ def test_remote_reset(run_server):
     run_server.join(1)
     assert run_server.is_alive()
 
+def request_reply(request):
+    import socket
+    import struct
+    from buildpal.common.message import msg_from_bytes
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.connect(('127.0.0.1', SRV_PORT))
+        for buffer in msg_to_bytes(request):
+            sock.send(buffer)
+        data = b''
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+            if len(data) >= 4 and len(data) >= 4 + struct.unpack('!I',
+                    data[:4])[0]:
+                break
+    return list(msg_from_bytes(memoryview(data)[4:]))
+
+def test_remote_profile(run_server):
+    import struct
+    msg = request_reply([b'PROFILE', struct.pack('!I', 0)])
+    assert msg[0] == b'PROFILE'
+    assert b'MainThread;' in msg[1].tobytes()
+
+def test_remote_profile_malformed(run_server):
+    msg = request_reply([b'PROFILE', b'x'])
+    assert msg[0] == b'PROFILE_ERROR'
+
 def test_remote_shutdown(run_server):
     import socket
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -57,6 +57,7 @@ class Environment:
         filename = self.full_path(filename)
         statinfo = os.stat(filename)
         os.utime(filename, times=(statinfo.st_atime, statinfo.st_mtime + 1))
+        preprocessing.revalidate_content_cache()
 
 @pytest.fixture(params=["run_withcache", "run_nocache"])
 def env(request, tmpdir):
@@ -266,4 +267,295 @@ def test_empty_directive(env):
 #include "header.h"
 ''')
 
-    assert 'header.h' in env.run('test.cpp')
\ No newline at end of file
+    assert 'header.h' in env.run('test.cpp')
+
+def test_cache_snapshot(tmpdir):
+    env = Environment(tmpdir)
+    env.make_file('xxx.h')
+    env.make_file('yyy.h')
+    env.make_file('a.h', '''\
+#ifndef A_H
+#define A_H
+#include "xxx.h"
+#endif
+''')
+    env.make_file('test.cpp', '''\
+#define A_H_INCLUDE "a.h"
+#include A_H_INCLUDE
+''')
+    snapshot = os.path.join(env.dir, 'cache.bin')
+
+    def scan(cache):
+        preprocessor = preprocessing.Preprocessor(cache)
+        ppc = preprocessing.PreprocessingContext()
+        header_data, missing = preprocessor.scan_headers(ppc,
+            env.full_path('test.cpp'))
+        return set(x[0] for dir, headers in header_data for x in headers)
+
+    cache = preprocessing.Cache()
+    assert scan(cache) == {'a.h', 'xxx.h'}
+    saved = cache.save_snapshot(snapshot)
+    assert saved > 0
+
+    # Simulate manager restart.
+    preprocessing.clear_content_cache()
+    cache = preprocessing.Cache()
+    assert cache.load_snapshot(snapshot) == saved
+    assert scan(cache) == {'a.h', 'xxx.h'}
+    loaded, restored, rejected = cache.get_snapshot_stats()
+    assert restored > 0
+    assert rejected == 0
+
+    # Stale entries must not be used.
+    env.make_file('a.h', '''\
+#ifndef A_H
+#define A_H
+#include "yyy.h"
+#endif
+''')
+    env.touch('a.h')
+    preprocessing.clear_content_cache()
+    cache = preprocessing.Cache()
+    cache.load_snapshot(snapshot)
+    assert scan(cache) == {'a.h', 'yyy.h'}
+    loaded, restored, rejected = cache.get_snapshot_stats()
+    assert rejected > 0
+
+    # Unusable snapshot is ignored.
+    env.make_file('garbage.bin', b'garbage')
+    assert preprocessing.Cache().load_snapshot(env.full_path('garbage.bin')) == 0
+
+def test_cache_revalidation(tmpdir):
+    env = Environment(tmpdir)
+    env.make_file('xxx.h')
+    env.make_file('yyy.h')
+    env.make_file('a.h', '''\
+#include "xxx.h"
+''')
+    env.make_file('b.h', '''\
+#include "a.h"
+''')
+    env.make_file('test.cpp', '''\
+#define B_H_INCLUDE "b.h"
+#include B_H_INCLUDE
+''')
+
+    # Same cache is used for all scans, as in a long running manager.
+    cache = preprocessing.Cache()
+    def scan():
+        preprocessor = preprocessing.Preprocessor(cache)
+        ppc = preprocessing.PreprocessingContext()
+        header_data, missing = preprocessor.scan_headers(ppc,
+            env.full_path('test.cpp'))
+        return set(x[0] for dir, headers in header_data for x in headers)
+
+    assert scan() == {'a.h', 'b.h', 'xxx.h'}
+    assert scan() == {'a.h', 'b.h', 'xxx.h'}
+    hits, misses = cache.get_stats()[:2]
+    assert hits > 0
+
+    # Change is noticed in the next generation.
+    env.make_file('a.h', '''\
+#include "yyy.h"
+''')
+    env.touch('a.h')
+    assert scan() == {'a.h', 'b.h', 'yyy.h'}
+    generation, invalidated = preprocessing.content_cache_stats()
+    assert invalidated > 0
+
+    assert not preprocessing.invalidate_content(env.full_path('missing.h'))
+
+def test_scan_headers_batch(tmpdir):
+    env = Environment(tmpdir)
+    env.make_file('include/a.h')
+    env.make_file('include/b.h')
+    env.make_file('test1.cpp', '''\
+#include <a.h>
+''')
+    env.make_file('test2.cpp', '''\
+#ifdef USE_B
+#include <b.h>
+#endif
+''')
+    preprocessor = preprocessing.Preprocessor(preprocessing.Cache())
+    ppc = preprocessing.PreprocessingContext()
+    ppc.add_include_path(env.full_path('include'), False)
+    ppc.add_macro('USE_B', '1')
+    filenames = [env.full_path('test1.cpp'), env.full_path('test2.cpp'),
+        env.full_path('missing.cpp')]
+
+    # Context must be frozen before it can be shared.
+    with pytest.raises(Exception):
+        preprocessor.scan_headers_batch(ppc, filenames)
+    ppc.freeze()
+    assert ppc.frozen()
+    with pytest.raises(Exception):
+        ppc.add_macro('X', '1')
+
+    def headers(result):
+        header_data, missing = result
+        return set(x[0] for dir, headers in header_data for x in headers)
+
+    results = preprocessor.scan_headers_batch(ppc, filenames)
+    assert len(results) == 3
+    assert headers(results[0]) == {'a.h'}
+    assert headers(results[1]) == {'b.h'}
+    assert isinstance(results[2], Exception)
+
+    delivered = []
+    def callback(index, result):
+        delivered.append((index, result))
+    assert preprocessor.scan_headers_batch(ppc, filenames, callback) is None
+    assert [index for index, result in delivered] == [0, 1, 2]
+    assert headers(delivered[0][1]) == {'a.h'}
+    assert headers(delivered[1][1]) == {'b.h'}
+    assert isinstance(delivered[2][1], Exception)
+
+def test_manifest(tmpdir):
+    from buildpal.common.manifest import iter_manifest
+    env = Environment(tmpdir)
+    env.make_file('include/a.h')
+    env.make_file('include/b.h', '#include "c.h"\n')
+    env.make_file('include/c.h')
+    env.make_file('test.cpp', '''\
+#include "rel.h"
+#include <a.h>
+#include <b.h>
+''')
+    env.make_file('rel.h')
+    preprocessor = preprocessing.Preprocessor(preprocessing.Cache())
+    ppc = preprocessing.PreprocessingContext()
+    ppc.add_include_path(env.full_path('include'), False)
+    header_data, missing, manifest = preprocessor.scan_headers(ppc,
+        env.full_path('test.cpp'), manifest=True)
+    expected = {(dir, file) : content_entry.checksum() for dir, headers in
+        header_data for file, relative, content_entry in headers if not
+        relative}
+    assert {(dir, file) : checksum for dir, files in iter_manifest(manifest)
+        for file, checksum in files} == expected
+    shared = {file for dir, file in expected}
+    assert {'a.h', 'b.h'} <= shared
+    assert 'rel.h' not in shared
+
+def test_scan_result_cache(tmpdir):
+    from buildpal.manager.header_sets import HeaderSetRegistry
+    from buildpal.manager.scan_result_cache import ScanResultCache
+    from buildpal.manager.source_scanner import create_preprocessing_context
+    from buildpal.manager.task import PreprocessContext, PreprocessTask
+    env = Environment(tmpdir)
+    env.make_file('include/a.h')
+    env.make_file('test.cpp', '''\
+#include "rel.h"
+#include <a.h>
+''')
+    env.make_file('rel.h')
+    context = PreprocessContext([], [env.full_path('include')], [], [])
+    task = PreprocessTask(env.full_path('test.cpp'), context, None)
+    ppc = create_preprocessing_context(context.include_dirs,
+        context.sysinclude_dirs, context.forced_includes, context.macros)
+    registry = HeaderSetRegistry()
+    cache = ScanResultCache()
+
+    def scan():
+        key, result = cache.lookup(task)
+        if result is not None:
+            return result
+        preprocessor = preprocessing.Preprocessor(preprocessing.Cache())
+        header_data, missing, manifest = preprocessor.scan_headers(
+            ppc, task.source, manifest=True)
+        header_set, local_headers = registry.intern(header_data, manifest)
+        cache.store(key, header_set, local_headers, missing)
+        return None
+
+    assert scan() is None
+    assert scan() is not None
+    assert cache.stats()[:2] == (1, 1)
+
+    # Changed shared header.
+    env.make_file('include/a.h', '#define X\n')
+    env.touch('include/a.h')
+    assert scan() is None
+    assert scan() is not None
+
+    # Changed local header.
+    env.make_file('rel.h', '#define Y\n')
+    env.touch('rel.h')
+    assert scan() is None
+    assert scan() is not None
+    assert cache.stats()[:2] == (3, 3)
+
+def test_profile(tmpdir):
+    env = Environment(tmpdir)
+    env.make_file('include/a.h', '#define A 1\n')
+    env.make_file('test.cpp', '''\
+#include <a.h>
+''')
+    preprocessing.reset_profile()
+    preprocessor = preprocessing.Preprocessor(preprocessing.Cache())
+    ppc = preprocessing.PreprocessingContext()
+    ppc.add_include_path(env.full_path('include'), False)
+    preprocessor.scan_headers(ppc, env.full_path('test.cpp'))
+    profile = preprocessing.get_profile()
+    assert set(profile) == {'file_read', 'lexing', 'cache_lookup',
+        'content_lock_wait', 'generate_content'}
+    for phase in ('file_read', 'lexing', 'content_lock_wait'):
+        count, seconds, histogram = profile[phase]
+        assert count > 0
+        assert sum(histogram) == count
+    preprocessing.reset_profile()
+    assert all(count == 0 for count, seconds, histogram in
+        preprocessing.get_profile().values())
+
+def test_cache_memory_budget(tmpdir):
+    env = Environment(tmpdir)
+    sources = []
+    for index in range(64):
+        env.make_file('include/h{}.h'.format(index),
+            '#define H{0} {0}\n'.format(index))
+        env.make_file('test{}.cpp'.format(index),
+            '#include <h{}.h>\n'.format(index))
+        sources.append(env.full_path('test{}.cpp'.format(index)))
+    ppc = preprocessing.PreprocessingContext()
+    ppc.add_include_path(env.full_path('include'), False)
+
+    def fill(cache):
+        preprocessor = preprocessing.Preprocessor(cache)
+        for source in sources:
+            preprocessor.scan_headers(ppc, source)
+        return cache.get_stats()
+
+    unlimited = fill(preprocessing.Cache())
+    assert unlimited[2] > 0
+    assert unlimited[3] == 0
+    budget = unlimited[2] // 4
+    limited = fill(preprocessing.Cache(memory_budget=budget))
+    assert limited[3] > 0
+    assert limited[2] < unlimited[2]
+
+def test_mapped_content(tmpdir):
+    env = Environment(tmpdir)
+    # Large enough for LLVM to actually map it.
+    content = b'#define X 1\n' * 4096
+    env.make_file('include/big.h', content)
+    env.make_file('test.cpp', '#include <big.h>\n')
+    filename = env.full_path('include/big.h')
+
+    def read(map_threshold):
+        preprocessing.clear_content_cache()
+        preprocessing.set_map_threshold(map_threshold)
+        try:
+            entry = preprocessing.get_content_entry(filename)
+            preprocessor = preprocessing.Preprocessor(preprocessing.Cache())
+            ppc = preprocessing.PreprocessingContext()
+            ppc.add_include_path(env.full_path('include'), False)
+            header_data, missing = preprocessor.scan_headers(ppc,
+                env.full_path('test.cpp'))
+            headers = set(x[0] for dir, headers in header_data for x in headers)
+            return bytes(entry.buffer()), entry.checksum(), headers
+        finally:
+            preprocessing.set_map_threshold(0)
+            preprocessing.clear_content_cache()
+
+    assert read(0) == read(1024)
+    assert read(1024)[0] == content
+    assert read(1024)[2] == {'big.h'}
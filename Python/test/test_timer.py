@@ -0,0 +1,20 @@
+from buildpal.common import Timer
+
+def test_timer():
+    first = Timer()
+    second = Timer()
+    for timer in (first, second):
+        timer.note_time('created')
+        timer.note_time('started', 'waiting')
+        timer.note_time('completed', 'running')
+    assert first.time_point_names() == ('created', 'started', 'completed')
+    # Timers with the same time points share the names.
+    assert first.time_point_names() is second.time_point_names()
+    assert [ord for ord, (name, time) in first.time_points()] == [0, 1, 2]
+    durations = list(first.time_durations())
+    assert [(ord, name) for ord, (name, duration) in durations] == \
+        [(0, 'waiting'), (1, 'running')]
+    assert all(duration >= 0 for ord, (name, duration) in durations)
+    assert Timer.event_id('started', 'waiting') == \
+        Timer.event_id('started', 'waiting')
+    assert not hasattr(first, '__dict__')
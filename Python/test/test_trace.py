@@ -0,0 +1,122 @@
+import json
+
+from array import array
+from io import StringIO
+
+from buildpal.manager.compile_session import SessionResult
+from buildpal.manager.database import Database
+from buildpal.manager.trace import ClockOffset, chrome_trace, \
+    session_spans, task_spans, write_chrome_trace
+
+def test_clock_offset():
+    clock_offset = ClockOffset(window=2)
+    assert clock_offset.estimate() is None
+    # Server clock is 100s ahead, request took 1s and reply 3s.
+    clock_offset.add_sample(0, 101, 102, 5)
+    assert clock_offset.estimate() == (99, 4)
+    # Symmetric, shorter round trip wins.
+    clock_offset.add_sample(10, 110.5, 111, 11.5)
+    assert clock_offset.estimate() == (100, 1)
+    # Samples out of the window are forgotten.
+    clock_offset.add_sample(20, 121, 122, 25)
+    clock_offset.add_sample(30, 131, 132, 35)
+    assert clock_offset.estimate() == (99, 4)
+
+def make_session(started, hostname='server'):
+    return {
+        'hostname': hostname,
+        'port': '1234',
+        'started': started,
+        'responded': started + 0.2,
+        'result_received': started + 3,
+        'completed': started + 3.5,
+        'result': SessionResult.success,
+        'clock_offset': 100.0,
+        'server_times': (('session created', 'received task',
+            'determined missing files', 'received missing headers',
+            'include dir ready', 'ready for compile', 'compile slot acquired',
+            'compilation done'), array('d', [started + x for x in
+            (0.1, 0.1, 0.1, 0.3, 0.4, 0.5, 1, 2.9)]))}
+
+def make_task(started, source='a.cpp', sessions=None):
+    return {
+        'source': source,
+        'sessions': sessions or [],
+        'times': (('queued for preprocessing', 'dequeued by preprocessor',
+            'preprocessed', 'assigned to a server session',
+            'completed notification', 'session successful'), array('d',
+            [started + x for x in (0, 0.5, 1, 1.5, 4.5, 5)]))}
+
+def test_task_spans():
+    spans = task_spans(make_task(10))
+    assert [(span.name, span.start, span.end) for span in spans] == [
+        ('a.cpp', 10, 15),
+        ('wait for preprocessor', 10, 10.5),
+        ('preprocess', 10.5, 11),
+        ('wait for session', 11, 11.5),
+        ('remote', 11.5, 14.5),
+        ('download', 14.5, 15)]
+
+def test_session_spans():
+    spans = session_spans(make_session(10), 'a.cpp')
+    assert spans[0].args == {'source': 'a.cpp', 'result': 'success',
+        'clock offset': 100.0}
+    assert [(span.name, span.category, round(span.start, 3),
+        round(span.end, 3)) for span in spans] == [
+        ('a.cpp', 'session', 10, 13.5),
+        ('request', 'network', 10, 10.1),
+        ('missing files', 'server', 10.1, 10.1),
+        ('reply', 'network', 10.1, 10.2),
+        ('upload', 'network', 10.2, 10.3),
+        ('prepare', 'server', 10.3, 10.5),
+        ('server queue', 'queue', 10.5, 11),
+        ('compile', 'compile', 11, 12.9),
+        ('reply', 'network', 12.9, 13),
+        ('download', 'network', 13, 13.5)]
+
+    # Session refused by the server.
+    spans = session_spans({'hostname': 'server', 'port': '1234',
+        'started': 10, 'completed': 10.1, 'result': SessionResult.busy},
+        'a.cpp')
+    assert [span.name for span in spans] == ['a.cpp', 'download']
+
+def test_chrome_trace():
+    commands = [{'command': 'a.cpp', 'started': 9, 'completed': 16, 'tasks':
+        [make_task(10, sessions=[make_session(11.5)])]},
+        {'command': 'b.cpp', 'started': 10, 'completed': 17, 'tasks':
+        [make_task(11, 'b.cpp', sessions=[make_session(12.5)])]},
+        {'command': 'c.cpp', 'started': 20, 'completed': 27, 'tasks': []}]
+    trace = json.loads(json.dumps(chrome_trace(commands)))
+    processes = {event['args']['name'] : event['pid'] for event in
+        trace['traceEvents'] if event['ph'] == 'M'}
+    assert set(processes) == {'commands', 'manager', 'server:1234'}
+    outer = [(event['name'], event['pid'], event['tid'], event['ts'],
+        event['dur']) for event in trace['traceEvents'] if event['ph'] ==
+        'X' and event['cat'] in ('command', 'task', 'session')]
+    assert sorted(outer, key=lambda event : event[3]) == [
+        ('a.cpp', processes['commands'], 1, 0, 7000000),
+        ('a.cpp', processes['manager'], 1, 1000000, 5000000),
+        # Overlapping spans go to separate threads, threads are reused.
+        ('b.cpp', processes['commands'], 2, 1000000, 7000000),
+        ('b.cpp', processes['manager'], 2, 2000000, 5000000),
+        ('a.cpp', processes['server:1234'], 1, 2500000, 3500000),
+        ('b.cpp', processes['server:1234'], 2, 3500000, 3500000),
+        ('c.cpp', processes['commands'], 1, 11000000, 7000000)]
+    assert chrome_trace([]) == {'traceEvents': [], 'displayTimeUnit': 'ms'}
+
+def test_write_chrome_trace():
+    db = Database()
+    conn = db.get_connection()
+    db.create_structure(conn)
+    command = {'command': 'a.cpp', 'started': 9, 'completed': 16,
+        'tasks': [make_task(10, sessions=[make_session(11.5)])]}
+    with conn:
+        first, = db.insert_commands(conn, [command])[0]
+        assert db.get_command(conn, first) == command
+        second = db.insert_command(conn, dict(command, command='b.cpp'))
+        assert db.command_ids(conn) == [first, second]
+        file = StringIO()
+        write_chrome_trace(file, db, conn, second)
+    trace = json.loads(file.getvalue())
+    assert {event['name'] for event in trace['traceEvents'] if event.get('cat')
+        == 'command'} == {'b.cpp'}
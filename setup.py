@@ -185,6 +185,7 @@ setup(name = 'buildpal',
                 'Extensions/HeaderScanner/headerTracker_.cpp',
                 'Extensions/HeaderScanner/macroState_.cpp',
                 'Extensions/HeaderScanner/naivePreprocessor_.cpp',
+                'Extensions/HeaderScanner/profile_.cpp',
                 'Extensions/HeaderScanner/pythonBindings_.cpp',
                 'Extensions/HeaderScanner/utility_.cpp',
             ]